@@ -1,4 +1,5 @@
-from collections.abc import Generator
+import uuid
+from collections.abc import AsyncGenerator
 from typing import Annotated
 
 import jwt
@@ -6,28 +7,32 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app import crud
 from app.core import security
 from app.core.config import settings
-from app.core.db import engine
-from app.models import TokenPayload, User
+from app.core.db import async_engine
+from app.models import Course, TokenPayload, User
+from app.services import membership_service, user_cache_service
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
 
 
-def get_db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    # Objects are not expired on commit so they can still be serialised after the
+    # request commits without triggering an implicit (sync) refresh
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
         yield session
 
 
-SessionDep = Annotated[Session, Depends(get_db)]
+SessionDep = Annotated[AsyncSession, Depends(get_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> User:
+async def get_current_user(session: SessionDep, token: TokenDep) -> User:
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
@@ -38,7 +43,7 @@ def get_current_user(session: SessionDep, token: TokenDep) -> User:
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = session.get(User, token_data.sub)
+    user = await user_cache_service.get_user(session, token_data.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     # if not user.is_active:
@@ -60,4 +65,16 @@ def get_current_active_superuser(current_user: CurrentUser) -> User:
         raise HTTPException(
             status_code=403, detail="The user doesn't have enough privileges"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_member_course(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Course:
+    """Course of the path, only if the current user is enrolled in it or is an admin."""
+    course = await crud.course.get_course(session=session, id=course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=course.id, user_niub=current_user.niub):
+        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
+    return course
+
+
+MemberCourse = Annotated[Course, Depends(get_member_course)]
@@ -1,45 +1,72 @@
+import logging
+import posixpath
+import uuid
+from collections.abc import Sequence
 from datetime import datetime
 from io import BytesIO
-import uuid
 from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, logger
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
 from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from sqlmodel import col, delete, func, select, desc, update
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import desc, func, select
+from sqlmodel.sql.expression import Select, SelectOfScalar
 
 from app import crud
 from app.api.deps import (
     CurrentUser,
+    MemberCourse,
     SessionDep,
     get_current_active_superuser,
-    get_current_teacher
+    get_current_teacher,
 )
 from app.core.config import settings
-from app.core.security import get_password_hash, verify_password
 from app.models import (
-    Message,
     Course,
-    CoursePublic,
     CourseCreate,
-    CourseUpdate,
-    CoursePublicWithUsersAndPractices,
-    CoursePublicWithUsers,
+    CoursePublic,
     CoursePublicWithPractices,
+    CoursePublicWithRoster,
+    CoursePublicWithUsers,
+    CoursePublicWithUsersAndPractices,
+    CourseRosterSync,
     CoursesPublic,
     CoursesUsersLink,
+    CourseUpdate,
+    GradebookFormatEnum,
+    Message,
     Practice,
-    PracticesUsersLink,
     PracticePublic,
+    PracticesStatisticsPublic,
+    PracticesUsersLink,
+    RosterRowReport,
+    RosterRowStatusEnum,
     StatusEnum,
-    UserPublic
+    User,
+    UserPublic,
+)
+from app.services import (
+    count_service,
+    enrollment_service,
+    etag_service,
+    gradebook_service,
+    membership_service,
+    pagination_service,
+    roster_service,
+    search_service,
+    sftp_service,
+    statistics_service,
 )
-import pandas as pd
-import os
-import logging
-from app.services import sftp_service
 from app.utils import format_directory_name
-import posixpath
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -47,136 +74,202 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("/", dependencies=[Depends(get_current_active_superuser)], response_model=CoursesPublic)
-def read_courses(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+async def read_courses(
+    session: SessionDep,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    include_count: bool = True,
+    estimate: bool = False
+) -> Any:
     """
     Retrieve courses.
     """
-    count_statement = select(func.count()).select_from(Course)
-    count = session.exec(count_statement).one()
+    count = None
+    if estimate:
+        count = await count_service.estimate(session, Course)
+    elif include_count:
+        count_statement = select(func.count()).select_from(Course)
+        count = await count_service.count(session, count_statement)
 
-    statement = select(Course).offset(skip).limit(limit)
-    courses = session.exec(statement).all()
+    courses, next_cursor = await pagination_service.paginate(
+        session, select(Course), keys=[Course.id], skip=skip, limit=limit, cursor=cursor
+    )
 
-    return CoursesPublic(data=courses, count=count)
+    return CoursesPublic(data=courses, count=count, next_cursor=next_cursor)
 
 @router.get("/search", response_model=CoursesPublic)
-def search_courses(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100, search: str = None) -> Any:
+async def search_courses(
+    session: SessionDep,
+    current_user: CurrentUser,
+    skip: int = 0,
+    limit: int = 100,
+    search: str = None,
+    cursor: str | None = None,
+    include_count: bool = True
+) -> Any:
     """
     Retrieve only student users with optional search functionality.
     """
 
-    if not current_user.is_admin: 
-        base_query = select(Course).where(Course.users.contains(current_user))
-    else: 
-        base_query = select(Course)
-    
-    if search:
-        search_term = f"%{search}%"
-        base_query = base_query.where(
-            (Course.name.ilike(search_term)) |
-            (Course.description.ilike(search_term))
+    base_query, rank = select_searched_courses(current_user, search)
+
+    count = None
+    if include_count:
+        count_query = select(func.count()).select_from(
+            base_query.subquery()
         )
-    
-    count_query = select(func.count()).select_from(
-        base_query.subquery()
+        count = await count_service.count(session, count_query)
+
+    courses, next_cursor = await pagination_service.paginate(
+        session, base_query, keys=[Course.id], skip=skip, limit=limit, cursor=cursor, rank=rank
     )
-    count = session.exec(count_query).one()
-    
-    courses_query = base_query.offset(skip).limit(limit)
-    courses = session.exec(courses_query).all()
-    
-    return CoursesPublic(data=courses, count=count)
-
-def enrich_courses_with_practice_stats(session: SessionDep, user_niub: str, courses: list[Course]) -> list[CoursePublic]:
-    result: list[CoursePublic] = []
 
-    for course in courses:
-        # Count total practices for this course
-        total_practices_count = len(course.practices)
-
-        # Count corrected practices for this user in this course
-        # Practices are considered corrected if status is CORRECTED
-        corrected_practices_count = session.exec(
-            select(func.count())
-            .select_from(Practice)
-            .join(PracticesUsersLink, Practice.id == PracticesUsersLink.practice_id)
-            .where(
-                Practice.course_id == course.id,
-                PracticesUsersLink.user_niub == user_niub,
-                PracticesUsersLink.status == StatusEnum.CORRECTED
-            )
-        ).one()
+    return CoursesPublic(data=courses, count=count, next_cursor=next_cursor)
 
-        course_user = session.exec(select(CoursesUsersLink).where(
-            CoursesUsersLink.user_niub == user_niub,
-            CoursesUsersLink.course_id == course.id
-        )).first()
+def select_searched_courses(user: User, search: str | None) -> tuple[SelectOfScalar, ColumnElement[float] | None]:
+    """
+        Select the courses a user can search, matching the search term when given
+        :param user: user searching
+        :param search: text typed by the user
+        :return: select statement of the courses and their relevance, None without search term
+    """
+    statement = select(Course)
+    if not user.is_admin:
+        statement = statement.where(Course.users.contains(user))
+
+    rank = None
+    if search:
+        condition, rank = search_service.search(search, columns=[Course.name, Course.description])
+        statement = statement.where(condition)
+
+    return statement, rank
+
+def select_courses_with_progress(user_niub: str) -> Select:
+    """
+        Select courses together with the progress of a user, computed by the database
+        :param user_niub: niub of the user whose progress is computed
+        :return: select statement yielding (Course, total, corrected, last_access) rows
+    """
+    # Each aggregate is correlated only to Course, so callers can join CoursesUsersLink without altering them
+    total_practices = select(func.count(Practice.id)).where(
+        Practice.course_id == Course.id
+    ).correlate(Course).scalar_subquery()
 
+    corrected_practices = select(func.count()).select_from(PracticesUsersLink).join(Practice).where(
+        Practice.course_id == Course.id,
+        PracticesUsersLink.user_niub == user_niub,
+        PracticesUsersLink.status == StatusEnum.CORRECTED
+    ).correlate(Course).scalar_subquery()
+
+    last_access = select(CoursesUsersLink.last_access).where(
+        CoursesUsersLink.course_id == Course.id,
+        CoursesUsersLink.user_niub == user_niub
+    ).correlate(Course).scalar_subquery()
+
+    return select(Course, total_practices, corrected_practices, last_access)
+
+def select_my_courses(user: User) -> Select:
+    """
+        Select the courses of a user with their progress, every course for admins
+        :param user: user requesting them
+        :return: select statement of select_courses_with_progress rows
+    """
+    statement = select_courses_with_progress(user.niub)
+    if not user.is_admin:
+        statement = statement.where(Course.users.contains(user))
+    return statement
+
+def select_recent_courses(user_niub: str) -> Select:
+    """
+        Select the courses a user has accessed with their progress, most recently accessed first
+        :param user_niub: niub of the user
+        :return: select statement of select_courses_with_progress rows
+    """
+    return select_courses_with_progress(user_niub).join(CoursesUsersLink).where(
+        CoursesUsersLink.user_niub == user_niub,
+        CoursesUsersLink.last_access.is_not(None)
+    ).order_by(desc(CoursesUsersLink.last_access))
+
+def build_courses_with_progress(rows: Sequence[tuple]) -> list[CoursePublic]:
+    """
+        Build the public courses from the rows of select_courses_with_progress
+        :param rows: rows returned by the database
+        :return: list of public courses
+    """
+    result: list[CoursePublic] = []
+
+    for course, total_practices, corrected_practices, last_access in rows:
         course_response = CoursePublic.model_validate(course)
-        course_response.total_practices = total_practices_count
-        course_response.corrected_practices = corrected_practices_count
-        course_response.last_access = course_user.last_access if course_user else None
+        course_response.total_practices = total_practices
+        course_response.corrected_practices = corrected_practices
+        course_response.last_access = last_access
 
         result.append(course_response)
 
     return result
 
 @router.get("/me", response_model=CoursesPublic)
-def read_my_courses(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100) -> Any:
+async def read_my_courses(
+    request: Request,
+    response: Response,
+    session: SessionDep,
+    current_user: CurrentUser,
+    skip: int = 0,
+    limit: int = 100
+) -> Any:
     """
     Retrieve courses of the current user.
     """
-    if current_user.is_admin: count_statement = select(func.count()).select_from(Course)
-    else: count_statement = select(func.count()).select_from(Course).where(Course.users.contains(current_user))
-    count = session.exec(count_statement).one()
+    etag = await etag_service.user_courses_etag(session, user=current_user, all_courses=current_user.is_admin)
+    if not_modified := etag_service.not_modified(request, response, etag):
+        return not_modified
+
+    if current_user.is_admin:
+        count_statement = select(func.count()).select_from(Course)
+    else:
+        count_statement = select(func.count()).select_from(Course).where(Course.users.contains(current_user))
+    count = await count_service.count(session, count_statement)
 
-    if current_user.is_admin: 
-        statement = select(Course).offset(skip).limit(limit)
-    else: 
-        statement = select(Course).where(Course.users.contains(current_user)).offset(skip).limit(limit)
-    
-    courses = session.exec(statement).all()
-    enriched_courses = enrich_courses_with_practice_stats(session, current_user.niub, courses)
+    statement = select_my_courses(current_user).offset(skip).limit(limit)
+    rows = (await session.exec(statement)).all()
 
-    return CoursesPublic(data=enriched_courses, count=count)
+    return CoursesPublic(data=build_courses_with_progress(rows), count=count)
 
 @router.get("/me/recent", response_model=CoursesPublic)
-def read_my_recent_courses(session: SessionDep, current_user: CurrentUser, limit: int = 5) -> Any:
+async def read_my_recent_courses(request: Request, response: Response, session: SessionDep, current_user: CurrentUser, limit: int = 5) -> Any:
     """
     Retrieve the most recently accessed courses of the current user.
     Orders by last_access timestamp (newest first) and limits to the specified count.
-    
+
     - By default, only returns courses with non-null last_access values.
     """
+    etag = await etag_service.user_courses_etag(session, user=current_user)
+    if not_modified := etag_service.not_modified(request, response, etag):
+        return not_modified
 
-    statement = select(Course).join(CoursesUsersLink).where(
-        CoursesUsersLink.user_niub == current_user.niub,
-        CoursesUsersLink.last_access.is_not(None)
-    ).order_by(desc(CoursesUsersLink.last_access)).limit(limit)
-    
-    courses = session.exec(statement).all()
-
-    enriched_courses = enrich_courses_with_practice_stats(session, current_user.niub, courses)
+    statement = select_recent_courses(current_user.niub).limit(limit)
+    rows = (await session.exec(statement)).all()
 
-    return CoursesPublic(data=enriched_courses, count=len(courses))
+    return CoursesPublic(data=build_courses_with_progress(rows), count=len(rows))
 
 @router.get("/{course_id}", response_model=CoursePublicWithUsersAndPractices)
-def read_course(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def read_course(request: Request, response: Response, course: MemberCourse, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Retrieve course by ID.
     """
-    course = crud.course.get_course(session=session, id=course_id)
-    if current_user not in course.users and not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
-    
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    
+    course_id = course.id
+    etag = await etag_service.course_etag(session, course_id=course_id, user=current_user)
+    if not_modified := etag_service.not_modified(request, response, etag):
+        return not_modified
+
+    await session.refresh(course, ["users"])
+
     practices_public = []
 
-    if current_user.is_admin and not current_user in course.users:
-        practices = session.exec(select(Practice).where(Practice.course_id == course_id))
-        practices_public = practices
+    if current_user.is_admin and not await membership_service.is_course_member(session, course_id=course_id, user_niub=current_user.niub):
+        practices = await session.exec(select(Practice).where(Practice.course_id == course_id))
+        practices_public = practices.all()
 
     else:
         statement = select(Practice, PracticesUsersLink).join(PracticesUsersLink).where(
@@ -184,7 +277,7 @@ def read_course(course_id: uuid.UUID, session: SessionDep, current_user: Current
             PracticesUsersLink.practice_id == Practice.id,
             Practice.course_id == course_id
         )
-        practices = session.exec(statement).all()
+        practices = (await session.exec(statement)).all()
 
         for practice, link in practices:
             practice_data = PracticePublic(
@@ -202,166 +295,172 @@ def read_course(course_id: uuid.UUID, session: SessionDep, current_user: Current
     )
 
 @router.get("/{course_id}/users", response_model=CoursePublicWithUsers)
-def read_course_users(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def read_course_users(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Retrieve users of the course by ID.
     """
-    course = crud.course.get_course(session=session, id=course_id)
-    if current_user not in course.users:
-        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
-    
+    course = await crud.course.get_course(session=session, id=course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-    
+
+    if not await membership_service.is_course_member(session, course_id=course.id, user_niub=current_user.niub):
+        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
+
+    await session.refresh(course, ["users"])
     return course
 
 @router.get("/{course_id}/teachers", response_model=list[UserPublic])
-def read_course_teachers(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def read_course_teachers(course: MemberCourse, session: SessionDep) -> Any:
     """
     Retrieve teachers of the course by ID.
     """
-    course = crud.course.get_course(session=session, id=course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-
-    if current_user not in course.users and not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
-    
-    teachers = [user for user in course.users if user.is_teacher]
+    teachers = await crud.course.get_courses_teachers(session=session, course_ids=[course.id])
 
-    return teachers
+    return teachers[course.id]
 
 @router.get("/{course_id}/practices", response_model=CoursePublicWithPractices)
-def read_course_practices(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def read_course_practices(course: MemberCourse, session: SessionDep) -> Any:
     """
     Retrieve practices of the course by ID.
     """
-    course = crud.course.get_course(session=session, id=course_id)
-    if current_user not in course.users and not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
-    
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    
+    await session.refresh(course, ["practices"])
     return course
 
-@router.post("/", dependencies=[Depends(get_current_teacher)], response_model=CoursePublic)
-async def create_course(*, session: SessionDep, course_in: CourseCreate, file: UploadFile, current_user: CurrentUser) -> Any:
+@router.get("/{course_id}/statistics", dependencies=[Depends(get_current_teacher)], response_model=PracticesStatisticsPublic)
+async def read_course_statistics(course: MemberCourse, session: SessionDep) -> Any:
     """
-    Create new course.
+    Retrieve the status counts, grades and submission timeline of every practice of the course.
     """
-    _, extension = os.path.splitext(file.filename)
+    statement = select(Practice).where(Practice.course_id == course.id).order_by(Practice.due_date, Practice.name)
+    practices = (await session.exec(statement)).all()
+
+    data = await statistics_service.get_statistics(session, practices=practices)
+    return PracticesStatisticsPublic(data=data, count=len(data))
+
+@router.get("/{course_id}/grades", dependencies=[Depends(get_current_teacher)], response_class=StreamingResponse)
+async def export_course_grades(
+    course: MemberCourse,
+    file_format: GradebookFormatEnum = Query(GradebookFormatEnum.CSV, alias="format")
+) -> Any:
+    """
+    Export the grades of every student of the course, one column per practice.
+    """
+    if file_format == GradebookFormatEnum.MOODLE:
+        raise HTTPException(status_code=400, detail="The Moodle format is only available for a single practice")
+
+    filename = f"{format_directory_name(course.name)}_qualificacions.{gradebook_service.EXTENSIONS[file_format]}"
+    return StreamingResponse(
+        gradebook_service.stream_course_gradebook(course, file_format),
+        media_type=gradebook_service.MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+async def read_roster(file: UploadFile) -> list[RosterRowReport]:
     try:
-        if extension.lower() == ".csv":
-            data = pd.read_csv(file.file)
-        elif extension.lower() in [".xlsx", ".xls"]:
-            contents = file.file.read()
-            buffer = BytesIO(contents)
-            data = pd.read_excel(buffer)
-            buffer.close()
-        else:
-            raise HTTPException(status_code=500, detail="Solo se puede subir archivos csv o excel")
-        
-        # Check if "niub" column exists in the uploaded file
-        if "niub" not in data.columns:
-            raise HTTPException(status_code=400, detail="El archivo debe contener una columna llamada 'niub'")
-    except HTTPException:
-        raise
+        return await run_in_threadpool(roster_service.parse_roster, file.file, file.filename)
+    except roster_service.RosterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error procesando archivo: {str(e)}")
 
-    course = crud.course.get_course_by_name(session=session, name=course_in.name)
-    if course and course.academic_year == course_in.academic_year:
+@router.post("/", dependencies=[Depends(get_current_teacher)], response_model=CoursePublicWithRoster)
+async def create_course(*, session: SessionDep, course_in: CourseCreate, file: UploadFile, current_user: CurrentUser) -> Any:
+    """
+    Create new course.
+    """
+    roster = await read_roster(file)
+
+    course = await crud.course.get_course_by_name(session=session, name=course_in.name, academic_year=course_in.academic_year)
+    if course:
         raise HTTPException(status_code=400, detail="The course already exists")
-    
-    def _mk_course_dir():
-        with sftp_service.sftp_client() as sftp:
+
+    try:
+        async with sftp_service.async_sftp_client() as sftp:
             p_path = posixpath.join(settings.PROFESSOR_FILES_PATH, course_in.academic_year, format_directory_name(course_in.name))
             a_path = posixpath.join(settings.STUDENT_FILES_PATH, course_in.academic_year, format_directory_name(course_in.name))
             try:
-                sftp_service.mkdir_p(sftp, p_path)
-                sftp_service.mkdir_p(sftp, a_path)
+                await sftp_service.mkdir_p(sftp, p_path)
+                await sftp_service.mkdir_p(sftp, a_path)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Error creating directories on SFTP server: {str(e)}")
-            
-    try:
-        await run_in_threadpool(_mk_course_dir)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SFTP connection error: {str(e)}")
-    
-    course = crud.course.create_course(session=session, course_create=course_in)
-    course.users.append(current_user) # Add teacher to course
-    
+
+    course = await crud.course.create_course(session=session, course_create=course_in)
+
+    rows = [report for report in roster if report.status == RosterRowStatusEnum.PENDING]
+    for report in rows:
+        if report.niub == current_user.niub:
+            report.status = RosterRowStatusEnum.ALREADY_ENROLLED
+    users = await crud.user.get_users_by_niubs(session=session, niubs=[report.niub for report in rows if report.status == RosterRowStatusEnum.PENDING])
+    await enrollment_service.enroll_course_users(session, course_id=course.id, users=[current_user, *users]) # Add teacher and students to course
+
+    found_niubs = {user.niub for user in users}
     not_found_users = []
-    for user_niub in data["niub"]:
-        user = crud.user.get_user_by_niub(session=session, niub=user_niub)
-        if user:
-            course.users.append(user)
-        else:
-            not_found_users.append(user_niub)
-        
+    for report in rows:
+        if report.niub in found_niubs:
+            report.status = RosterRowStatusEnum.ENROLLED
+        elif report.status == RosterRowStatusEnum.PENDING:
+            report.detail = "Enrolled when the user signs up"
+            not_found_users.append(report.niub)
+
     if not_found_users:
-        course.pending_niubs = ",".join(not_found_users)
+        await crud.course.add_pending_enrollments(session=session, course_id=course.id, niubs=not_found_users)
         logger.warning(f"Users not found: {not_found_users}")
 
-    session.add(course)
-    session.commit()
-    
-    return course
-    
+    await session.commit()
+    await session.refresh(course)
+
+    return CoursePublicWithRoster.model_validate(course, update={"roster": roster})
+
 @router.post("/{course_id}/students/{niub}", dependencies=[Depends(get_current_teacher)], response_model=Message)
-def add_student_by_niub(course_id: uuid.UUID, niub: str, session: SessionDep, current_user: CurrentUser) -> Any:
+async def add_student_by_niub(course_id: uuid.UUID, niub: str, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Add a student to a course using their NIUB.
     """
-    course = crud.course.get_course(session=session, id=course_id)
+    course = await crud.course.get_course(session=session, id=course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-    
-    if current_user not in course.users and not current_user.is_admin:
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=course.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="You are not authorized to modify this course")
-    
-    user = crud.user.get_user_by_niub(session=session, niub=niub)
+
+    user = await crud.user.get_user_by_niub(session=session, niub=niub)
     if not user:
         raise HTTPException(status_code=404, detail=f"User with NIUB {niub} not found")
-    
-    if user in course.users:
+
+    if await crud.course.is_course_member(session=session, course_id=course.id, user_niub=user.niub):
         raise HTTPException(status_code=400, detail=f"User with NIUB {niub} is already enrolled in this course")
-    
+
     if not user.is_student:
         raise HTTPException(status_code=400, detail=f"User with NIUB {niub} is not a student")
-    
-    course.users.append(user)
-
-    for practice in course.practices:
-        if user not in practice.users:
-            practice.users.append(user)
-            session.add(practice)
-    
-    session.add(course)
-    session.commit()
-    
+
+    await enrollment_service.enroll_course_users(session, course_id=course.id, users=[user])
+    await session.commit()
+
     return Message(message=f"Student with NIUB {niub} successfully added to the course")
 
 @router.put("/{course_id}", dependencies=[Depends(get_current_teacher)], response_model=CoursePublic)
-async def update_course(course_id: uuid.UUID, course_in: CourseUpdate, session: SessionDep, current_user: CurrentUser) -> Any:
+async def update_course(course: MemberCourse, course_in: CourseUpdate, session: SessionDep) -> Any:
     """
     Update course.
     """
-    course = crud.course.get_course(session=session, id=course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    
-    if current_user not in course.users and not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
-    
     # Check if name or academic year is being changed
     name_changed = course_in.name and course_in.name != course.name
     academic_year_changed = course_in.academic_year and course_in.academic_year != course.academic_year
-    
+
     old_course_name = course.name if name_changed else None
     old_academic_year = course.academic_year if academic_year_changed else None
 
+    if name_changed or academic_year_changed:
+        existing_course = await crud.course.get_course_by_name(
+            session=session,
+            name=course_in.name or course.name,
+            academic_year=course_in.academic_year or course.academic_year
+        )
+        if existing_course:
+            raise HTTPException(status_code=400, detail="The course already exists")
+
     # If name or academic year changed, rename directories
     if name_changed or academic_year_changed:
         try:
@@ -375,11 +474,11 @@ async def update_course(course_id: uuid.UUID, course_in: CourseUpdate, session:
             logger.error(f"Failed to rename course directories: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to rename course directories: {str(e)}")
 
-    course = crud.course.update_course(session=session, db_course=course, course_in=course_in)
+    course = await crud.course.update_course(session=session, db_course=course, course_in=course_in)
     return course
 
 @router.patch("/me/{course_id}/access", response_model=Message)
-def update_course_last_access(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def update_course_last_access(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Update the last access timestamp for a specific course of the current user.
     """
@@ -387,37 +486,32 @@ def update_course_last_access(course_id: uuid.UUID, session: SessionDep, current
         CoursesUsersLink.course_id == course_id,
         CoursesUsersLink.user_niub == current_user.niub
     )
-    course_user = session.exec(course_user).first()
+    course_user = (await session.exec(course_user)).first()
 
     if not course_user:
-        if current_user.is_admin: return Message(message="Last access not updated because you are admin")
+        if current_user.is_admin:
+            return Message(message="Last access not updated because you are admin")
         raise HTTPException(status_code=404, detail="Course not found or you don't have access to it")
 
     course_user.last_access = datetime.now()
 
     session.add(course_user)
-    session.commit()
-    session.refresh(course_user)
-    
+    await session.commit()
+    await session.refresh(course_user)
+
     return Message(message="Last access updated successfully")
 
 @router.delete("/{course_id}", dependencies=[Depends(get_current_teacher)], response_model=Message)
-async def delete_course(course_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def delete_course(course: MemberCourse, session: SessionDep) -> Any:
     """
     Delete course.
     """
-    course = crud.course.get_course(session=session, id=course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    if current_user not in course.users and not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="The user is not enrolled in the course.")
-    
     # Delete remote directories
     try:
         # Construct the paths for professor and student directories
         course_professor_path = posixpath.join(settings.PROFESSOR_FILES_PATH, course.academic_year, format_directory_name(course.name))
         course_student_path = posixpath.join(settings.STUDENT_FILES_PATH, course.academic_year, format_directory_name(course.name))
-        
+
         # Remove professor and student directories
         await sftp_service.remove_recursive_diretory(course_professor_path)
         await sftp_service.remove_recursive_diretory(course_student_path)
@@ -425,49 +519,71 @@ async def delete_course(course_id: uuid.UUID, session: SessionDep, current_user:
     except Exception as e:
         # Log the error but continue with the database deletion
         logger.error(f"Error connecting to SFTP server: {str(e)}")
-    
-    crud.course.delete_course(session=session, course=course)
-    
+
+    await crud.course.delete_course(session=session, course=course)
+
     return Message(message="Course deleted successfully")
 
 @router.delete("/{course_id}/students/{niub}", dependencies=[Depends(get_current_teacher)], response_model=Message)
-def delete_student_from_course(course_id: uuid.UUID, niub: str, session: SessionDep, current_user: CurrentUser) -> Any:
+async def delete_student_from_course(course_id: uuid.UUID, niub: str, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Remove a student from a course.
     """
-    course = crud.course.get_course(session=session, id=course_id)
+    course = await crud.course.get_course(session=session, id=course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-    
-    if current_user not in course.users and not current_user.is_admin:
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=course.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="You are not authorized to modify this course")
-    
-    student = crud.user.get_user_by_niub(session=session, niub=niub)
+
+    student = await crud.user.get_user_by_niub(session=session, niub=niub)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
-    
-    if student not in course.users:
+
+    if not await crud.course.is_course_member(session=session, course_id=course.id, user_niub=student.niub):
         raise HTTPException(status_code=404, detail="Student is not enrolled in this course")
-    
+
     if not student.is_student:
         raise HTTPException(status_code=400, detail="Only students can be removed from a course using this endpoint")
-    
-    for practice in course.practices:
-        if student in practice.users:
-            practice.users.remove(student)
-    
-    course.users.remove(student)
-
-    session.add(student)
-    session.commit()
-    
-    return Message(message=f"Student successfully removed from the course")
+
+    await enrollment_service.unenroll_course_users(session, course_id=course.id, niubs=[student.niub])
+    await session.commit()
+
+    return Message(message="Student successfully removed from the course")
+
+@router.put("/{course_id}/students", dependencies=[Depends(get_current_teacher)], response_model=CourseRosterSync)
+async def sync_course_students(course_id: uuid.UUID, file: UploadFile, session: SessionDep, current_user: CurrentUser, dry_run: bool = False) -> Any:
+    """
+    Replace the students of a course with the ones listed in a full roster.
+    With dry_run the changes are reported but not applied.
+    """
+    course = await crud.course.get_course(session=session, id=course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=course.id, user_niub=current_user.niub):
+        raise HTTPException(status_code=403, detail="You are not authorized to modify this course")
+
+    roster = await read_roster(file)
+    # An empty or unreadable roster would otherwise remove every student
+    if not any(report.status == RosterRowStatusEnum.PENDING for report in roster):
+        raise HTTPException(status_code=400, detail="El archivo no contiene ningún niub válido")
+
+    result = await roster_service.sync_course_roster(session, course_id=course.id, roster=roster)
+    if dry_run:
+        await session.rollback()
+    else:
+        await session.commit()
+
+    return result
 
 @router.get("/students-template/csv", dependencies=[Depends(get_current_teacher)])
 def get_students_template_csv() -> Any:
     """
     Get template for students in CSV.
     """
+    import pandas as pd
+
     df = pd.DataFrame(columns=["niub", "nom", "cognoms"])
 
     return Response(
@@ -481,6 +597,8 @@ def get_students_template_xlsx() -> Any:
     """
     Get template for students in XLSX.
     """
+    import pandas as pd
+
     df = pd.DataFrame(columns=["niub", "nom", "cognoms"])
 
     buffer = BytesIO()
@@ -493,4 +611,4 @@ def get_students_template_xlsx() -> Any:
         content=buffer.getvalue(),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": "attachment; filename=plantilla_alumnes.xlsx"},
-    )
\ No newline at end of file
+    )
@@ -1,18 +1,24 @@
-from datetime import datetime
+import logging
 import posixpath
-import tempfile
 import uuid
+from datetime import datetime
 from typing import Any
-import shutil
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, BackgroundTasks
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
 from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-import paramiko
-import zipstream
-from sqlmodel import col, delete, func, select
-import logging
-logger = logging.getLogger("uvicorn")
+from sqlalchemy.orm import selectinload
+from sqlmodel import and_, func, select
+from sqlmodel.sql.expression import Select
 
 from app import crud
 from app.api.deps import (
@@ -20,96 +26,164 @@ from app.api.deps import (
     SessionDep,
     get_current_active_superuser,
     get_current_teacher,
-    get_current_user
+    get_current_user,
 )
 from app.core.config import settings
 from app.models import (
+    CourseRoleEnum,
+    CoursesUsersLink,
+    GradebookFormatEnum,
     Message,
     Practice,
-    PracticePublic,
     PracticeCreate,
-    PracticeUpdate,
+    PracticeFileInfo,
+    PracticePublic,
     PracticePublicWithCourse,
     PracticePublicWithUsers,
     PracticePublicWithUsersAndCourse,
     PracticesPublic,
-    PracticesPublicWithCourse,
     PracticesPublicWithCorrection,
+    PracticesPublicWithCourse,
+    PracticeStatisticsPublic,
     PracticesUsersLink,
-    PracticeFileInfo,
-    StatusEnum
+    PracticeUpdate,
+    StatusEnum,
+)
+from app.services import (
+    archive_cache_service,
+    archive_service,
+    count_service,
+    enrollment_service,
+    etag_service,
+    gradebook_service,
+    membership_service,
+    pagination_service,
+    practice_service,
+    search_service,
+    sftp_service,
+    statistics_service,
 )
 from app.utils import clean_filename, format_directory_name
-import os
-from app.services import practice_service
-from app.services import sftp_service
+
+logger = logging.getLogger("uvicorn")
 
 router = APIRouter()
 
 @router.get("/", dependencies=[Depends(get_current_active_superuser)], response_model=PracticesPublic)
-def read_practices(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+async def read_practices(
+    session: SessionDep,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    include_count: bool = True,
+    estimate: bool = False
+) -> Any:
     """
     Retrieve practices.
     """
-    count_statement = select(func.count()).select_from(Practice)
-    count = session.exec(count_statement).one()
+    count = None
+    if estimate:
+        count = await count_service.estimate(session, Practice)
+    elif include_count:
+        count_statement = select(func.count()).select_from(Practice)
+        count = await count_service.count(session, count_statement)
 
-    statement = select(Practice).offset(skip).limit(limit)
-    practices = session.exec(statement).all()
+    practices, next_cursor = await pagination_service.paginate(
+        session, select(Practice), keys=[Practice.id], skip=skip, limit=limit, cursor=cursor
+    )
 
-    return PracticesPublic(data=practices, count=count)
+    return PracticesPublic(data=practices, count=count, next_cursor=next_cursor)
 
 @router.get("/search", response_model=PracticesPublic)
-def search_courses(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100, search: str = None) -> Any:
+async def search_courses(
+    session: SessionDep,
+    current_user: CurrentUser,
+    skip: int = 0,
+    limit: int = 100,
+    search: str = None,
+    cursor: str | None = None,
+    include_count: bool = True
+) -> Any:
     """
     Retrieve only student users with optional search functionality.
     """
 
-    if not current_user.is_admin: 
+    if not current_user.is_admin:
         base_query = select(Practice).where(Practice.users.contains(current_user))
-    else: 
+    else:
         base_query = select(Practice)
-    
+
+    rank = None
     if search:
-        search_term = f"%{search}%"
-        base_query = base_query.where(
-            (Practice.name.ilike(search_term)) |
-            (Practice.description.ilike(search_term))
+        condition, rank = search_service.search(search, columns=[Practice.name, Practice.description])
+        base_query = base_query.where(condition)
+
+    count = None
+    if include_count:
+        count_query = select(func.count()).select_from(
+            base_query.subquery()
         )
-    
-    count_query = select(func.count()).select_from(
-        base_query.subquery()
+        count = await count_service.count(session, count_query)
+
+    practices, next_cursor = await pagination_service.paginate(
+        session, base_query, keys=[Practice.id], skip=skip, limit=limit, cursor=cursor, rank=rank
+    )
+
+    return PracticesPublic(data=practices, count=count, next_cursor=next_cursor)
+
+def select_my_practices(user_niub: str) -> Select:
+    """
+        Select the practices of a user together with their submission
+        :param user_niub: niub of the user
+        :return: select statement yielding (Practice, PracticesUsersLink) rows
+    """
+    return select(Practice, PracticesUsersLink).join(PracticesUsersLink).where(
+        PracticesUsersLink.user_niub == user_niub
+    ).options(selectinload(Practice.course))
+
+def select_my_corrected_practices(user_niub: str) -> Select:
+    """
+        Select the corrected practices of a user together with their correction
+        :param user_niub: niub of the user
+        :return: select statement yielding (Practice, correction) rows
+    """
+    return select(Practice, PracticesUsersLink.correction).join(PracticesUsersLink).where(
+        PracticesUsersLink.user_niub == user_niub,
+        PracticesUsersLink.status == StatusEnum.CORRECTED
     )
-    count = session.exec(count_query).one()
-    
-    practices_query = base_query.offset(skip).limit(limit)
-    practices = session.exec(practices_query).all()
-    
-    return PracticesPublic(data=practices, count=count)
 
 @router.get("/me", response_model=PracticesPublicWithCourse)
-def read_my_practices(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100) -> Any:
+async def read_my_practices(
+    request: Request,
+    response: Response,
+    session: SessionDep,
+    current_user: CurrentUser,
+    skip: int = 0,
+    limit: int = 100
+) -> Any:
     """
     Retrieve practices of the current user.
     """
+    # The practices of a user are those of the courses they are enrolled in
+    etag = await etag_service.user_courses_etag(session, user=current_user)
+    if not_modified := etag_service.not_modified(request, response, etag):
+        return not_modified
+
     count_statement = select(func.count()).select_from(Practice).join(PracticesUsersLink).where(
         PracticesUsersLink.user_niub == current_user.niub
     )
-    count = session.exec(count_statement).one()
+    count = await count_service.count(session, count_statement)
 
-    statement = select(Practice, PracticesUsersLink).join(PracticesUsersLink).where(
-        PracticesUsersLink.user_niub == current_user.niub
-    ).offset(skip).limit(limit)
-    practices = session.exec(statement).all()
+    statement = select_my_practices(current_user.niub).offset(skip).limit(limit)
+    practices = (await session.exec(statement)).all()
+
+    course_ids = {practice.course_id for practice, _ in practices}
+    teachers = await crud.course.get_courses_teachers(session=session, course_ids=list(course_ids))
 
     practices_with_course = []
     for practice, link in practices:
-        teacher = None
-        for user in practice.users:
-            if user.is_teacher:
-                teacher = user
-                break
-        
+        teacher = next(iter(teachers[practice.course_id]), None)
+
         practice_data = PracticePublicWithCourse(
             **practice.model_dump(),
             submission_date=link.submission_date,
@@ -123,65 +197,69 @@ def read_my_practices(session: SessionDep, current_user: CurrentUser, skip: int
     return PracticesPublicWithCourse(data=practices_with_course, count=count)
 
 @router.get("/me/corrected", response_model=PracticesPublicWithCorrection)
-def read_my_corrected_practices(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100) -> Any:
+async def read_my_corrected_practices(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100) -> Any:
     """
     Retrieve corrected practices of the current user.
     """
     count_statement = select(func.count()).select_from(Practice).join(PracticesUsersLink).where(
-        PracticesUsersLink.user_niub == current_user.niub, 
+        PracticesUsersLink.user_niub == current_user.niub,
         PracticesUsersLink.status == StatusEnum.CORRECTED
     )
-    count = session.exec(count_statement).one()
+    count = await count_service.count(session, count_statement)
 
-    statement = select(Practice, PracticesUsersLink.correction).join(PracticesUsersLink).where(
-        PracticesUsersLink.user_niub == current_user.niub,
-        PracticesUsersLink.status == StatusEnum.CORRECTED
-    ).offset(skip).limit(limit)
-    practices = session.exec(statement).all()
+    statement = select_my_corrected_practices(current_user.niub).offset(skip).limit(limit)
+    practices = (await session.exec(statement)).all()
 
     return PracticesPublicWithCorrection(data=practices, count=count)
 
 @router.get("/me/uncorrected", response_model=PracticesPublic)
-def read_my_uncorrected_practices(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100) -> Any:
+async def read_my_uncorrected_practices(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 100) -> Any:
     """
     Retrieve uncorrected practices of the current user.
     """
     count_statement = select(func.count()).select_from(Practice).join(PracticesUsersLink).where(
-        PracticesUsersLink.user_niub == current_user.niub, 
+        PracticesUsersLink.user_niub == current_user.niub,
         PracticesUsersLink.status == StatusEnum.NOT_SUBMITTED
     )
-    count = session.exec(count_statement).one()
+    count = await count_service.count(session, count_statement)
 
     statement = select(Practice).join(PracticesUsersLink).where(
         PracticesUsersLink.user_niub == current_user.niub,
         PracticesUsersLink.status == StatusEnum.NOT_SUBMITTED
     ).offset(skip).limit(limit)
-    practices = session.exec(statement).all()
+    practices = (await session.exec(statement)).all()
 
     return PracticesPublic(data=practices, count=count)
 
 @router.get("/{practice_id}", response_model=PracticePublicWithUsersAndCourse)
-def read_practice(practice_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+async def read_practice(request: Request, response: Response, practice_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Retrieve practice by ID.
     """
-    practice = session.get(Practice, practice_id)
+    practice = await session.get(Practice, practice_id)
 
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
 
-    if current_user not in practice.course.users and not current_user.is_admin:
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=practice.course_id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="The user is not enrolled in the practice.")
 
+    etag = await etag_service.practice_etag(session, practice=practice, user=current_user)
+    if not_modified := etag_service.not_modified(request, response, etag):
+        return not_modified
+
+    await session.refresh(practice, ["users", "course"])
+
     link = None
     if not current_user.is_admin:
         statement = select(PracticesUsersLink).where(
             PracticesUsersLink.user_niub == current_user.niub,
             PracticesUsersLink.practice_id == practice_id
         )
-        link = session.exec(statement).first()
+        link = (await session.exec(statement)).first()
 
-    teacher = next((user for user in practice.users if user.is_teacher), None)
+    teachers = await crud.course.get_courses_teachers(session=session, course_ids=[practice.course_id])
+    teacher = next(iter(teachers[practice.course_id]), None)
 
     return PracticePublicWithUsersAndCourse(
         **practice.model_dump(),
@@ -195,25 +273,25 @@ def read_practice(practice_id: uuid.UUID, session: SessionDep, current_user: Cur
     )
 
 @router.get("/{practice_id}/users", dependencies=[Depends(get_current_user)], response_model=PracticePublicWithUsers)
-def read_practice_users(practice_id: uuid.UUID, session: SessionDep) -> Any:
+async def read_practice_users(practice_id: uuid.UUID, session: SessionDep) -> Any:
     """
     Retrieve practice users.
     """
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.users)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     return practice
 
 @router.get("/{practice_id}/course", dependencies=[Depends(get_current_user)], response_model=PracticePublicWithCourse)
-def read_practice_course(practice_id: uuid.UUID, session: SessionDep) -> Any:
+async def read_practice_course(practice_id: uuid.UUID, session: SessionDep) -> Any:
     """
     Retrieve practice course.
     """
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     return practice
 
 @router.get("/{practice_id}/correction-files-info", dependencies=[Depends(get_current_teacher)], response_model=list[PracticeFileInfo])
@@ -221,17 +299,17 @@ async def read_practice_correction_files_info(practice_id: uuid.UUID, session: S
     """
     Retrieve uploaded correction files for a specific practice.
     """
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     course = practice.course
     if not course:
         raise HTTPException(status_code=404, detail="Course not found for practice")
-    
-    if current_user not in course.users and not current_user.is_admin:
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=course.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="Not authorized to access practice correction files")
-    
+
     try:
         return await sftp_service.get_practice_correction_files_info(practice)
     except Exception as e:
@@ -243,33 +321,30 @@ async def read_practice_file_info(practice_id: uuid.UUID, session: SessionDep, c
     Retrieve uploaded file info for a given practice.
     """
     query = select(Practice, PracticesUsersLink).join(
-        PracticesUsersLink, 
-        (PracticesUsersLink.practice_id == Practice.id) & 
+        PracticesUsersLink,
+        (PracticesUsersLink.practice_id == Practice.id) &
         (PracticesUsersLink.user_niub == current_user.niub)
-    ).where(Practice.id == practice_id)
-    
-    result = session.exec(query).first()
-    
+    ).where(Practice.id == practice_id).options(selectinload(Practice.course))
+
+    result = (await session.exec(query)).first()
+
     if not result:
         raise HTTPException(status_code=404, detail="Practice or user-practice link not found")
-    
+
     practice, practice_user = result
-    
+
     if not practice_user.submission_file_name:
         raise HTTPException(status_code=404, detail="No file submitted for this practice")
-    
+
     # Ruta base en SFTP
     if current_user.is_student:
         remote_file_path = posixpath.join(settings.STUDENT_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name), current_user.niub, clean_filename(practice_user.submission_file_name))
     else:
         raise HTTPException(status_code=403, detail="User role not allowed")
-    
-    def _stat_file():
-        with sftp_service.sftp_client() as sftp:
-            return sftp.stat(remote_file_path)
 
     try:
-        file_stat = await run_in_threadpool(_stat_file)
+        async with sftp_service.async_sftp_client() as sftp:
+            file_stat = await sftp.stat(remote_file_path)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Submitted file not found on server")
     except Exception as e:
@@ -277,7 +352,7 @@ async def read_practice_file_info(practice_id: uuid.UUID, session: SessionDep, c
 
     return PracticeFileInfo(
         name=practice_user.submission_file_name,
-        size=file_stat.st_size,
+        size=file_stat.size,
     )
 
 @router.get("/{practice_id}/users/{niub}/submission-file-info", dependencies=[Depends(get_current_teacher)], response_model=PracticeFileInfo)
@@ -292,9 +367,9 @@ async def read_user_submission_file_info(practice_id: uuid.UUID, niub: str, sess
         PracticesUsersLink,
         (PracticesUsersLink.practice_id == Practice.id) &
         (PracticesUsersLink.user_niub == niub)
-    ).where(Practice.id == practice_id)
-    
-    result = session.exec(query).first()
+    ).where(Practice.id == practice_id).options(selectinload(Practice.course))
+
+    result = (await session.exec(query)).first()
 
     if not result:
         raise HTTPException(status_code=404, detail="Practice or submission not found")
@@ -307,7 +382,7 @@ async def read_user_submission_file_info(practice_id: uuid.UUID, niub: str, sess
     if not practice_user:
         raise HTTPException(status_code=403, detail="Access to this submission is not allowed")
 
-    if current_user not in practice.users and not current_user.is_admin:
+    if not current_user.is_admin and not await membership_service.is_practice_member(session, practice_id=practice.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="Teacher can only access to their own practices")
 
     if not practice_user.submission_file_name:
@@ -322,12 +397,9 @@ async def read_user_submission_file_info(practice_id: uuid.UUID, niub: str, sess
         clean_filename(practice_user.submission_file_name)
     )
 
-    def _stat_file():
-        with sftp_service.sftp_client() as sftp:
-            return sftp.stat(remote_path)
-
     try:
-        file_stat = await run_in_threadpool(_stat_file)
+        async with sftp_service.async_sftp_client() as sftp:
+            file_stat = await sftp.stat(remote_path)
     except FileNotFoundError:
         raise HTTPException(status_code=410, detail="Submitted file not found on server")
     except Exception as e:
@@ -335,24 +407,64 @@ async def read_user_submission_file_info(practice_id: uuid.UUID, niub: str, sess
 
     return PracticeFileInfo(
         name=practice_user.submission_file_name,
-        size=file_stat.st_size
+        size=file_stat.size
+    )
+
+@router.get("/{practice_id}/statistics", dependencies=[Depends(get_current_teacher)], response_model=PracticeStatisticsPublic)
+async def read_practice_statistics(practice_id: uuid.UUID, session: SessionDep, current_user: CurrentUser) -> Any:
+    """
+    Retrieve the status counts, grades and submission timeline of the practice.
+    """
+    practice = await session.get(Practice, practice_id)
+    if not practice:
+        raise HTTPException(status_code=404, detail="Practice not found")
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=practice.course_id, user_niub=current_user.niub):
+        raise HTTPException(status_code=403, detail="The user is not enrolled in the practice.")
+
+    statistics, = await statistics_service.get_statistics(session, practices=[practice])
+    return statistics
+
+@router.get("/{practice_id}/grades", dependencies=[Depends(get_current_teacher)], response_class=StreamingResponse)
+async def export_practice_grades(
+    practice_id: uuid.UUID,
+    session: SessionDep,
+    current_user: CurrentUser,
+    file_format: GradebookFormatEnum = Query(GradebookFormatEnum.CSV, alias="format")
+) -> Any:
+    """
+    Export the status, grade and feedback of every student of the practice.
+    The moodle format is the offline grading worksheet that can be uploaded to a Moodle assignment.
+    """
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
+    if not practice:
+        raise HTTPException(status_code=404, detail="Practice not found")
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=practice.course_id, user_niub=current_user.niub):
+        raise HTTPException(status_code=403, detail="The user is not enrolled in the practice.")
+
+    filename = f"{format_directory_name(practice.course.name)}_{format_directory_name(practice.name)}_qualificacions.{gradebook_service.EXTENSIONS[file_format]}"
+    return StreamingResponse(
+        gradebook_service.stream_practice_gradebook(practice, file_format),
+        media_type=gradebook_service.MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 @router.get("/{practice_id}/{user_niub}", dependencies=[Depends(get_current_teacher)], response_model=PracticePublic)
-def read_practice_student(practice_id: uuid.UUID, user_niub: str, session: SessionDep, current_user: CurrentUser) -> Any:
+async def read_practice_student(practice_id: uuid.UUID, user_niub: str, session: SessionDep, current_user: CurrentUser) -> Any:
     """
     Retrieve student practice by ID and NIUB.
     """
     statement = select(Practice, PracticesUsersLink).join(PracticesUsersLink).where(
         PracticesUsersLink.user_niub == user_niub,
         PracticesUsersLink.practice_id == practice_id
-    )
-    practice, link = session.exec(statement).first()
+    ).options(selectinload(Practice.course))
+    practice, link = (await session.exec(statement)).first()
 
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
-    if current_user not in practice.course.users and not current_user.is_admin:
+
+    if not current_user.is_admin and not await membership_service.is_course_member(session, course_id=practice.course_id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="The user is not enrolled in the practice.")
 
     return PracticePublic(
@@ -368,27 +480,25 @@ async def create_practice(*, session: SessionDep, practice_in: PracticeCreate, f
     """
     Create new practice.
     """
-    course = crud.course.get_course(session=session, id=practice_in.course_id)
+    course = await crud.course.get_course(session=session, id=practice_in.course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-    
-    if any(p.name == practice_in.name for p in course.practices):
+
+    if await crud.practice.get_practice_by_name(session=session, course_id=course.id, name=practice_in.name):
         raise HTTPException(status_code=400, detail="A practice with this name already exists in the course")
-    
+
     try:
         await sftp_service.create_practice_directories_and_upload_files(course, practice_in.name, files)
-        
-        practice = crud.practice.create_practice(session=session, practice_create=practice_in, course=course)
 
-        for user in course.users:
-            practice.users.append(user)
+        practice = await crud.practice.create_practice(session=session, practice_create=practice_in, course=course)
+
+        await enrollment_service.enroll_practice_users(session, practice=practice)
 
-        session.add(practice)
-        session.commit()
+        await session.commit()
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SFTP connection error or operation failed: {str(e)}")
-    
+
     return practice
 
 @router.put("/{practice_id}", dependencies=[Depends(get_current_teacher)], response_model=PracticePublic)
@@ -398,14 +508,14 @@ async def update_practice(session: SessionDep, practice_id: uuid.UUID, practice_
     """
     course = None
     if practice_in.course_id:
-        course = crud.course.get_course(session=session, id=practice_in.course_id)
+        course = await crud.course.get_course(session=session, id=practice_in.course_id)
         if not course:
             raise HTTPException(status_code=404, detail="Course not found")
-        
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+
+    practice = await crud.practice.get_practice(session=session, id=practice_id)
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     # Check if name is being changed
     name_changed = practice_in.name and practice_in.name != practice.name
     old_practice_name = practice.name if name_changed else None
@@ -417,14 +527,16 @@ async def update_practice(session: SessionDep, practice_id: uuid.UUID, practice_
         except Exception as e:
             logger.error(f"Failed to rename practice directories: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to rename practice directories: {str(e)}")
-        
+
     if files:
         try:
             await sftp_service.replace_practice_files(course, practice.name, files)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"SFTP connection error or operation failed: {str(e)}")
-    
-    practice = crud.practice.update_practice(session=session, db_practice=practice, practice_in=practice_in, course=course)
+        finally:
+            archive_cache_service.invalidate(practice.id)
+
+    practice = await crud.practice.update_practice(session=session, db_practice=practice, practice_in=practice_in, course=course)
     return practice
 
 @router.delete("/{practice_id}", dependencies=[Depends(get_current_teacher)], response_model=Message)
@@ -432,7 +544,7 @@ async def delete_practice(session: SessionDep, practice_id: uuid.UUID) -> Any:
     """
     Delete practice.
     """
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
 
@@ -441,16 +553,17 @@ async def delete_practice(session: SessionDep, practice_id: uuid.UUID) -> Any:
         # Construct the paths for professor and student directories
         professor_path = posixpath.join(settings.PROFESSOR_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
         student_path = posixpath.join(settings.STUDENT_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
-        
+
         # Remove professor and student directories
         await sftp_service.remove_recursive_diretory(professor_path)
         await sftp_service.remove_recursive_diretory(student_path)
-            
+
     except Exception as e:
         # Log the error but continue with the database deletion
         logger.error(f"SFTP connection error or operation failed: {str(e)}")
-    
-    crud.practice.delete_practice(session=session, practice=practice)
+    archive_cache_service.invalidate(practice.id)
+
+    await crud.practice.delete_practice(session=session, practice=practice)
 
     return Message(message="Practice deleted")
 
@@ -459,56 +572,49 @@ async def upload_practice_file(session: SessionDep, practice_id: uuid.UUID, curr
     """
     Upload practice files.
     """
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=400, detail="Practice not found")
-        
-    if current_user not in practice.users:
+
+    if not await membership_service.is_practice_member(session, practice_id=practice.id, user_niub=current_user.niub):
         raise HTTPException(status_code=400, detail="User not in course")
-    
+
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
-    
-    body = None
-    remote_file_path = ""
 
-    def _upload():
-        nonlocal body, remote_file_path
+    practice_user = None
+    if current_user.is_student:
+        if not file.filename.lower().endswith(".zip"):
+            raise HTTPException(status_code=400, detail="Only ZIP files are allowed")
+
+        # Read before the upload, its previous file is removed from the server before the new one is written
+        practice_user = (await session.exec(
+            select(PracticesUsersLink)
+            .where(
+                PracticesUsersLink.user_niub == current_user.niub,
+                PracticesUsersLink.practice_id == practice.id
+            )
+        )).first()
+
+    previous_file_name = practice_user.submission_file_name if practice_user else None
+    body = None
 
-        with sftp_service.sftp_client() as sftp:
+    try:
+        async with sftp_service.async_sftp_client() as sftp:
             if current_user.is_student:
-                if not file.filename.lower().endswith(".zip"):
-                    raise HTTPException(status_code=400, detail="Only ZIP files are allowed")
-
                 dir_path = posixpath.join(settings.STUDENT_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name), current_user.niub)
-                sftp_service.mkdir_p(sftp, dir_path)
-
-                practice_user = session.exec(
-                    select(PracticesUsersLink)
-                    .where(
-                        PracticesUsersLink.user_niub == current_user.niub,
-                        PracticesUsersLink.practice_id == practice.id
-                    )
-                ).first()
+                await sftp_service.mkdir_p(sftp, dir_path)
 
                 # Si existe un archivo previo, eliminarlo antes de guardar el nuevo
-                if practice_user and practice_user.submission_file_name:
-                    previous_file_path = posixpath.join(dir_path, clean_filename(practice_user.submission_file_name))
+                if previous_file_name:
+                    previous_file_path = posixpath.join(dir_path, clean_filename(previous_file_name))
                     try:
-                        sftp.remove(previous_file_path)
+                        await sftp.remove(previous_file_path)
                     except FileNotFoundError:
                         pass
                     except Exception as e:
                         logger.warning(f"Error removing previous file: {str(e)}")
 
-                if practice_user:
-                    practice_user.status = StatusEnum.SUBMITTED
-                    practice_user.submission_date = datetime.now()
-                    practice_user.submission_file_name = file.filename
-                    session.add(practice_user)
-                    session.commit()
-                    session.refresh(practice_user)
-
                 if settings.ENABLE_EXTERNAL_SERVICE:
                     body = {
                         "subject": format_directory_name(practice.course.name),
@@ -523,17 +629,17 @@ async def upload_practice_file(session: SessionDep, practice_id: uuid.UUID, curr
 
             else:
                 dir_path = posixpath.join(settings.PROFESSOR_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
-                sftp_service.mkdir_p(sftp, dir_path)
+                await sftp_service.mkdir_p(sftp, dir_path)
 
             remote_file_path = f"{dir_path}/{clean_filename(file.filename)}"
 
             try:
-                sftp_service.upload_file(sftp, file, remote_file_path)
+                await sftp_service.upload_file(sftp, file, remote_file_path)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
-
-    try:
-        await run_in_threadpool(_upload)
+            finally:
+                # Also after a failed upload, the previous file may already be removed
+                archive_cache_service.invalidate(practice.id)
 
     except HTTPException:
         # Re-lanzar HTTPExceptions para que no se oculten
@@ -541,9 +647,22 @@ async def upload_practice_file(session: SessionDep, practice_id: uuid.UUID, curr
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error connecting or processing SFTP: {str(e)}")
 
+    if practice_user:
+        # Read again with the row locked, the correction worker may have moved it since
+        await session.refresh(practice_user, with_for_update=True)
+        previous_state = statistics_service.link_state(practice_user)
+        practice_user.status = StatusEnum.SUBMITTED
+        practice_user.submission_date = datetime.now()
+        practice_user.submission_file_name = file.filename
+        session.add(practice_user)
+        if await statistics_service.is_counted(session, practice_user):
+            await statistics_service.record(session, removed=[previous_state], added=[statistics_service.link_state(practice_user)])
+        await session.commit()
+        await session.refresh(practice_user)
+
     if body:
         try:
-            practice_service.send_practice_data(body)
+            await run_in_threadpool(practice_service.send_practice_data, body)
         except Exception as e:
             logger.error(f"Error sending practice data to external service: {str(e)}")
 
@@ -554,289 +673,218 @@ async def delete_practice_submission(session: SessionDep, practice_id: uuid.UUID
     """
     Delete a student's practice submission if the practice is in CORRECTING state.
     """
-    result = session.exec(
+    result = (await session.exec(
         select(Practice, PracticesUsersLink).join(PracticesUsersLink).where(
             PracticesUsersLink.user_niub == user_niub,
             PracticesUsersLink.practice_id == practice_id
-        )
-    ).first()
+        ).options(selectinload(Practice.course))
+    )).first()
 
     if not result:
         raise HTTPException(status_code=400, detail="Practice or user not found")
-    
+
     practice, practice_user = result
-    
+
     if practice_user.status == StatusEnum.CORRECTING:
         raise HTTPException(status_code=400, detail="Cannot delete submission that is in CORRECTING state")
-    
-    def _delete():
-        with sftp_service.sftp_client() as sftp:
+
+    try:
+        async with sftp_service.async_sftp_client() as sftp:
             dir_path = posixpath.join(settings.STUDENT_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name), user_niub)
 
             if practice_user and practice_user.submission_file_name:
                 previous_file_path = posixpath.join(dir_path, clean_filename(practice_user.submission_file_name))
                 try:
-                    sftp.remove(previous_file_path)
+                    await sftp.remove(previous_file_path)
                 except FileNotFoundError:
                     pass
                 except Exception as e:
                     logger.warning(f"Error removing previous file: {str(e)}")
-
-    try:
-        await run_in_threadpool(_delete)
+        archive_cache_service.invalidate(practice.id)
 
         if practice_user:
+            # Read again with the row locked, the correction worker may have moved it since
+            await session.refresh(practice_user, with_for_update=True)
+            previous_state = statistics_service.link_state(practice_user)
             practice_user.status = StatusEnum.NOT_SUBMITTED
             practice_user.submission_date = None
             practice_user.submission_file_name = None
             practice_user.correction = None
             session.add(practice_user)
-            session.commit()
-            session.refresh(practice_user)
+            if await statistics_service.is_counted(session, practice_user):
+                await statistics_service.record(session, removed=[previous_state], added=[statistics_service.link_state(practice_user)])
+            await session.commit()
+            await session.refresh(practice_user)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error connecting or processing SFTP: {str(e)}")
 
     return Message(message="Submission file deleted and status reset to NOT_SUBMITTED.")
 
-def add_files_to_zip_from_sftp(zip_file: zipstream.ZipFile, sftp: paramiko.SFTPClient, remote_path: str, temp_dir: str, base_dir: str = "") -> None:
-    """
-    Add files from SFTP directory to a ZIP file with relative paths.
-
-    :param zip_file: The ZIP file object.
-    :param sftp: SFTP client.
-    :param remote_path: The remote directory path on SFTP server.
-    :param temp_dir: The temporary directory to use.
-    :param base_dir: The base directory inside the ZIP file (optional).
-    """
-    try:
-        _walk_remote_dir_and_add_to_zip(zip_file, sftp, remote_path, temp_dir, base_dir)
-    except FileNotFoundError:
-        pass
-
-def _walk_remote_dir_and_add_to_zip(zip_file: zipstream.ZipFile, sftp: paramiko.SFTPClient, 
-                                   remote_path: str, temp_dir: str, base_dir: str = "", current_dir: str = ""):
-    """
-    Recursively walk through remote directory and add files to zip.
-    """
-    try:
-        remote_current_path = posixpath.join(remote_path, current_dir) if current_dir else remote_path
-        items = sftp.listdir(remote_current_path)
-        
-        for item in items:
-            item_path = posixpath.join(current_dir, item) if current_dir else item
-            remote_item_path = posixpath.join(remote_path, item_path)
-            
-            try:
-                # Check if it's a directory
-                if sftp.stat(remote_item_path).st_mode & 0o40000:
-                    # Recursive call for subdirectory
-                    _walk_remote_dir_and_add_to_zip(zip_file, sftp, remote_path, temp_dir, base_dir, item_path)
-                else:
-                    # It's a file - download to temp directory
-                    local_temp_path = os.path.join(temp_dir, item)
-                    sftp.get(remote_item_path, local_temp_path)
-                    
-                    # Add to zip file with correct path structure
-                    rel_path = item_path
-                    arcname = posixpath.join(base_dir, rel_path) if base_dir else rel_path
-                    zip_file.write(local_temp_path, arcname)
-            except Exception as e:
-                # Skip problematic files but continue processing
-                print(f"Error processing {remote_item_path}: {str(e)}")
-                continue
-    except FileNotFoundError:
-        # Skip directories that don't exist
-        pass
-
 @router.get("/{practice_id}/download/me", response_class=StreamingResponse)
-async def download_my_files(*, session: SessionDep, practice_id: uuid.UUID, current_user: CurrentUser, background_tasks: BackgroundTasks) -> Any:
+async def download_my_files(*, session: SessionDep, practice_id: uuid.UUID, current_user: CurrentUser) -> Any:
     """
     Download the current user's files for a specific practice from SFTP server.
     """
     # Get practice
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     # Check if user has access to the practice
-    if current_user not in practice.users:
+    if not await membership_service.is_practice_member(session, practice_id=practice.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="Access denied to this practice")
-    
+
     base_path = settings.PROFESSOR_FILES_PATH if current_user.is_teacher else settings.STUDENT_FILES_PATH
     file_path = posixpath.join(base_path, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
     user_path = posixpath.join(file_path, current_user.niub) if not current_user.is_teacher else file_path
-    
-    # Create a persistent temporary directory
-    temp_dir = tempfile.mkdtemp()
-
-    # Create zipstream
-    z = zipstream.ZipFile(mode='w', compression=zipstream.ZIP_DEFLATED)
-
-    def _sftp_zip():
-        with sftp_service.sftp_client() as sftp:
-            # Add files to zip
-            add_files_to_zip_from_sftp(z, sftp, user_path, temp_dir, "")
-    
-    try:
-        await run_in_threadpool(_sftp_zip)
 
+    try:
+        chunks = await archive_service.stream_archive([(user_path, "")])
     except Exception as e:
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Error connecting or processing SFTP: {str(e)}")
-    
-    # Schedule temp_dir cleanup after streaming completes
-    background_tasks.add_task(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
-    
+
     # Create response with appropriate headers
     filename = f"{practice.name}_{'teacher' if current_user.is_teacher else 'student'}_{current_user.niub}.zip"
     return StreamingResponse(
-        z,
+        chunks,
         media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={filename}"},
-        background=background_tasks
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 @router.get("/{practice_id}/download/all", dependencies=[Depends(get_current_teacher)], response_class=StreamingResponse)
-async def download_all_files(*, session: SessionDep, practice_id: uuid.UUID, current_user: CurrentUser, background_tasks: BackgroundTasks) -> Any:
+async def download_all_files(
+    *,
+    session: SessionDep,
+    practice_id: uuid.UUID,
+    current_user: CurrentUser,
+    niubs: list[str] | None = Query(None, alias="niub")
+) -> Any:
     """
     Download all files for a practice from SFTP server. Only available to teachers.
-    Creates a ZIP with subdirectories for each user.
+    Creates a ZIP with subdirectories for each user, only the given students when niub is repeated in the query.
     """
-    
+
     # Get practice
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     # Check if teacher has access to the practice
-    if current_user not in practice.users and not current_user.is_admin:
+    if not current_user.is_admin and not await membership_service.is_practice_member(session, practice_id=practice.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="Access denied to this practice")
-    
+
     # Base paths
     prof_base_path = posixpath.join(settings.PROFESSOR_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
     student_base_path = posixpath.join(settings.STUDENT_FILES_PATH, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
-    
-    # Create a persistent temporary directory
-    temp_dir = tempfile.mkdtemp()
-
-    # Create zipstream
-    z = zipstream.ZipFile(mode='w', compression=zipstream.ZIP_DEFLATED)
-    
-    def _sftp_zip():
-        with sftp_service.sftp_client() as sftp:
-            for user in practice.users:
-                if not user.is_teacher:
-                    user_path = posixpath.join(student_base_path, user.niub)
-                    base_dir = f"students/{user.niub}"
-                    # Add student files to zip
-                    add_files_to_zip_from_sftp(z, sftp, user_path, temp_dir, base_dir)
-                
-            # Add teachers files to zip
-            add_files_to_zip_from_sftp(z, sftp, prof_base_path, temp_dir, "teachers")
 
-    try:
-        await run_in_threadpool(_sftp_zip)
+    # The students of the course, as in the gradebook. Sorted so the archive has the same order every time
+    students = list((await session.exec(
+        select(PracticesUsersLink.user_niub).join(
+            CoursesUsersLink,
+            and_(CoursesUsersLink.user_niub == PracticesUsersLink.user_niub, CoursesUsersLink.course_id == practice.course_id)
+        ).where(
+            PracticesUsersLink.practice_id == practice.id,
+            CoursesUsersLink.role == CourseRoleEnum.STUDENT
+        ).order_by(PracticesUsersLink.user_niub)
+    )).all())
+    if niubs is not None:
+        not_enrolled = sorted(set(niubs) - set(students))
+        if not_enrolled:
+            raise HTTPException(status_code=404, detail=f"Students not enrolled in this practice: {', '.join(not_enrolled)}")
+        students = [niub for niub in students if niub in niubs]
+
+    sources = [(posixpath.join(student_base_path, niub), f"students/{niub}") for niub in students]
+    # Teachers files
+    sources.append((prof_base_path, "teachers"))
 
+    try:
+        # Only the full archive is cached, teachers download it again and again while grading
+        if niubs is None:
+            chunks = await archive_cache_service.stream_practice_archive(practice.id, sources)
+        else:
+            chunks = await archive_service.stream_archive(sources)
     except Exception as e:
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Error connecting or processing SFTP: {str(e)}")
 
-    # Schedule temp_dir cleanup after streaming completes
-    background_tasks.add_task(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
-
     # Create response with appropriate headers
-    filename = f"{practice.name}_all_submissions.zip"
+    filename = f"{practice.name}_{'selected' if niubs is not None else 'all'}_submissions.zip"
     return StreamingResponse(
-        z,
+        chunks,
         media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={filename}"},
-        background=background_tasks
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 @router.get("/{practice_id}/download/{user_niub}", response_class=StreamingResponse)
-async def download_user_files(*, session: SessionDep, practice_id: uuid.UUID, user_niub: str, current_user: CurrentUser, background_tasks: BackgroundTasks) -> Any:
+async def download_user_files(*, session: SessionDep, practice_id: uuid.UUID, user_niub: str, current_user: CurrentUser) -> Any:
     """
     Download files for a specific user in a practice from SFTP server.
     Teachers can download any user's files. Students can only download their own.
     """
     # Get practice
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
+
     # Check if current user has access to the practice
-    if current_user not in practice.users and not current_user.is_admin:
+    if not current_user.is_admin and not await membership_service.is_practice_member(session, practice_id=practice.id, user_niub=current_user.niub):
         raise HTTPException(status_code=403, detail="Access denied to this practice")
-    
+
     # Get target user
-    target_user = crud.user.get_user_by_niub(session=session, niub=user_niub)
+    target_user = await crud.user.get_user_by_niub(session=session, niub=user_niub)
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
-    
+
     # Security check: Students can only download their own files
     if not current_user.is_teacher and current_user.niub != user_niub and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Access denied to this user's files")
-    
+
     # Check if target user has access to the practice
-    if target_user not in practice.users:
+    if not await membership_service.is_practice_member(session, practice_id=practice.id, user_niub=target_user.niub):
         raise HTTPException(status_code=404, detail="This user is not enrolled in this practice")
-    
+
     base_path = settings.PROFESSOR_FILES_PATH if target_user.is_teacher else settings.STUDENT_FILES_PATH
     file_path = posixpath.join(base_path, practice.course.academic_year, format_directory_name(practice.course.name), format_directory_name(practice.name))
     user_path = posixpath.join(file_path, target_user.niub) if not target_user.is_teacher else file_path
-    
-    # Create a persistent temporary directory
-    temp_dir = tempfile.mkdtemp()
-
-    # Create zipstream
-    z = zipstream.ZipFile(mode='w', compression=zipstream.ZIP_DEFLATED)
-    
-    def _sftp_zip():
-        with sftp_service.sftp_client() as sftp:
-            # Add files to zip
-            add_files_to_zip_from_sftp(z, sftp, user_path, temp_dir, "")
-    
+
     try:
-        await run_in_threadpool(_sftp_zip)
-    
+        chunks = await archive_service.stream_archive([(user_path, "")])
     except Exception as e:
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Error connecting or processing SFTP: {str(e)}")
 
-    background_tasks.add_task(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
-    
     # Create response with appropriate headers
     filename = f"{practice.name}_{'teacher' if target_user.is_teacher else 'student'}_{target_user.niub}.zip"
     return StreamingResponse(
-        z,
+        chunks,
         media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={filename}"},
-        background=background_tasks
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 @router.post("/send-practice-data/{practice_id}/{niub}", dependencies=[Depends(get_current_teacher)], response_model=Message)
-def send_practice_data(*, session: SessionDep, practice_id: str, niub: str) -> Any:
+async def send_practice_data(*, session: SessionDep, practice_id: str, niub: str) -> Any:
     """
     Send practice data for correction.
     """
-    practice = crud.practice.get_practice(session=session, id=practice_id)
+    practice = await crud.practice.get_practice(session=session, id=practice_id, options=[selectinload(Practice.course)])
     if not practice:
         raise HTTPException(status_code=404, detail="Practice not found")
-    
-    practice_user = session.exec(select(PracticesUsersLink)
+
+    practice_user = (await session.exec(select(PracticesUsersLink)
         .where(
             PracticesUsersLink.user_niub == niub,
             PracticesUsersLink.practice_id == practice_id
-        )
-    ).first()
-    
+        ).with_for_update()
+    )).first()
+
     if practice_user:
+        previous_state = statistics_service.link_state(practice_user)
         practice_user.status = StatusEnum.SUBMITTED
         session.add(practice_user)
-        session.commit()
-        session.refresh(practice_user)
-    
+        if await statistics_service.is_counted(session, practice_user):
+            await statistics_service.record(session, removed=[previous_state], added=[statistics_service.link_state(practice_user)])
+        await session.commit()
+        await session.refresh(practice_user)
+
     body = {
         "subject": format_directory_name(practice.course.name),
         "year": practice.course.academic_year,
@@ -848,6 +896,6 @@ def send_practice_data(*, session: SessionDep, practice_id: str, niub: str) -> A
         "teacher_dir": f"/{settings.PROFESSOR_FILES_PATH}/{practice.course.academic_year}/{format_directory_name(practice.course.name)}/{format_directory_name(practice.name)}"
     }
 
-    practice_service.send_practice_data(body)
+    await run_in_threadpool(practice_service.send_practice_data, body)
 
-    return Message(message="Practice data sent successfully")
\ No newline at end of file
+    return Message(message="Practice data sent successfully")
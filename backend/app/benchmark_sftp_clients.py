@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import logging
+import posixpath
+import statistics
+import time
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services import sftp_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# Both libraries log every connection at INFO
+logging.getLogger("asyncssh").setLevel(logging.WARNING)
+logging.getLogger("paramiko").setLevel(logging.WARNING)
+
+# Scratch directory on the SFTP server, removed after each run
+BENCHMARK_DIR = "benchmark"
+DEFAULT_TASKS = 64
+DEFAULT_FILES = 4
+DEFAULT_FILE_KIB = 512
+# How often the probes check the threadpool and the event loop while the load runs
+PROBE_INTERVAL = 0.01
+
+
+def _upload(data: bytes, filename: str) -> UploadFile:
+    # In memory, as FastAPI keeps small uploads
+    file = SpooledTemporaryFile(max_size=len(data) + 1)
+    file.write(data)
+    return UploadFile(file=file, filename=filename, size=len(data))
+
+
+async def _probe(stop: asyncio.Event, threadpool_waits: list[float], loop_lags: list[float]) -> None:
+    # A sync route needs a threadpool thread, this is how long it would wait for one
+    while not stop.is_set():
+        start = time.perf_counter()
+        await run_in_threadpool(lambda: None)
+        threadpool_waits.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        loop_lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def _task(root: str, index: int, files: int, data: bytes) -> None:
+    directory = posixpath.join(root, str(index))
+    async with sftp_service.async_sftp_client() as sftp:
+        await sftp_service.mkdir_p(sftp, directory)
+        for number in range(files):
+            path = posixpath.join(directory, f"{number}.bin")
+            await sftp_service.upload_file(sftp, _upload(data, f"{number}.bin"), path)
+            await sftp.stat(path)
+        infos = await sftp_service.get_directory_files_info(sftp, directory)
+        if len(infos) != files:
+            raise RuntimeError(f"{directory} has {len(infos)} files instead of {files}")
+
+
+async def run(client: str, tasks: int, files: int, file_bytes: int) -> dict[str, float]:
+    """
+        Run concurrent SFTP tasks (mkdir, upload, stat and listing) with one client library
+        :param client: asyncssh or paramiko
+        :param tasks: concurrent tasks, each one with its own connection
+        :param files: files uploaded by each task
+        :param file_bytes: size of each file
+        :return: measurements of the run
+    """
+    settings.SFTP_CLIENT = client
+    root = posixpath.join(BENCHMARK_DIR, uuid.uuid4().hex)
+    data = bytes(file_bytes)
+    stop = asyncio.Event()
+    threadpool_waits: list[float] = []
+    loop_lags: list[float] = []
+
+    probe = asyncio.create_task(_probe(stop, threadpool_waits, loop_lags))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(_task(root, index, files, data) for index in range(tasks)))
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()
+        await probe
+        await sftp_service.remove_recursive_diretory(root)
+
+    return {
+        "seconds": elapsed,
+        "MiB/s": tasks * files * file_bytes / elapsed / 2**20,
+        "threadpool wait p50 ms": statistics.median(threadpool_waits) * 1000,
+        "threadpool wait max ms": max(threadpool_waits) * 1000,
+        "loop lag max ms": max(loop_lags) * 1000,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    results = {}
+    for client in args.clients:
+        logger.info(f"Running {args.tasks} tasks x {args.files} files of {args.file_kib} KiB with {client}")
+        results[client] = await run(client, args.tasks, args.files, args.file_kib * 1024)
+    await sftp_service.close_pool()
+
+    for name in next(iter(results.values())):
+        logger.info(f"{name:>24}: " + "  ".join(f"{client} {values[name]:9.2f}" for client, values in results.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the asyncssh and paramiko SFTP clients under concurrent load")
+    parser.add_argument("--tasks", type=int, default=DEFAULT_TASKS, help="concurrent tasks, one connection each")
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES, help="files uploaded per task")
+    parser.add_argument("--file-kib", type=int, default=DEFAULT_FILE_KIB, help="size of each file")
+    parser.add_argument("--clients", nargs="+", choices=["asyncssh", "paramiko"], default=["asyncssh", "paramiko"])
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
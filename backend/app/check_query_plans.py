@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import random
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import Engine, insert, text
+from sqlmodel import Session, select
+
+from app import crud
+from app.api.routes import courses, practices
+from app.core.config import settings
+from app.core.db import engine
+from app.models import (
+    Course,
+    CourseRoleEnum,
+    CoursesUsersLink,
+    Practice,
+    PracticesUsersLink,
+    SemesterEnum,
+    StatusEnum,
+    User,
+)
+from app.services import etag_service, pagination_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tables whose hot-path queries must be served by an index
+WATCHED_TABLES = {"course", "practice", "coursesuserslink", "practicesuserslink"}
+
+BENCHMARK_STUDENTS = 3000
+BENCHMARK_TEACHERS = 20
+BENCHMARK_COURSES = 2000
+BENCHMARK_PRACTICES_PER_COURSE = 8
+BENCHMARK_COURSES_PER_STUDENT = 4
+BENCHMARK_ACADEMIC_YEAR = "2024-2025"
+BENCHMARK_NIUB_PREFIX = "B"
+
+
+def benchmark_niub(index: int) -> str:
+    return f"{BENCHMARK_NIUB_PREFIX}{index:011d}"
+
+
+def seed_benchmark_data(session: Session) -> None:
+    """
+        Fill the database with a dataset large enough for the planner to prefer the indexes
+        :param session: database session
+    """
+    if session.get(User, benchmark_niub(0)):
+        logger.info("Benchmark dataset already seeded")
+        return
+
+    rng = random.Random(0)
+    # The hash is never checked, the benchmark users are not meant to log in
+    users = [
+        {
+            "niub": benchmark_niub(i),
+            "email": f"bench{i}@golem.test",
+            "name": f"Bench {i}",
+            "surnames": "Benchmark",
+            "is_student": i >= BENCHMARK_TEACHERS,
+            "is_teacher": i < BENCHMARK_TEACHERS,
+            "is_admin": False,
+            "hashed_password": "!",
+        }
+        for i in range(BENCHMARK_TEACHERS + BENCHMARK_STUDENTS)
+    ]
+    courses = [
+        Course(
+            name=f"Benchmark course {i}",
+            academic_year=BENCHMARK_ACADEMIC_YEAR,
+            semester=SemesterEnum.TARDOR,
+            description="Benchmark course",
+        )
+        for i in range(BENCHMARK_COURSES)
+    ]
+    practices = [
+        Practice(
+            course_id=course.id,
+            name=f"Practice {p}",
+            description="Benchmark practice",
+            due_date=datetime.now() + timedelta(days=p),
+        )
+        for course in courses
+        for p in range(BENCHMARK_PRACTICES_PER_COURSE)
+    ]
+    practices_by_course = {course.id: [] for course in courses}
+    for practice in practices:
+        practices_by_course[practice.course_id].append(practice)
+
+    course_links = []
+    practice_links = []
+    statuses = list(StatusEnum)
+
+    def enroll(niub: str, course: Course, last_access: datetime | None, role: CourseRoleEnum) -> None:
+        course_links.append({"user_niub": niub, "course_id": course.id, "last_access": last_access, "role": role})
+        for practice in practices_by_course[course.id]:
+            practice_links.append({"user_niub": niub, "practice_id": practice.id, "status": rng.choice(statuses)})
+
+    for i, course in enumerate(courses):
+        enroll(benchmark_niub(i % BENCHMARK_TEACHERS), course, None, CourseRoleEnum.TEACHER)
+
+    for user in users[BENCHMARK_TEACHERS:]:
+        for course in rng.sample(courses, BENCHMARK_COURSES_PER_STUDENT):
+            last_access = datetime.now() - timedelta(minutes=rng.randint(0, 60 * 24 * 30)) if rng.random() < 0.7 else None
+            enroll(user["niub"], course, last_access, CourseRoleEnum.STUDENT)
+
+    session.execute(insert(User), users)
+    session.add_all(courses)
+    session.flush()
+    session.add_all(practices)
+    session.flush()
+    session.execute(insert(CoursesUsersLink), course_links)
+    session.execute(insert(PracticesUsersLink), practice_links)
+    session.commit()
+    logger.info(
+        f"Seeded {len(users)} users, {len(courses)} courses, {len(practices)} practices, "
+        f"{len(course_links)} course links and {len(practice_links)} practice links"
+    )
+
+
+def get_hot_queries(session: Session) -> dict[str, object]:
+    """
+        Build the statements issued by the hot routes for a sample benchmark student
+        :param session: database session
+        :return: statements by name
+    """
+    student = session.get(User, benchmark_niub(BENCHMARK_TEACHERS))
+    if not student:
+        raise RuntimeError("Benchmark dataset not found, run with --seed first")
+    course_id = session.exec(
+        select(CoursesUsersLink.course_id).where(CoursesUsersLink.user_niub == student.niub)
+    ).first()
+    practice_id = session.exec(select(Practice.id).where(Practice.course_id == course_id)).first()
+    course = session.get(Course, course_id)
+
+    search, rank = courses.select_searched_courses(student, "course 1")
+
+    # Relationship loads are plain filters on a foreign key, the rest comes from the routes' own builders
+    return {
+        "courses_me": courses.select_my_courses(student).limit(100),
+        "courses_me_recent": courses.select_recent_courses(student.niub).limit(5),
+        "courses_search": pagination_service.page_statement(search, keys=[Course.id], skip=0, limit=100, rank=rank),
+        "courses_page": pagination_service.page_statement(
+            select(Course), keys=[Course.id], skip=0, limit=100,
+            cursor=pagination_service.encode_cursor([course_id])
+        ),
+        "course_practices": select(Practice).where(Practice.course_id == course_id),
+        "course_users": select(CoursesUsersLink).where(CoursesUsersLink.course_id == course_id),
+        "course_teachers": crud.course.select_courses_teachers([course_id]),
+        "course_by_name": crud.course.select_course_by_name(course.name, course.academic_year),
+        "practices_me": practices.select_my_practices(student.niub).limit(100),
+        "practices_me_corrected": practices.select_my_corrected_practices(student.niub).limit(100),
+        "practice_users": select(PracticesUsersLink).where(PracticesUsersLink.practice_id == practice_id),
+        "course_etag": select(*etag_service.courses_stamps(lambda column: column == course_id, student.niub)),
+        "courses_me_etag": select(*etag_service.user_courses_stamps(student)),
+    }
+
+
+def find_seq_scans(plan: dict) -> list[str]:
+    relations = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in WATCHED_TABLES:
+        relations.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        relations.extend(find_seq_scans(child))
+    return relations
+
+
+def check(db_engine: Engine) -> list[str]:
+    """
+        Explain every hot query and collect the ones that scan a watched table sequentially
+        :param db_engine: engine connected to the benchmark database
+        :return: one message per regressed query
+    """
+    failures = []
+    with Session(db_engine) as session:
+        for table in WATCHED_TABLES:
+            session.exec(text(f"ANALYZE {table}"))
+        for name, statement in get_hot_queries(session).items():
+            compiled = statement.compile(dialect=db_engine.dialect, compile_kwargs={"literal_binds": True})
+            # Some functions (aggregate_strings) keep their arguments as bound parameters even with literal_binds
+            plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).one()[0]
+            seq_scans = find_seq_scans(plan[0]["Plan"])
+            if seq_scans:
+                failures.append(f"{name}: Seq Scan on {', '.join(sorted(set(seq_scans)))}")
+                logger.error(f"{name} regressed to a sequential scan:\n{json.dumps(plan, indent=2)}")
+            else:
+                logger.info(f"{name}: OK")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fail when a hot route query plan uses a sequential scan")
+    parser.add_argument("--seed", action="store_true", help="seed the benchmark dataset before checking")
+    args = parser.parse_args()
+
+    if settings.DB_ENGINE != "postgres":
+        logger.error("Query plans can only be checked against PostgreSQL")
+        sys.exit(2)
+
+    if args.seed:
+        with Session(engine) as session:
+            seed_benchmark_data(session)
+
+    failures = check(engine)
+    if failures:
+        logger.error("Query plan regressions found:\n" + "\n".join(failures))
+        sys.exit(1)
+    logger.info("All hot query plans use indexes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Every gunicorn worker pays the import of app.main, again each time max_requests recycles it
+STARTUP_MODULE = "app.main"
+# Heavy modules only some routes need, they must be imported on first use and not at startup
+LAZY_MODULES = ["pandas", "numpy", "openpyxl", "xlsxwriter", "paramiko", "pika", "sentry_sdk"]
+DEFAULT_RUNS = 5
+DEFAULT_TOP = 15
+
+
+def import_profile() -> tuple[float, list[tuple[int, int, str]], set[str]]:
+    """
+        Import the app in a fresh interpreter, as a new worker does
+        :return: wall time in seconds, (cumulative microseconds, depth, module) per import and modules loaded
+    """
+    code = f"import sys, {STARTUP_MODULE}; print('\\n'.join(sys.modules))"
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        # Nested imports are indented by two spaces per level
+        name = module.strip()
+        imports.append((int(cumulative), (len(module) - len(module.lstrip()) - 1) // 2, name))
+    return elapsed, imports, set(result.stdout.split())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the import time of the app and fail when heavy modules load at startup")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="slowest imports to list")
+    parser.add_argument("--max-seconds", type=float, help="fail when the median startup exceeds this budget")
+    args = parser.parse_args()
+
+    # The first run warms the bytecode cache, it is not counted
+    import_profile()
+    timings = []
+    for _ in range(args.runs):
+        elapsed, imports, modules = import_profile()
+        timings.append(elapsed)
+
+    median = statistics.median(timings)
+    logger.info(f"Startup of {STARTUP_MODULE}: median {median:.3f}s, min {min(timings):.3f}s over {args.runs} runs")
+    # What the app imports directly in the last run, deeper imports are included in their parent.
+    # Children are listed before the module importing them, up to the app's own line
+    children = []
+    for cumulative, depth, module in imports:
+        if depth == 0:
+            if module == STARTUP_MODULE:
+                break
+            children = []
+        elif depth == 1:
+            children.append((cumulative, module))
+    for cumulative, module in sorted(children, reverse=True)[:args.top]:
+        logger.info(f"{cumulative / 1000:9.1f} ms  {module}")
+
+    failures = [f"{module} is imported at startup" for module in LAZY_MODULES if module in modules]
+    if args.max_seconds is not None and median > args.max_seconds:
+        failures.append(f"median startup {median:.3f}s exceeds {args.max_seconds:.3f}s")
+    if failures:
+        logger.error("Startup regressions found:\n" + "\n".join(failures))
+        sys.exit(1)
+    logger.info("No heavy module is imported at startup")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,58 @@
-from sqlmodel import Session, create_engine, select
+from typing import Any
+
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.pool import NullPool
+from sqlmodel import create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import crud
 from app.core.config import settings
 from app.models import User, UserCreate
 
+
+def get_engine_options() -> dict[str, Any]:
+    """
+        Build the engine keyword arguments for the configured database and pool mode
+        :return: keyword arguments for create_engine
+    """
+    if settings.DB_ENGINE != 'postgres':
+        return {"connect_args": {"check_same_thread": False}}
+
+    if settings.DB_POOL_MODE == "transaction_pooler":
+        # The external pooler owns the connections and may hand each transaction to a
+        # different backend, so neither client-side pooling nor prepared statements are safe
+        return {
+            "poolclass": NullPool,
+            "connect_args": {"prepare_threshold": None},
+        }
+
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "connect_args": {"prepare_threshold": settings.DB_PREPARE_THRESHOLD},
+    }
+
+
+# The sync engine is kept for the pre-start scripts and the checks, request handlers use async_engine.
+# Without a pool of its own, the connections of a worker are only the ones of async_engine
 engine = create_engine(
-    str(settings.SQLALCHEMY_DATABASE_URI), 
-    poolclass=NullPool,
-    connect_args={"prepare_threshold": None}
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    connect_args=get_engine_options()["connect_args"],
+    poolclass=NullPool
 )
+async_engine = create_async_engine(settings.SQLALCHEMY_ASYNC_DATABASE_URI, **get_engine_options())
 
-def init_db(session: Session) -> None:
-    user = session.exec(
+async def init_db(session: AsyncSession) -> None:
+    user = (await session.exec(
         select(User).where(User.email == settings.FIRST_SUPERUSER)
-    ).first()
+    )).first()
     if not user:
         user_in = UserCreate(
             email=settings.FIRST_SUPERUSER,
             password=settings.FIRST_SUPERUSER_PASSWORD,
             is_superuser=True,
         )
-        user = crud.user.create_user(session=session, user_create=user_in)
\ No newline at end of file
+        user = await crud.user.create_user(session=session, user_create=user_in)
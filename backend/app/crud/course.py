@@ -1,40 +1,92 @@
 import uuid
+from collections.abc import Sequence
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy import insert
+from sqlalchemy.sql.base import ExecutableOption
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import Select, SelectOfScalar
 
-from app.models import Course, CourseCreate, CourseUpdate
+from app.models import (
+    Course,
+    CourseCreate,
+    CourseRoleEnum,
+    CoursesUsersLink,
+    CourseUpdate,
+    PendingEnrollment,
+    User,
+)
 
 
-def create_course(*, session: Session, course_create: CourseCreate) -> Course:
+async def create_course(*, session: AsyncSession, course_create: CourseCreate) -> Course:
     db_obj = Course.model_validate(course_create)
     session.add(db_obj)
-    session.commit()
-    session.refresh(db_obj)
+    await session.commit()
+    await session.refresh(db_obj)
     return db_obj
 
 
-def update_course(*, session: Session, db_course: Course, course_in: CourseUpdate) -> Any:
+async def update_course(*, session: AsyncSession, db_course: Course, course_in: CourseUpdate) -> Any:
     course_data = course_in.model_dump(exclude_unset=True)
 
     db_course.sqlmodel_update(course_data)
     session.add(db_course)
-    session.commit()
-    session.refresh(db_course)
+    await session.commit()
+    await session.refresh(db_course)
     return db_course
 
 
-def get_course(*, session: Session, id: uuid.UUID) -> Course | None:
-    statement = select(Course).where(Course.id == id)
-    course = session.exec(statement).first()
+async def get_course(*, session: AsyncSession, id: uuid.UUID, options: Sequence[ExecutableOption] = ()) -> Course | None:
+    statement = select(Course).where(Course.id == id).options(*options)
+    course = (await session.exec(statement)).first()
     return course
 
 
-def get_course_by_name(*, session: Session, name: str) -> Course | None:
-    statement = select(Course).where(Course.name == name)
-    course = session.exec(statement).first()
+def select_course_by_name(name: str, academic_year: str) -> SelectOfScalar:
+    return select(Course).where(Course.name == name, Course.academic_year == academic_year)
+
+
+async def get_course_by_name(*, session: AsyncSession, name: str, academic_year: str) -> Course | None:
+    statement = select_course_by_name(name, academic_year)
+    course = (await session.exec(statement)).first()
     return course
 
-def delete_course(*, session: Session, course: Course) -> Any:
-    session.delete(course)
-    session.commit()
\ No newline at end of file
+async def is_course_member(*, session: AsyncSession, course_id: uuid.UUID, user_niub: str) -> bool:
+    statement = select(CoursesUsersLink.user_niub).where(
+        CoursesUsersLink.course_id == course_id,
+        CoursesUsersLink.user_niub == user_niub
+    )
+    return (await session.exec(statement)).first() is not None
+
+def get_course_role(user: User) -> CourseRoleEnum:
+    return CourseRoleEnum.TEACHER if user.is_teacher else CourseRoleEnum.STUDENT
+
+
+def select_courses_teachers(course_ids: Sequence[uuid.UUID]) -> Select:
+    return select(CoursesUsersLink.course_id, User).join(User).where(
+        CoursesUsersLink.course_id.in_(course_ids),
+        CoursesUsersLink.role == CourseRoleEnum.TEACHER
+    ).order_by(User.niub)
+
+
+async def get_courses_teachers(*, session: AsyncSession, course_ids: Sequence[uuid.UUID]) -> dict[uuid.UUID, list[User]]:
+    statement = select_courses_teachers(course_ids)
+    teachers: dict[uuid.UUID, list[User]] = {course_id: [] for course_id in course_ids}
+    for course_id, user in (await session.exec(statement)).all():
+        teachers[course_id].append(user)
+    return teachers
+
+
+async def add_pending_enrollments(*, session: AsyncSession, course_id: uuid.UUID, niubs: Sequence[str]) -> None:
+    if not niubs:
+        return
+    # A single INSERT, duplicated niubs in a roster would collide on the primary key
+    await session.exec(insert(PendingEnrollment).values([
+        {"niub": niub, "course_id": course_id} for niub in dict.fromkeys(niubs)
+    ]))
+
+
+async def delete_course(*, session: AsyncSession, course: Course) -> Any:
+    await session.delete(course)
+    await session.commit()
@@ -1,44 +1,62 @@
 import uuid
+from collections.abc import Sequence
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy.sql.base import ExecutableOption
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.models import Practice, PracticeCreate, PracticeUpdate, Course
+from app.models import (
+    Course,
+    Practice,
+    PracticeCreate,
+    PracticesUsersLink,
+    PracticeUpdate,
+)
 
-def create_practice(*, session: Session, practice_create: PracticeCreate, course: Course) -> Practice:
+
+async def create_practice(*, session: AsyncSession, practice_create: PracticeCreate, course: Course) -> Practice:
     db_obj = Practice.model_validate(practice_create)
     db_obj.course = course
     session.add(db_obj)
-    session.commit()
-    session.refresh(db_obj)
+    await session.commit()
+    await session.refresh(db_obj)
     return db_obj
 
 
-def update_practice(*, session: Session, db_practice: Practice, practice_in: PracticeUpdate, course: Course | None) -> Any:
+async def update_practice(*, session: AsyncSession, db_practice: Practice, practice_in: PracticeUpdate, course: Course | None) -> Any:
     practice_data = practice_in.model_dump(exclude_unset=True)
 
     db_practice.sqlmodel_update(practice_data)
     if course:
         db_practice.course = course
-        
+
     session.add(db_practice)
-    session.commit()
-    session.refresh(db_practice)
+    await session.commit()
+    await session.refresh(db_practice)
     return db_practice
 
 
-def get_practice(*, session: Session, id: uuid.UUID) -> Practice | None:
-    statement = select(Practice).where(Practice.id == id)
-    practice = session.exec(statement).first()
+async def get_practice(*, session: AsyncSession, id: uuid.UUID, options: Sequence[ExecutableOption] = ()) -> Practice | None:
+    statement = select(Practice).where(Practice.id == id).options(*options)
+    practice = (await session.exec(statement)).first()
     return practice
 
 
-def get_practice_by_name(*, session: Session, name: str) -> Practice | None:
-    statement = select(Practice).where(Practice.name == name)
-    practice = session.exec(statement).first()
+async def get_practice_by_name(*, session: AsyncSession, course_id: uuid.UUID, name: str) -> Practice | None:
+    statement = select(Practice).where(Practice.course_id == course_id, Practice.name == name)
+    practice = (await session.exec(statement)).first()
     return practice
 
 
-def delete_practice(*, session: Session, practice: Practice) -> Any:
-    session.delete(practice)
-    session.commit()
\ No newline at end of file
+async def is_practice_member(*, session: AsyncSession, practice_id: uuid.UUID, user_niub: str) -> bool:
+    statement = select(PracticesUsersLink.user_niub).where(
+        PracticesUsersLink.practice_id == practice_id,
+        PracticesUsersLink.user_niub == user_niub
+    )
+    return (await session.exec(statement)).first() is not None
+
+
+async def delete_practice(*, session: AsyncSession, practice: Practice) -> Any:
+    await session.delete(practice)
+    await session.commit()
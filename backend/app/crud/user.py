@@ -1,57 +1,96 @@
+from collections.abc import Sequence
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.security import get_password_hash, verify_password
-from app.models import User, UserCreate, UserUpdate
+from app.models import (
+    CourseRoleEnum,
+    CoursesUsersLink,
+    PracticesUsersLink,
+    User,
+    UserCreate,
+    UserUpdate,
+)
+from app.services import password_service, statistics_service, user_cache_service
 
 
-def create_user(*, session: Session, user_create: UserCreate) -> User:
+async def create_user(*, session: AsyncSession, user_create: UserCreate) -> User:
+    hashed_password = await password_service.hash_password(user_create.password)
     db_obj = User.model_validate(
-        user_create, update={"hashed_password": get_password_hash(user_create.password)}
+        user_create, update={"hashed_password": hashed_password}
     )
     session.add(db_obj)
-    session.commit()
-    session.refresh(db_obj)
+    await session.commit()
+    await session.refresh(db_obj)
     return db_obj
 
 
-def update_user(*, session: Session, db_user: User, user_in: UserUpdate) -> Any:
+async def update_user(*, session: AsyncSession, db_user: User, user_in: UserUpdate) -> Any:
     user_data = user_in.model_dump(exclude_unset=True)
     extra_data = {}
     if "password" in user_data:
         password = user_data["password"]
-        hashed_password = get_password_hash(password)
+        hashed_password = await password_service.hash_password(password)
         extra_data["hashed_password"] = hashed_password
     db_user.sqlmodel_update(user_data, update=extra_data)
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    if "is_teacher" in user_data:
+        # Keep the role denormalised on the course links in sync
+        role = CourseRoleEnum.TEACHER if db_user.is_teacher else CourseRoleEnum.STUDENT
+        previous_role = CourseRoleEnum.STUDENT if role == CourseRoleEnum.TEACHER else CourseRoleEnum.TEACHER
+        # Only the links of students are counted, those of the courses where the role changes move in or out
+        changed = await statistics_service.link_states(
+            session,
+            PracticesUsersLink.user_niub == db_user.niub,
+            statistics_service.has_course_role(previous_role)
+        )
+        await session.exec(update(CoursesUsersLink).where(CoursesUsersLink.user_niub == db_user.niub).values(role=role))
+        if role == CourseRoleEnum.STUDENT:
+            await statistics_service.record(session, added=changed)
+        else:
+            await statistics_service.record(session, removed=changed)
+    await session.commit()
+    await session.refresh(db_user)
     return db_user
 
 
-def get_user_by_email(*, session: Session, email: str) -> User | None:
+async def get_user_by_email(*, session: AsyncSession, email: str) -> User | None:
     statement = select(User).where(User.email == email)
-    session_user = session.exec(statement).first()
+    session_user = (await session.exec(statement)).first()
     return session_user
 
 
-def get_user_by_niub(*, session: Session, niub: str) -> User | None:
+async def get_user_by_niub(*, session: AsyncSession, niub: str) -> User | None:
     statement = select(User).where(User.niub == niub)
-    session_user = session.exec(statement).first()
+    session_user = (await session.exec(statement)).first()
     return session_user
 
 
-def authenticate(*, session: Session, email: str = None, niub: str = None, password: str) -> User | None:
+async def get_users_by_niubs(*, session: AsyncSession, niubs: Sequence[str]) -> list[User]:
+    if not niubs:
+        return []
+    statement = select(User).where(User.niub.in_(niubs))
+    return list((await session.exec(statement)).all())
+
+
+async def authenticate(*, session: AsyncSession, email: str = None, niub: str = None, password: str) -> User | None:
     if email:
-        db_user = get_user_by_email(session=session, email=email)
+        db_user = await get_user_by_email(session=session, email=email)
     elif niub:
-        db_user = get_user_by_niub(session=session, niub=niub)
+        db_user = await get_user_by_niub(session=session, niub=niub)
     else:
         return None
-    
+
     if not db_user:
         return None
-    if not verify_password(password, db_user.hashed_password):
+    verified, new_hash = await password_service.verify_password(password, db_user.hashed_password)
+    if not verified:
         return None
-    return db_user
\ No newline at end of file
+    if new_hash:
+        # The hash was made with a different cost factor, store it with the configured one
+        db_user.hashed_password = new_hash
+        session.add(db_user)
+        await session.commit()
+        await user_cache_service.invalidate(session, db_user.niub)
+    return db_user
@@ -1,10 +1,19 @@
-import sentry_sdk
+import asyncio
+import contextlib
+from collections.abc import AsyncIterator
+
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.main import api_router
 from app.core.config import settings
+from app.services import (
+    membership_service,
+    password_service,
+    sftp_service,
+    user_cache_service,
+)
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -12,10 +21,38 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
+    import sentry_sdk
+
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+@contextlib.asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    listeners = []
+    # LISTEN needs a session level connection, which a transaction pooler does not provide
+    if settings.DB_ENGINE == 'postgres' and settings.DB_POOL_MODE == "pooled":
+        if settings.CURRENT_USER_CACHE_TTL > 0:
+            listeners.append(asyncio.create_task(user_cache_service.listen()))
+        if settings.MEMBERSHIP_CACHE_TTL > 0:
+            listeners.append(asyncio.create_task(membership_service.listen()))
+    # In the background, an unreachable SFTP server must not hold the startup
+    warm_up = asyncio.create_task(sftp_service.warm_up()) if settings.SFTP_POOL_WARMUP > 0 else None
+    try:
+        yield
+    finally:
+        for listener in listeners:
+            listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await listener
+        if warm_up:
+            warm_up.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await warm_up
+        await sftp_service.close_pool()
+        password_service.shutdown()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
 )
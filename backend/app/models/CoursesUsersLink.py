@@ -1,11 +1,27 @@
 """ Courses users link """
-from sqlmodel import Field
-from .base import SQLModel
+import enum
 import uuid
-
 from datetime import datetime
 
+from sqlmodel import Column, Enum, Field, Index
+
+from .base import UPDATED_AT_MAPPER_ARGS, SQLModel, UpdatedAtField
+
+
+class CourseRoleEnum(str, enum.Enum):
+    STUDENT = "student"
+    TEACHER = "teacher"
+
 class CoursesUsersLink(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_coursesuserslink_user_niub_last_access", "user_niub", "last_access"),
+        Index("ix_coursesuserslink_course_id_role", "course_id", "role"),
+    )
+    __mapper_args__ = UPDATED_AT_MAPPER_ARGS
+
     user_niub: str | None = Field(default=None, foreign_key="user.niub", primary_key=True)
     course_id: uuid.UUID | None = Field(default=None, foreign_key="course.id", primary_key=True)
-    last_access: datetime | None = Field(default=None)
\ No newline at end of file
+    last_access: datetime | None = Field(default=None)
+    # Copy of the user's is_teacher flag, so the teachers of a course can be resolved without loading its students
+    role: CourseRoleEnum = Field(default=CourseRoleEnum.STUDENT, sa_column=Column(Enum(CourseRoleEnum), nullable=False, server_default='STUDENT'))
+    updated_at: datetime | None = UpdatedAtField()
@@ -0,0 +1,12 @@
+""" Pending enrollments """
+import uuid
+
+from sqlmodel import Field
+
+from .base import SQLModel
+
+
+# Students listed in a course roster before having signed up, enrolled when they register
+class PendingEnrollment(SQLModel, table=True):
+    niub: str = Field(primary_key=True, max_length=12)
+    course_id: uuid.UUID = Field(foreign_key="course.id", primary_key=True, index=True, ondelete="CASCADE")
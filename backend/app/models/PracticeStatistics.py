@@ -0,0 +1,41 @@
+""" Practice statistics """
+import uuid
+from datetime import date
+
+from sqlmodel import JSON, Field
+
+from .base import SQLModel
+from .PracticesUsersLink import StatusEnum
+
+
+class PracticeStatistics(SQLModel, table=True):
+    """ Aggregates of the links of a practice, kept up to date by every write to practicesuserslink """
+    practice_id: uuid.UUID = Field(foreign_key="practice.id", primary_key=True, ondelete="CASCADE")
+    not_submitted: int = 0
+    submitted: int = 0
+    correcting: int = 0
+    corrected: int = 0
+    rejected: int = 0
+    # Corrected links with a grade, and the sum of their grades
+    graded: int = 0
+    grade_sum: float = 0
+    # Graded links per grade and current submissions per day (ISO date), the median and the timeline are read from them
+    grades: dict[str, int] = Field(default_factory=dict, sa_type=JSON)
+    submissions: dict[str, int] = Field(default_factory=dict, sa_type=JSON)
+
+class SubmissionsPerDay(SQLModel):
+    day: date
+    count: int
+
+class PracticeStatisticsPublic(SQLModel):
+    practice_id: uuid.UUID
+    name: str
+    status_counts: dict[StatusEnum, int]
+    graded: int
+    grade_mean: float | None = None
+    grade_median: float | None = None
+    submissions: list[SubmissionsPerDay] = []
+
+class PracticesStatisticsPublic(SQLModel):
+    data: list[PracticeStatisticsPublic]
+    count: int
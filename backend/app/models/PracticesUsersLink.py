@@ -1,10 +1,13 @@
 """ Practices users link """
+import enum
+import uuid
 from datetime import datetime
-from sqlmodel import Field, Enum, Column
+
 from sqlalchemy.dialects.postgresql import JSONB
-from .base import SQLModel
-import uuid
-import enum
+from sqlmodel import Column, Enum, Field, Index
+
+from .base import UPDATED_AT_MAPPER_ARGS, SQLModel, UpdatedAtField
+
 
 class StatusEnum(str, enum.Enum):
     NOT_SUBMITTED = "not_submitted"
@@ -14,13 +17,20 @@ class StatusEnum(str, enum.Enum):
     REJECTED = "rejected"
 
 class PracticesUsersLink(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_practicesuserslink_user_niub_status", "user_niub", "status"),
+        Index("ix_practicesuserslink_practice_id_status", "practice_id", "status"),
+    )
+    __mapper_args__ = UPDATED_AT_MAPPER_ARGS
+
     user_niub: str = Field(foreign_key="user.niub", primary_key=True)
     practice_id: uuid.UUID = Field(foreign_key="practice.id", primary_key=True)
     submission_date: datetime | None = Field(default=None)
     status: StatusEnum = Field(default=StatusEnum.NOT_SUBMITTED, sa_column=Column(Enum(StatusEnum), nullable=False, server_default='NOT_SUBMITTED'))
     submission_file_name: str | None = Field(default=None)
     correction: dict | None = Field(default=None, sa_type=JSONB)
+    updated_at: datetime | None = UpdatedAtField()
 
 class PracticeFileInfo(SQLModel):
     name: str
-    size: int
\ No newline at end of file
+    size: int
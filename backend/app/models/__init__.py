@@ -1,13 +1,16 @@
-from .base import SQLModel
+# Kept in dependency order, not sorted
+from .base import SQLModel  # noqa: F401, I001
 from .user import *
 from .course import *
 from .practice import *
 from .CoursesUsersLink import *
 from .PracticesUsersLink import *
+from .PendingEnrollment import *
+from .PracticeStatistics import *
 
 # Rebuild models for forward references (only needed on models that have forward references)
 CoursePublicWithUsersAndPractices.model_rebuild()
 CoursePublicWithPractices.model_rebuild()
 UserCoursesOut.model_rebuild()
 UserPracticesOut.model_rebuild()
-UserPublicWithCoursesPractices.model_rebuild()
\ No newline at end of file
+UserPublicWithCoursesPractices.model_rebuild()
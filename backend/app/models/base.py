@@ -1 +1,45 @@
-from sqlmodel import SQLModel
\ No newline at end of file
+from typing import Any
+
+from sqlalchemy import DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlmodel import Field
+from sqlmodel import SQLModel as SQLModel  # Re-exported, the models import it from here
+
+
+class current_timestamp(FunctionElement):
+    """ CURRENT_TIMESTAMP with sub-second precision, SQLite's own is truncated to seconds """
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(current_timestamp)
+def _compile_current_timestamp(_element, _compiler, **_kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(current_timestamp, "sqlite")
+def _compile_sqlite_current_timestamp(_element, _compiler, **_kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+class clock_timestamp(current_timestamp):
+    """ Time of the statement, PostgreSQL's CURRENT_TIMESTAMP is the start of the transaction """
+    inherit_cache = True
+
+@compiles(clock_timestamp, "postgresql")
+def _compile_postgresql_clock_timestamp(_element, _compiler, **_kw):
+    return "clock_timestamp()"
+
+
+def UpdatedAtField() -> Any:
+    """ Time of the last write of the row, set by the database on every insert and update """
+    return Field(
+        default=None,
+        nullable=False,
+        # An update stamped with the start of a long transaction could commit below the latest
+        # stamp already read, and leave the ETags built from it unchanged
+        sa_column_kwargs={"server_default": current_timestamp(), "onupdate": clock_timestamp()}
+    )
+
+# Mapper arguments of the tables with an updated_at column, so the value written by the
+# database is returned by the INSERT/UPDATE itself instead of being lazy loaded later
+UPDATED_AT_MAPPER_ARGS = {"eager_defaults": True}
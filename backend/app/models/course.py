@@ -1,13 +1,26 @@
-from sqlmodel import Field, Relationship, Enum, Column, String
+import enum
+import json
+import uuid
+from datetime import datetime
+
 from pydantic import model_validator
+from sqlalchemy.orm import column_property
+from sqlmodel import (
+    Column,
+    Enum,
+    Field,
+    Index,
+    Relationship,
+    UniqueConstraint,
+    func,
+    select,
+)
 
-from .base import SQLModel
+from .base import UPDATED_AT_MAPPER_ARGS, SQLModel, UpdatedAtField
 from .CoursesUsersLink import CoursesUsersLink
+from .PendingEnrollment import PendingEnrollment
 from .user import User, UserPublic
-import uuid
-import json
-import enum
-from datetime import datetime
+
 
 class ColorEnum(str, enum.Enum):
     DEFAULT = "default"
@@ -33,18 +46,28 @@ class CourseBase(SQLModel):
     color: ColorEnum = Field(default=ColorEnum.DEFAULT, sa_column=Column(Enum(ColorEnum), nullable=False, server_default='DEFAULT'))
 
 class Course(CourseBase, table=True):
+    __table_args__ = (
+        UniqueConstraint("name", "academic_year", name="uq_course_name_academic_year"),
+        # Trigram indexes serving the ILIKE search on PostgreSQL
+        Index("ix_course_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_course_description_trgm", "description", postgresql_using="gin", postgresql_ops={"description": "gin_trgm_ops"}),
+    )
+    __mapper_args__ = UPDATED_AT_MAPPER_ARGS
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    updated_at: datetime | None = UpdatedAtField()
     users: list[User] = Relationship(back_populates="courses", link_model=CoursesUsersLink)
     practices: list["Practice"] = Relationship(back_populates="course", cascade_delete=True)
-    pending_niubs: str = Field(default="", sa_column=Column(String, nullable=False, server_default=""))
-    
-    @property
-    def students_count(self) -> int:
-        return sum(user.is_student for user in self.users if hasattr(user, "is_student"))
-    
-    @property
-    def programming_languages(self) -> list[str]:
-        return list({p.programming_language for p in self.practices if hasattr(p, "programming_language")})
+    pending_enrollments: list[PendingEnrollment] = Relationship(cascade_delete=True)
+
+# Computed by the database whenever a course is loaded, so serialising a CoursePublic doesn't need its users
+# Course.programming_languages is defined next to Practice
+Course.students_count = column_property(
+    select(func.count()).select_from(CoursesUsersLink).join(User).where(
+        CoursesUsersLink.course_id == Course.id,
+        User.is_student.is_(True)
+    ).correlate_except(CoursesUsersLink, User).scalar_subquery()
+)
 
 
 class CourseCreate(CourseBase):
@@ -72,6 +95,35 @@ class CoursePublic(CourseBase):
     programming_languages: list[str] = []
     last_access: datetime | None = None
 
+class RosterRowStatusEnum(str, enum.Enum):
+    ENROLLED = "enrolled"
+    ALREADY_ENROLLED = "already_enrolled"
+    PENDING = "pending"
+    DUPLICATE = "duplicate"
+    INVALID = "invalid"
+
+class GradebookFormatEnum(str, enum.Enum):
+    CSV = "csv"
+    XLSX = "xlsx"
+    # Moodle offline grading worksheet, built from the Qualification Table Entry of each correction
+    MOODLE = "moodle"
+
+class RosterRowReport(SQLModel):
+    # Line of the uploaded file, counting the header as line 1
+    row: int
+    niub: str | None = None
+    status: RosterRowStatusEnum
+    detail: str | None = None
+
+class CoursePublicWithRoster(CoursePublic):
+    roster: list[RosterRowReport] = []
+
+class CourseRosterSync(SQLModel):
+    added: list[str] = []
+    removed: list[str] = []
+    pending: list[str] = []
+    roster: list[RosterRowReport] = []
+
 class CoursePublicWithUsersAndPractices(CourseBase):
     id: uuid.UUID
     users: list[UserPublic] = []
@@ -87,4 +139,7 @@ class CoursePublicWithPractices(CourseBase):
 
 class CoursesPublic(SQLModel):
     data: list[CoursePublic]
-    count: int
\ No newline at end of file
+    # None when the caller opted out of the total count
+    count: int | None = None
+    # Pass it back as cursor to fetch the following page, None on the last page
+    next_cursor: str | None = None
@@ -1,17 +1,18 @@
 import enum
-from sqlmodel import Field, Relationship, Enum, Column
+import json
+import uuid
+from datetime import datetime
+
 from pydantic import model_validator
-from sqlalchemy.ext.hybrid import hybrid_property
-from typing import ClassVar
+from sqlalchemy import TypeDecorator, cast, type_coerce
+from sqlalchemy.orm import column_property
+from sqlmodel import Column, Enum, Field, Index, Relationship, String, func, select
 
-from datetime import datetime
-from .base import SQLModel
+from .base import UPDATED_AT_MAPPER_ARGS, SQLModel, UpdatedAtField
+from .course import Course, CoursePublic
 from .PracticesUsersLink import PracticesUsersLink, StatusEnum
 from .user import User, UserPublic
-import uuid
-import json
 
-from .course import Course, CoursePublic
 
 class ProgrammingLanguageEnum(str, enum.Enum):
     PYTHON = "python"
@@ -25,18 +26,45 @@ class ProgrammingLanguageEnum(str, enum.Enum):
     CSS = "css"
     R = "r"
 
+class ProgrammingLanguageList(TypeDecorator):
+    """ Comma separated programming language names, as aggregated by the database """
+    impl = String
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        # Enum columns are stored by name
+        return sorted({ProgrammingLanguageEnum[name] for name in value.split(",")}) if value else []
+
 class PracticeBase(SQLModel):
-    course_id: uuid.UUID | None = Field(default=None, foreign_key="course.id", ondelete="CASCADE")
+    course_id: uuid.UUID | None = Field(default=None, foreign_key="course.id", ondelete="CASCADE", index=True)
     name: str
     description: str
     programming_language: ProgrammingLanguageEnum = Field(default=ProgrammingLanguageEnum.PYTHON, sa_column=Column(Enum(ProgrammingLanguageEnum), nullable=False, server_default='PYTHON'))
     due_date: datetime
 
 class Practice(PracticeBase, table=True):
+    __table_args__ = (
+        # Trigram indexes serving the ILIKE search on PostgreSQL
+        Index("ix_practice_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_practice_description_trgm", "description", postgresql_using="gin", postgresql_ops={"description": "gin_trgm_ops"}),
+    )
+    __mapper_args__ = UPDATED_AT_MAPPER_ARGS
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    updated_at: datetime | None = UpdatedAtField()
     users: list[User] = Relationship(back_populates="practices", link_model=PracticesUsersLink)
     course: Course = Relationship(back_populates="practices")
 
+# Computed by the database whenever a course is loaded, so serialising a CoursePublic doesn't need its practices
+Course.programming_languages = column_property(
+    type_coerce(
+        select(func.aggregate_strings(cast(Practice.programming_language, String), ",")).where(
+            Practice.course_id == Course.id
+        ).correlate_except(Practice).scalar_subquery(),
+        ProgrammingLanguageList()
+    )
+)
+
 class PracticeCreate(PracticeBase):
     # This validator ensures that if the input is a JSON string, it gets parsed and converted to the appropriate model instance (mostly in form-data request)
     @model_validator(mode='before')
@@ -86,7 +114,10 @@ class PracticePublicWithCorrection(PracticePublic):
 
 class PracticesPublic(SQLModel):
     data: list[PracticePublic]
-    count: int
+    # None when the caller opted out of the total count
+    count: int | None = None
+    # Pass it back as cursor to fetch the following page, None on the last page
+    next_cursor: str | None = None
 
 class PracticesPublicWithCourse(SQLModel):
     data: list[PracticePublicWithCourse]
@@ -94,4 +125,4 @@ class PracticesPublicWithCourse(SQLModel):
 
 class PracticesPublicWithCorrection(SQLModel):
     data: list[PracticePublicWithCorrection]
-    count: int
\ No newline at end of file
+    count: int
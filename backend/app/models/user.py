@@ -1,10 +1,12 @@
+from datetime import datetime
+
 from pydantic import EmailStr
-from sqlmodel import Field, Relationship
+from sqlmodel import Field, Index, Relationship
 
-from .base import SQLModel
+from .base import UPDATED_AT_MAPPER_ARGS, SQLModel, UpdatedAtField
 from .CoursesUsersLink import CoursesUsersLink
 from .PracticesUsersLink import PracticesUsersLink
-import uuid
+
 
 class UserBase(SQLModel):
     niub: str = Field(primary_key=True, min_length=12, max_length=12)
@@ -16,7 +18,17 @@ class UserBase(SQLModel):
     is_admin: bool = Field(default=False)
 
 class User(UserBase, table=True):
+    __table_args__ = (
+        # Trigram indexes serving the ILIKE search on PostgreSQL, including the niub prefix match
+        Index("ix_user_niub_trgm", "niub", postgresql_using="gin", postgresql_ops={"niub": "gin_trgm_ops"}),
+        Index("ix_user_email_trgm", "email", postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}),
+        Index("ix_user_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_user_surnames_trgm", "surnames", postgresql_using="gin", postgresql_ops={"surnames": "gin_trgm_ops"}),
+    )
+    __mapper_args__ = UPDATED_AT_MAPPER_ARGS
+
     hashed_password: str
+    updated_at: datetime | None = UpdatedAtField()
     courses: list["Course"] = Relationship(back_populates="users", link_model=CoursesUsersLink)
     practices: list["Practice"] = Relationship(back_populates="users", link_model=PracticesUsersLink)
 
@@ -36,7 +48,7 @@ class UserUpdate(UserBase):
 
 class UserUpdateMe(SQLModel):
     email: EmailStr | None = Field(max_length=255)
-    name: str | None = Field(max_length=255) 
+    name: str | None = Field(max_length=255)
     surnames: str | None = Field(max_length=255)
 
 class UserUpdatePassword(SQLModel):
@@ -48,7 +60,10 @@ class UserPublic(UserBase):
 
 class UsersPublic(SQLModel):
     data: list[UserPublic]
-    count: int
+    # None when the caller opted out of the total count
+    count: int | None = None
+    # Pass it back as cursor to fetch the following page, None on the last page
+    next_cursor: str | None = None
 
 class UserCoursesOut(SQLModel):
     data: list["CoursePublic"]
@@ -74,4 +89,4 @@ class TokenPayload(SQLModel):
 
 class NewPassword(SQLModel):
     token: str
-    new_password: str = Field(min_length=8, max_length=40)
\ No newline at end of file
+    new_password: str = Field(min_length=8, max_length=40)
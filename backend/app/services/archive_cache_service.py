@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import suppress
+from typing import BinaryIO
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services import archive_service, sftp_service
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a cached archive per yielded chunk
+READ_CHUNK_BYTES = 256 * 1024
+ARCHIVE_SUFFIX = ".zip"
+PART_SUFFIX = ".part"
+# Leftovers of a build whose worker died, any live build writes more often than this
+PART_MAX_AGE = 24 * 3600
+
+# Bumped when the files of a practice change, an archive built from the files before is not stored
+_generations: dict[uuid.UUID, int] = defaultdict(int)
+# Builds running in this worker by archive path, every download of the same archive follows the same build
+_builds: dict[str, "_Build"] = {}
+
+
+class _Build:
+    """ An archive being written to its .part file, downloads read it as it grows """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.part_path = f"{path}.{uuid.uuid4().hex}{PART_SUFFIX}"
+        self.file = open(self.part_path, "wb")
+        self.size = 0
+        self.complete = False
+        self.done = False
+        self.error: Exception | None = None
+        # Set and replaced on every change, readers wait on the one current when they checked
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def wait(self, offset: int) -> None:
+        # Until more than offset bytes are written or the build ends
+        while offset >= self.size and not self.done:
+            await self.changed.wait()
+
+
+def _fingerprint(listing: list[tuple[str, sftp_service.RemoteEntry]]) -> str:
+    digest = hashlib.sha256()
+    for arcname, entry in listing:
+        digest.update(f"{arcname}\0{entry.size}\0{entry.mtime}\n".encode())
+    return digest.hexdigest()[:32]
+
+
+def _append(file: BinaryIO, chunk: bytes) -> None:
+    file.write(chunk)
+    # Readers have their own file object, they only see what is flushed
+    file.flush()
+
+
+def _evict() -> None:
+    # Least recently used first, serving an archive touches it
+    now = time.time()
+    archives = []
+    for entry in os.scandir(settings.ARCHIVE_CACHE_DIR):
+        stat = entry.stat()
+        if entry.name.endswith(ARCHIVE_SUFFIX):
+            archives.append((stat.st_mtime, stat.st_size, entry.path))
+        elif entry.name.endswith(PART_SUFFIX) and now - stat.st_mtime > PART_MAX_AGE:
+            with suppress(OSError):
+                os.remove(entry.path)
+
+    total = sum(size for _, size, _ in archives)
+    for _, size, path in sorted(archives):
+        if total <= settings.ARCHIVE_CACHE_MAX_BYTES:
+            break
+        # Downloads that already opened it keep reading it
+        with suppress(OSError):
+            os.remove(path)
+        total -= size
+
+
+def _unregister(build: _Build) -> None:
+    if _builds.get(build.path) is build:
+        del _builds[build.path]
+
+
+async def _build(build: _Build, practice_id: uuid.UUID, generation: int, sources: list[archive_service.Source]) -> None:
+    stored = False
+    try:
+        async for chunk in await archive_service.stream_archive(sources):
+            await run_in_threadpool(_append, build.file, chunk)
+            build.size += len(chunk)
+            build.notify()
+        build.complete = True
+        build.file.close()
+        # Downloads from here open the stored archive, not the .part file this is about to rename.
+        # Nothing is awaited until the rename
+        _unregister(build)
+        if _generations[practice_id] == generation:
+            os.replace(build.part_path, build.path)
+            stored = True
+            await run_in_threadpool(_evict)
+    except Exception as e:
+        logger.error(f"Error building the archive {build.path}: {str(e)}")
+        build.error = e
+    finally:
+        build.file.close()
+        if not stored:
+            with suppress(OSError):
+                os.remove(build.part_path)
+        build.done = True
+        _unregister(build)
+        build.notify()
+
+
+async def _read_file(file: BinaryIO) -> AsyncIterator[bytes]:
+    with file:
+        while chunk := await run_in_threadpool(file.read, READ_CHUNK_BYTES):
+            yield chunk
+
+
+async def _follow(build: _Build, file: BinaryIO) -> AsyncIterator[bytes]:
+    with file:
+        offset = 0
+        while True:
+            await build.wait(offset)
+            if offset < build.size:
+                chunk = await run_in_threadpool(file.read, min(READ_CHUNK_BYTES, build.size - offset))
+                if not chunk:
+                    raise RuntimeError(f"The archive {build.part_path} is shorter than written")
+                offset += len(chunk)
+                yield chunk
+            elif build.complete:
+                return
+            else:
+                raise build.error or RuntimeError("The archive build was stopped")
+
+
+async def stream_practice_archive(practice_id: uuid.UUID, sources: list[archive_service.Source]) -> AsyncIterator[bytes]:
+    """
+        Stream the ZIP of the submissions of a practice from the local cache, keyed by a fingerprint of the
+        names, sizes and modification times of its files. When the files changed the archive is built in the
+        background, stored for the next downloads, and streamed as it is written
+        :param practice_id: practice the sources belong to
+        :param sources: (remote directory, directory inside the ZIP) pairs, as for archive_service.stream_archive
+        :return: ZIP contents
+    """
+    if settings.ARCHIVE_CACHE_MAX_BYTES <= 0:
+        return await archive_service.stream_archive(sources)
+
+    generation = _generations[practice_id]
+    # Listing only, no file is read
+    fingerprint = _fingerprint(await archive_service.list_archive(sources))
+    path = os.path.join(settings.ARCHIVE_CACHE_DIR, f"{practice_id}-{fingerprint}{ARCHIVE_SUFFIX}")
+
+    # Nothing is awaited from the lookup to the open, a build can't be stored or an archive evicted in between
+    build = _builds.get(path)
+    if build is None:
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            pass
+        else:
+            os.utime(path)
+            return _read_file(file)
+
+        os.makedirs(settings.ARCHIVE_CACHE_DIR, exist_ok=True)
+        build = _builds[path] = _Build(path)
+        build.task = asyncio.create_task(_build(build, practice_id, generation, sources))
+    file = open(build.part_path, "rb")
+
+    # A build that fails before writing anything can still be answered with an error status
+    await build.wait(0)
+    if build.done and not build.complete:
+        file.close()
+        raise build.error or RuntimeError("The archive build was stopped")
+    return _follow(build, file)
+
+
+def invalidate(practice_id: uuid.UUID) -> None:
+    """
+        Drop the cached archives of a practice after its files changed. A change within the same second that
+        keeps the size would not change the fingerprint
+        :param practice_id: practice whose files changed
+    """
+    _generations[practice_id] += 1
+    prefix = f"{practice_id}-"
+    with suppress(FileNotFoundError):
+        for entry in os.scandir(settings.ARCHIVE_CACHE_DIR):
+            if entry.name.startswith(prefix) and entry.name.endswith(ARCHIVE_SUFFIX):
+                with suppress(OSError):
+                    os.remove(entry.path)
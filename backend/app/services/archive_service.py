@@ -0,0 +1,215 @@
+import asyncio
+import contextlib
+import logging
+import posixpath
+import time
+import zipfile
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services import sftp_service
+
+logger = logging.getLogger(__name__)
+
+# Oldest date a ZIP entry can hold
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+# Deflate can grow incompressible data slightly, entries close to the limit get zip64 sizes
+ZIP64_MARGIN = 1.05
+# Already compressed, deflating them again costs CPU time and saves nothing. Submissions are zips
+STORED_EXTENSIONS = {".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".jar", ".png", ".jpg", ".jpeg", ".mp4"}
+# Chunks a worker can read ahead of the archive for each source
+QUEUE_CHUNKS = 4
+SOURCES_AHEAD_PER_WORKER = 2
+
+# (remote directory, directory inside the ZIP), files are added with their path relative to the first
+Source = tuple[str, str]
+
+
+class _Sink:
+    """ Write-only file for zipfile, keeps what was written until it is taken """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _date_time(mtime: int) -> tuple[int, int, int, int, int, int]:
+    return max(time.localtime(mtime)[:6], ZIP_EPOCH)
+
+
+async def _walk(
+    sftp: sftp_service.AsyncSFTPClient,
+    remote_path: str,
+    arc_path: str
+) -> AsyncIterator[tuple[str, str, sftp_service.RemoteEntry]]:
+    try:
+        entries = await sftp.listdir(remote_path)
+    except FileNotFoundError:
+        # Skip directories that don't exist
+        return
+    except OSError as e:
+        logger.error(f"Error processing {remote_path}: {str(e)}")
+        return
+
+    for entry in sorted(entries, key=lambda entry: entry.name):
+        entry_path = posixpath.join(remote_path, entry.name)
+        arcname = posixpath.join(arc_path, entry.name) if arc_path else entry.name
+        if entry.is_dir:
+            async for item in _walk(sftp, entry_path, arcname):
+                yield item
+        else:
+            yield entry_path, arcname, entry
+
+
+def _zip_info(arcname: str, entry: sftp_service.RemoteEntry) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(arcname, _date_time(entry.mtime))
+    if posixpath.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+async def _fetch(
+    sftp: sftp_service.AsyncSFTPClient,
+    sources: list[Source],
+    queues: list[asyncio.Queue],
+    next_source: Iterator[int],
+    in_flight: asyncio.Semaphore
+) -> None:
+    # One worker: takes the next source, in order, and puts its files in the source's queue as
+    # (arcname, entry), the chunks and None, then a final None. An error is put in place of the rest
+    while True:
+        await in_flight.acquire()
+        index = next(next_source, None)
+        if index is None:
+            in_flight.release()
+            return
+        queue = queues[index]
+        remote_path, base_dir = sources[index]
+        try:
+            async for entry_path, arcname, entry in _walk(sftp, remote_path, base_dir):
+                chunks = sftp.read(entry_path)
+                try:
+                    # Opening the file, a file that can't be read is left out as long as nothing of it is written
+                    first = await anext(chunks, b"")
+                except OSError as e:
+                    logger.error(f"Error processing {entry_path}: {str(e)}")
+                    continue
+                await queue.put((arcname, entry))
+                await queue.put(first)
+                async for chunk in chunks:
+                    await queue.put(chunk)
+                await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+
+async def _get(queue: asyncio.Queue) -> Any:
+    message = await queue.get()
+    if isinstance(message, Exception):
+        # A failure past the first chunk aborts the download, the entry would be truncated
+        raise message
+    return message
+
+
+async def _borrow_clients(stack: contextlib.AsyncExitStack, sources: list[Source]) -> list[sftp_service.AsyncSFTPClient]:
+    # One connection per worker, returned to the pool when the stack closes
+    workers = max(1, min(settings.SFTP_ARCHIVE_WORKERS, len(sources)))
+    return [await stack.enter_async_context(sftp_service.async_sftp_client()) for _ in range(workers)]
+
+
+async def _zip_chunks(sources: list[Source]) -> AsyncIterator[bytes]:
+    sink = _Sink()
+    workers = max(1, min(settings.SFTP_ARCHIVE_WORKERS, len(sources)))
+    queues = [asyncio.Queue(maxsize=QUEUE_CHUNKS) for _ in sources]
+    next_source = iter(range(len(sources)))
+    # Sources fetched ahead of the one being written, memory stays bounded however many there are
+    in_flight = asyncio.Semaphore(workers * SOURCES_AHEAD_PER_WORKER)
+
+    async with contextlib.AsyncExitStack() as stack:
+        clients = await _borrow_clients(stack, sources)
+        # Empty first chunk, stream_archive waits for it so a connection error is raised before the response starts
+        yield b""
+
+        tasks = [asyncio.create_task(_fetch(sftp, sources, queues, next_source, in_flight)) for sftp in clients]
+        try:
+            # zipfile cannot seek the sink, it writes the sizes in a data descriptor after each file
+            with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+                # Written in the order of the sources whatever order the workers finish in
+                for queue in queues:
+                    while (message := await _get(queue)) is not None:
+                        arcname, entry = message
+                        force_zip64 = entry.size * ZIP64_MARGIN > zipfile.ZIP64_LIMIT
+                        with archive.open(_zip_info(arcname, entry), "w", force_zip64=force_zip64) as file:
+                            while (chunk := await _get(queue)) is not None:
+                                # Deflate runs in a thread, zlib releases the GIL and the event loop keeps serving
+                                await run_in_threadpool(file.write, chunk)
+                                if data := sink.take():
+                                    yield data
+                        # The data descriptor
+                        if data := sink.take():
+                            yield data
+                    in_flight.release()
+            # Central directory
+            yield sink.take()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def stream_archive(sources: list[Source]) -> AsyncIterator[bytes]:
+    """
+        Stream a ZIP of the files in the SFTP directories, read in chunks and compressed as they arrive.
+        Up to SFTP_ARCHIVE_WORKERS connections read the directories ahead in parallel, the archive keeps
+        the order of the sources. Nothing is stored on disk, memory is bounded, and zip64 is used when needed
+        :param sources: (remote directory, directory inside the ZIP) pairs, directories that don't exist are skipped
+        :return: ZIP contents, the SFTP connection is held until they are consumed
+    """
+    chunks = _zip_chunks(sources)
+    await anext(chunks)
+    return chunks
+
+
+async def list_archive(sources: list[Source]) -> list[tuple[str, sftp_service.RemoteEntry]]:
+    """
+        List the files stream_archive would write, in the same order, without reading them.
+        The directories are listed in parallel like stream_archive does
+        :param sources: (remote directory, directory inside the ZIP) pairs
+        :return: (name inside the ZIP, remote entry) of each file
+    """
+    listings: list[list[tuple[str, sftp_service.RemoteEntry]]] = [[] for _ in sources]
+    next_source = iter(range(len(sources)))
+
+    async def list_sources(sftp: sftp_service.AsyncSFTPClient) -> None:
+        for index in next_source:
+            remote_path, base_dir = sources[index]
+            listings[index] = [(arcname, entry) async for _, arcname, entry in _walk(sftp, remote_path, base_dir)]
+
+    async with contextlib.AsyncExitStack() as stack:
+        tasks = [asyncio.create_task(list_sources(sftp)) for sftp in await _borrow_clients(stack, sources)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On a failure the other workers must stop before their connections are returned
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return [item for listing in listings for item in listing]
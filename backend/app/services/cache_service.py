@@ -0,0 +1,35 @@
+from collections import defaultdict
+
+from sqlalchemy import Connection, Table, event
+from sqlalchemy.sql.dml import UpdateBase
+
+from app.core.db import async_engine
+
+# Bumped on every committed write to a table, cached values computed before are stale
+_generations: dict[str, int] = defaultdict(int)
+
+
+def generation(table: str) -> int:
+    return _generations[table]
+
+
+def invalidate(*tables: str) -> None:
+    """Mark the values cached from any of the given tables as stale."""
+    for table in tables:
+        _generations[table] += 1
+
+
+@event.listens_for(async_engine.sync_engine, "after_execute")
+def _track_writes(conn: Connection, clauseelement, _multiparams, _params, _execution_options, _result) -> None:
+    if isinstance(clauseelement, UpdateBase) and isinstance(clauseelement.table, Table):
+        conn.info.setdefault("cache_tables", set()).add(clauseelement.table.name)
+
+
+@event.listens_for(async_engine.sync_engine, "commit")
+def _invalidate_on_commit(conn: Connection) -> None:
+    invalidate(*conn.info.pop("cache_tables", ()))
+
+
+@event.listens_for(async_engine.sync_engine, "rollback")
+def _discard_on_rollback(conn: Connection) -> None:
+    conn.info.pop("cache_tables", None)
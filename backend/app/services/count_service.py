@@ -0,0 +1,72 @@
+import time
+
+from sqlalchemy import Table, text
+from sqlalchemy.sql import visitors
+from sqlmodel import SQLModel, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import SelectOfScalar
+
+from app.core.config import settings
+from app.services import cache_service
+
+# Cached totals: key -> (expiry, generations of the counted tables when computed, total)
+_cache: dict[str, tuple[float, dict[str, int], int]] = {}
+
+
+def _cache_key(statement: SelectOfScalar) -> str:
+    # The compiled SQL identifies the query shape, its parameters the filters and user scope
+    compiled = statement.compile()
+    return f"{compiled}|{sorted(compiled.params.items())!r}"
+
+
+async def count(session: AsyncSession, statement: SelectOfScalar[int]) -> int:
+    """
+        Run a COUNT statement, reusing its result while the counted tables are unchanged.
+        Writes committed by this worker invalidate it at once, and so do enrollment changes of other workers,
+        announced through membership_service. Any other write of another worker is only seen when the entry
+        expires, such a total is at most COUNT_CACHE_TTL seconds stale
+        :param session: database session
+        :param statement: select returning a single count
+        :return: total
+    """
+    if settings.COUNT_CACHE_TTL <= 0:
+        return (await session.exec(statement)).one()
+
+    key = _cache_key(statement)
+    now = time.monotonic()
+    cached = _cache.get(key)
+    if cached:
+        expires_at, generations, total = cached
+        if expires_at > now and all(cache_service.generation(table) == generation for table, generation in generations.items()):
+            return total
+        del _cache[key]
+
+    tables = {element.name for element in visitors.iterate(statement) if isinstance(element, Table)}
+    generations = {table: cache_service.generation(table) for table in tables}
+    total = (await session.exec(statement)).one()
+
+    if len(_cache) >= settings.COUNT_CACHE_MAX_ENTRIES:
+        # Entries are kept in insertion order, drop the oldest
+        del _cache[next(iter(_cache))]
+    _cache[key] = (now + settings.COUNT_CACHE_TTL, generations, total)
+    return total
+
+
+async def estimate(session: AsyncSession, model: type[SQLModel]) -> int:
+    """
+        Estimate the number of rows of a whole table from the PostgreSQL planner statistics
+        :param session: database session
+        :param model: table model to count
+        :return: estimated total, exact (and cached) when no statistics are available
+    """
+    table = model.__table__
+    if settings.DB_ENGINE == 'postgres':
+        reltuples = (await session.exec(
+            text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)"),
+            params={"name": f'"{table.name}"'}
+        )).scalar()
+        # reltuples is -1 until the table has been vacuumed or analyzed
+        if reltuples is not None and reltuples >= 0:
+            return int(reltuples)
+
+    return await count(session, select(func.count()).select_from(model))
@@ -0,0 +1,152 @@
+import uuid
+from collections.abc import Sequence
+
+from sqlalchemy import Insert, Uuid, and_, exists, insert, literal
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.models import (
+    CourseRoleEnum,
+    CoursesUsersLink,
+    PendingEnrollment,
+    Practice,
+    PracticesUsersLink,
+    StatusEnum,
+    User,
+)
+from app.services import membership_service, statistics_service
+from app.services.statistics_service import LinkState
+
+
+def _link_statement(condition: ColumnElement[bool]) -> Insert:
+    # Pair every course link matching the condition with the practices of its course, in a single INSERT ... SELECT
+    already_linked = exists().where(
+        PracticesUsersLink.user_niub == CoursesUsersLink.user_niub,
+        PracticesUsersLink.practice_id == Practice.id
+    )
+    return insert(PracticesUsersLink).from_select(
+        ["user_niub", "practice_id"],
+        select(CoursesUsersLink.user_niub, Practice.id)
+            .join(Practice, Practice.course_id == CoursesUsersLink.course_id)
+            .where(condition, ~already_linked)
+    )
+
+
+async def _link_course_practices(session: AsyncSession, condition: ColumnElement[bool]) -> None:
+    # Students apart, only their links are counted by the statistics
+    is_student = CoursesUsersLink.role == CourseRoleEnum.STUDENT
+    practice_ids = (await session.exec(
+        _link_statement(and_(condition, is_student)).returning(PracticesUsersLink.practice_id)
+    )).scalars().all()
+    await session.exec(_link_statement(and_(condition, ~is_student)))
+    await membership_service.announce(session, PracticesUsersLink.__tablename__)
+    await statistics_service.record(session, added=[
+        LinkState(practice_id, StatusEnum.NOT_SUBMITTED) for practice_id in practice_ids
+    ])
+
+
+async def _delete_practice_links(session: AsyncSession, *conditions: ColumnElement[bool]) -> None:
+    # Students first, while their course links still tell them apart
+    removed = (await session.exec(delete(PracticesUsersLink).where(
+        *conditions,
+        statistics_service.has_course_role(CourseRoleEnum.STUDENT)
+    ).returning(
+        PracticesUsersLink.practice_id,
+        PracticesUsersLink.status,
+        PracticesUsersLink.correction["grade"].as_float(),
+        PracticesUsersLink.submission_date
+    ))).all()
+    await session.exec(delete(PracticesUsersLink).where(*conditions))
+    await membership_service.announce(session, PracticesUsersLink.__tablename__)
+    await statistics_service.record(session, removed=[LinkState(*row) for row in removed])
+
+
+async def enroll_course_users(session: AsyncSession, *, course_id: uuid.UUID, users: Sequence[User]) -> None:
+    """
+        Enroll users in a course and in all of its practices
+        :param session: database session, the caller commits
+        :param course_id: course to enroll the users in
+        :param users: users not enrolled in the course yet
+    """
+    if not users:
+        return
+    await session.exec(insert(CoursesUsersLink).values([
+        {"user_niub": user.niub, "course_id": course_id, "role": crud.course.get_course_role(user)} for user in users
+    ]))
+    await membership_service.announce(session, CoursesUsersLink.__tablename__)
+    await _link_course_practices(session, and_(
+        CoursesUsersLink.course_id == course_id,
+        CoursesUsersLink.user_niub.in_([user.niub for user in users])
+    ))
+
+
+async def unenroll_course_users(session: AsyncSession, *, course_id: uuid.UUID, niubs: Sequence[str]) -> None:
+    """
+        Remove users from a course and from all of its practices, submissions included
+        :param session: database session, the caller commits
+        :param course_id: course to remove the users from
+        :param niubs: niubs of the users to remove
+    """
+    if not niubs:
+        return
+    await _delete_practice_links(
+        session,
+        PracticesUsersLink.user_niub.in_(niubs),
+        PracticesUsersLink.practice_id.in_(select(Practice.id).where(Practice.course_id == course_id))
+    )
+    await session.exec(delete(CoursesUsersLink).where(
+        CoursesUsersLink.course_id == course_id,
+        CoursesUsersLink.user_niub.in_(niubs)
+    ))
+    await membership_service.announce(session, CoursesUsersLink.__tablename__)
+
+
+async def unenroll_user(session: AsyncSession, *, niub: str) -> None:
+    """
+        Remove a user from all of their courses and practices, before the user is deleted
+        :param session: database session, the caller commits
+        :param niub: niub of the user
+    """
+    await _delete_practice_links(session, PracticesUsersLink.user_niub == niub)
+    await session.exec(delete(CoursesUsersLink).where(CoursesUsersLink.user_niub == niub))
+    await membership_service.announce(session, CoursesUsersLink.__tablename__)
+
+
+async def enroll_practice_users(session: AsyncSession, *, practice: Practice) -> None:
+    """
+        Link every user of the course of a new practice to it, and start its statistics
+        :param session: database session, the caller commits
+        :param practice: practice already flushed to the database
+    """
+    statistics_service.add_practice(session, practice_id=practice.id)
+    await _link_course_practices(session, and_(
+        CoursesUsersLink.course_id == practice.course_id,
+        Practice.id == literal(practice.id, Uuid)
+    ))
+
+
+async def enroll_pending_user(session: AsyncSession, *, user: User) -> list[uuid.UUID]:
+    """
+        Enroll a newly registered user in the courses and practices whose roster listed them
+        :param session: database session, the caller commits
+        :param user: registered user
+        :return: ids of the courses the user has been enrolled in
+    """
+    statement = select(PendingEnrollment.course_id).where(PendingEnrollment.niub == user.niub)
+    course_ids = list((await session.exec(statement)).all())
+    if not course_ids:
+        return course_ids
+
+    role = crud.course.get_course_role(user)
+    await session.exec(insert(CoursesUsersLink).values([
+        {"user_niub": user.niub, "course_id": course_id, "role": role} for course_id in course_ids
+    ]))
+    await membership_service.announce(session, CoursesUsersLink.__tablename__)
+    await _link_course_practices(session, and_(
+        CoursesUsersLink.user_niub == user.niub,
+        CoursesUsersLink.course_id.in_(course_ids)
+    ))
+    await session.exec(delete(PendingEnrollment).where(PendingEnrollment.niub == user.niub))
+    return course_ids
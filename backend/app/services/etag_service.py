@@ -0,0 +1,139 @@
+import hashlib
+import uuid
+from collections.abc import Callable
+
+from fastapi import Request, Response
+from sqlalchemy import BigInteger, Text, cast, literal, literal_column, true
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import SQLModel, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models import Course, CoursesUsersLink, Practice, PracticesUsersLink, User
+from app.services import cache_service
+
+CourseFilter = Callable[[InstrumentedAttribute], ColumnElement[bool]]
+
+
+def _stamp(model: type[SQLModel], *conditions: ColumnElement[bool]) -> list[ColumnElement]:
+    # Deleted rows don't move the latest update, the row count catches them
+    stamps = [
+        select(func.count()).select_from(model).where(*conditions).scalar_subquery(),
+        select(func.max(model.updated_at)).where(*conditions).scalar_subquery(),
+    ]
+    # updated_at only has the precision of the clock and is not set by bulk UPDATEs, the latest
+    # transaction that wrote a row is. Without PostgreSQL, committed writes of this worker bump a generation
+    if settings.DB_ENGINE == 'postgres':
+        xmin = cast(cast(literal_column(f'"{model.__tablename__}".xmin'), Text), BigInteger)
+        stamps.append(select(func.max(xmin)).select_from(model).where(*conditions).scalar_subquery())
+    else:
+        stamps.append(literal(cache_service.generation(model.__tablename__)))
+    return stamps
+
+
+def courses_stamps(courses: CourseFilter, user_niub: str) -> list[ColumnElement]:
+    """
+        Build the version stamps of everything a course payload is built from: the course, its members
+        (students_count, users, teacher), its practices (programming_languages) and the user's progress
+        :param courses: builds the condition selecting the courses from a course id column
+        :param user_niub: niub of the user whose progress is included
+        :return: columns to select together
+    """
+    return [
+        *_stamp(Course, courses(Course.id)),
+        *_stamp(CoursesUsersLink, courses(CoursesUsersLink.course_id)),
+        *_stamp(User, User.niub.in_(select(CoursesUsersLink.user_niub).where(courses(CoursesUsersLink.course_id)))),
+        *_stamp(Practice, courses(Practice.course_id)),
+        *_stamp(
+            PracticesUsersLink,
+            PracticesUsersLink.user_niub == user_niub,
+            PracticesUsersLink.practice_id.in_(select(Practice.id).where(courses(Practice.course_id)))
+        ),
+    ]
+
+
+async def _etag(session: AsyncSession, user: User, stamps: list[ColumnElement]) -> str:
+    # A single round trip, the stamps are aggregates over indexed foreign keys
+    values = (await session.exec(select(*stamps))).one()
+    # The payloads depend on who asks for them, the same URL gets a different tag per user
+    digest = hashlib.sha256(repr((user.niub, user.is_admin, tuple(values))).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+async def course_etag(session: AsyncSession, *, course_id: uuid.UUID, user: User) -> str:
+    """
+        Compute the ETag of a course as seen by a user
+        :param session: database session
+        :param course_id: course id
+        :param user: user requesting it
+        :return: strong entity tag
+    """
+    return await _etag(session, user, courses_stamps(lambda column: column == course_id, user.niub))
+
+
+async def practice_etag(session: AsyncSession, *, practice: Practice, user: User) -> str:
+    """
+        Compute the ETag of a practice, including its course, as seen by a user
+        :param session: database session
+        :param practice: practice
+        :param user: user requesting it
+        :return: strong entity tag
+    """
+    return await _etag(session, user, [
+        *courses_stamps(lambda column: column == practice.course_id, user.niub),
+        *_stamp(PracticesUsersLink, PracticesUsersLink.practice_id == practice.id),
+        *_stamp(User, User.niub.in_(select(PracticesUsersLink.user_niub).where(PracticesUsersLink.practice_id == practice.id))),
+    ])
+
+
+def user_courses_stamps(user: User, all_courses: bool = False) -> list[ColumnElement]:
+    """
+        Build the version stamps of the courses of a user and their practices
+        :param user: user requesting them
+        :param all_courses: cover every course instead of the ones the user is enrolled in
+        :return: columns to select together
+    """
+    enrolled = select(CoursesUsersLink.course_id).where(CoursesUsersLink.user_niub == user.niub)
+
+    def courses(column: InstrumentedAttribute) -> ColumnElement[bool]:
+        return true() if all_courses else column.in_(enrolled)
+
+    return courses_stamps(courses, user.niub)
+
+
+async def user_courses_etag(session: AsyncSession, *, user: User, all_courses: bool = False) -> str:
+    """
+        Compute the ETag of the courses of a user and their practices
+        :param session: database session
+        :param user: user requesting them
+        :param all_courses: cover every course instead of the ones the user is enrolled in
+        :return: strong entity tag
+    """
+    return await _etag(session, user, user_courses_stamps(user, all_courses))
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Response | None:
+    """
+        Tag the response and check the client's cached copy against it
+        :param request: incoming request
+        :param response: response the route will return
+        :param etag: current entity tag of the resource
+        :return: 304 response when the If-None-Match header matches, None otherwise
+    """
+    headers = {
+        "ETag": etag,
+        # Cached by the browser only, and revalidated before every use
+        "Cache-Control": "private, no-cache",
+        "Vary": "Authorization",
+    }
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return None
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+    return None
@@ -0,0 +1,268 @@
+import csv
+import io
+import os
+import re
+import tempfile
+from collections.abc import AsyncIterator, Callable
+from datetime import datetime
+from typing import Any
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import async_engine
+from app.models import (
+    Course,
+    CourseRoleEnum,
+    CoursesUsersLink,
+    GradebookFormatEnum,
+    Practice,
+    PracticesUsersLink,
+    StatusEnum,
+    User,
+)
+
+# Rows fetched from the server-side cursor, and written per yielded chunk
+EXPORT_BATCH_ROWS = 500
+XLSX_CHUNK_BYTES = 64 * 1024
+
+STUDENT_COLUMNS = ["niub", "nom", "cognoms", "email"]
+PRACTICE_COLUMNS = ["estat", "data_entrega", "qualificacio", "comentaris"]
+# Header of the Moodle grading worksheet, used when no correction carries its own
+MOODLE_COLUMNS = [
+    "Identificador",
+    "Nom complet",
+    "Adreça electrònica",
+    "Estat",
+    "Qualificació",
+    "Qualificació màxima",
+    "La qualificació es pot canviar",
+    "Darrera modificació (qualificació)",
+    "Comentaris de retroalimentació",
+]
+
+MEDIA_TYPES = {
+    GradebookFormatEnum.CSV: "text/csv",
+    GradebookFormatEnum.XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    GradebookFormatEnum.MOODLE: "text/csv",
+}
+EXTENSIONS = {
+    GradebookFormatEnum.CSV: "csv",
+    GradebookFormatEnum.XLSX: "xlsx",
+    GradebookFormatEnum.MOODLE: "csv",
+}
+
+Rows = AsyncIterator[list[Any]]
+
+# Text starting with one of these is run as a formula by spreadsheets, names and comments are typed by users
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _escape(value: Any) -> Any:
+    # A leading quote keeps the text as text, negative numbers stay numbers
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not _is_number(value):
+        return f"'{value}"
+    return value
+
+
+def _grade(status: StatusEnum | None, grade: float | None) -> float | str:
+    return grade if status == StatusEnum.CORRECTED and grade is not None else ""
+
+
+async def _course_rows(session: AsyncSession, course_id: Any) -> Rows:
+    practices = (await session.exec(
+        select(Practice.id, Practice.name).where(Practice.course_id == course_id).order_by(Practice.due_date, Practice.name)
+    )).all()
+    columns = {practice_id: index for index, (practice_id, _) in enumerate(practices)}
+    yield [*STUDENT_COLUMNS, *(name for _, name in practices)]
+
+    # One row per student and practice, a student's rows are contiguous thanks to the niub tiebreak
+    statement = select(
+        User.niub,
+        User.name,
+        User.surnames,
+        User.email,
+        PracticesUsersLink.practice_id,
+        PracticesUsersLink.status,
+        PracticesUsersLink.correction["grade"].as_float()
+    ).select_from(CoursesUsersLink).join(User, User.niub == CoursesUsersLink.user_niub).outerjoin(
+        PracticesUsersLink,
+        and_(PracticesUsersLink.user_niub == User.niub, PracticesUsersLink.practice_id.in_(list(columns)))
+    ).where(
+        CoursesUsersLink.course_id == course_id,
+        CoursesUsersLink.role == CourseRoleEnum.STUDENT
+    ).order_by(User.surnames, User.name, User.niub).execution_options(yield_per=EXPORT_BATCH_ROWS)
+
+    row = None
+    async for niub, name, surnames, email, practice_id, status, grade in await session.stream(statement):
+        if row is None or row[0] != niub:
+            if row is not None:
+                yield row
+            row = [niub, name, surnames, email, *([""] * len(columns))]
+        if practice_id in columns:
+            row[len(STUDENT_COLUMNS) + columns[practice_id]] = _grade(status, grade)
+    if row is not None:
+        yield row
+
+
+def _practice_statement(practice_id: Any, *columns: Any):
+    return select(*columns).select_from(PracticesUsersLink).join(
+        User, User.niub == PracticesUsersLink.user_niub
+    ).join(Practice, Practice.id == PracticesUsersLink.practice_id).join(
+        CoursesUsersLink,
+        and_(CoursesUsersLink.course_id == Practice.course_id, CoursesUsersLink.user_niub == User.niub)
+    ).where(
+        PracticesUsersLink.practice_id == practice_id,
+        CoursesUsersLink.role == CourseRoleEnum.STUDENT
+    ).order_by(User.surnames, User.name, User.niub).execution_options(yield_per=EXPORT_BATCH_ROWS)
+
+
+async def _practice_rows(session: AsyncSession, practice_id: Any) -> Rows:
+    yield [*STUDENT_COLUMNS, *PRACTICE_COLUMNS]
+    # Only the grade and the feedback are read from the correction, not the whole report
+    statement = _practice_statement(
+        practice_id,
+        User.niub,
+        User.name,
+        User.surnames,
+        User.email,
+        PracticesUsersLink.status,
+        PracticesUsersLink.submission_date,
+        PracticesUsersLink.correction["grade"].as_float(),
+        PracticesUsersLink.correction["feedback_comments"].as_string()
+    )
+    async for niub, name, surnames, email, status, submission_date, grade, feedback in await session.stream(statement):
+        yield [niub, name, surnames, email, status.value, submission_date or "", _grade(status, grade), feedback or ""]
+
+
+def _parse_qualification_entry(entry: str) -> tuple[list[str], list[list[str]]]:
+    # Stored as returned by the corrector, inside a markdown code block
+    header, *rows = csv.reader(io.StringIO(entry.strip().removeprefix("```").removesuffix("```").strip()))
+    return header, rows
+
+
+async def _moodle_rows(session: AsyncSession, practice_id: Any) -> Rows:
+    statement = _practice_statement(
+        practice_id,
+        PracticesUsersLink.correction["qualification_table_entry"].as_string()
+    ).where(PracticesUsersLink.status == StatusEnum.CORRECTED)
+
+    header = None
+    async for entry, in await session.stream(statement):
+        if not entry:
+            continue
+        try:
+            entry_header, entry_rows = _parse_qualification_entry(entry)
+        except (csv.Error, ValueError):
+            continue
+        if header is None:
+            header = entry_header
+            yield header
+        for entry_row in entry_rows:
+            if entry_header == header:
+                yield entry_row
+            else:
+                # Reorder the values by column name when a correction has a different header
+                values = dict(zip(entry_header, entry_row, strict=False))
+                yield [values.get(column, "") for column in header]
+
+    if header is None:
+        yield MOODLE_COLUMNS
+
+
+async def _csv_chunks(rows: Rows, escape: bool) -> AsyncIterator[bytes]:
+    # Excel only detects UTF-8 with the BOM, Moodle strips it
+    buffer = io.StringIO()
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+    count = 0
+    async for row in rows:
+        writer.writerow([_escape(value) for value in row] if escape else row)
+        count += 1
+        if count % EXPORT_BATCH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def _xlsx_chunks(rows: Rows, sheet_name: str) -> AsyncIterator[bytes]:
+    # An XLSX is a zip that can only be assembled once all rows are known, constant_memory
+    # flushes every row to a temporary file so memory stays flat while it is built on disk
+    import xlsxwriter
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "tmpdir": tempfile.gettempdir()})
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+        # Sheet names are limited to 31 characters and some punctuation is not allowed
+        worksheet = workbook.add_worksheet(re.sub(r"[\[\]:*?/\\]", "", sheet_name)[:31] or None)
+        index = 0
+        async for row in rows:
+            for column, value in enumerate(row):
+                # Explicit writers, write() would turn text starting with = into a formula
+                if isinstance(value, datetime):
+                    worksheet.write_datetime(index, column, value, date_format)
+                elif isinstance(value, (int, float)):
+                    worksheet.write_number(index, column, value)
+                elif value != "":
+                    worksheet.write_string(index, column, str(value))
+            index += 1
+        await run_in_threadpool(workbook.close)
+
+        with open(path, "rb") as file:
+            while chunk := await run_in_threadpool(file.read, XLSX_CHUNK_BYTES):
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+async def _stream(
+    build_rows: Callable[[AsyncSession, Any], Rows],
+    id: Any,
+    file_format: GradebookFormatEnum,
+    sheet_name: str
+) -> AsyncIterator[bytes]:
+    # The body is sent after the request's session is closed, the export reads with its own
+    async with AsyncSession(async_engine) as session:
+        rows = build_rows(session, id)
+        if file_format == GradebookFormatEnum.XLSX:
+            chunks = _xlsx_chunks(rows, sheet_name)
+        else:
+            # Only the plain CSV is opened in a spreadsheet, Moodle imports the values as they are
+            chunks = _csv_chunks(rows, escape=file_format == GradebookFormatEnum.CSV)
+        async for chunk in chunks:
+            yield chunk
+
+
+def stream_course_gradebook(course: Course, file_format: GradebookFormatEnum) -> AsyncIterator[bytes]:
+    """
+        Stream the grades of every student of a course, one column per practice
+        :param course: course to export
+        :param file_format: csv or xlsx
+        :return: file contents, produced as the rows are read
+    """
+    return _stream(_course_rows, course.id, file_format, "Qualificacions")
+
+
+def stream_practice_gradebook(practice: Practice, file_format: GradebookFormatEnum) -> AsyncIterator[bytes]:
+    """
+        Stream the status, grade and feedback of every student of a practice
+        :param practice: practice to export
+        :param file_format: csv, xlsx or moodle
+        :return: file contents, produced as the rows are read
+    """
+    if file_format == GradebookFormatEnum.MOODLE:
+        return _stream(_moodle_rows, practice.id, file_format, practice.name)
+    return _stream(_practice_rows, practice.id, file_format, practice.name)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+import uuid
+
+import psycopg
+from sqlalchemy import make_url, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.core.config import settings
+from app.models import CoursesUsersLink, PracticesUsersLink
+from app.services import cache_service
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL channel on which every worker announces the link tables it changed
+CHANNEL = "golem_membership_cache"
+LISTEN_RETRY_SECONDS = 5
+
+# Memberships: (link table, course or practice id, niub) -> (expiry, generation of the link table, member)
+_cache: dict[tuple[str, uuid.UUID, str], tuple[float, int, bool]] = {}
+# Whether the changes of the other workers reach this one, a membership can only be granted from the cache then
+_listening = False
+
+
+def _get(key: tuple[str, uuid.UUID, str]) -> bool | None:
+    cached = _cache.get(key)
+    if cached:
+        expires_at, generation, member = cached
+        if expires_at > time.monotonic() and cache_service.generation(key[0]) == generation:
+            return member
+        del _cache[key]
+    return None
+
+
+def _set(key: tuple[str, uuid.UUID, str], generation: int, member: bool) -> None:
+    # A removal committed by another worker would not be seen until the entry expires. Being refused
+    # for a while after an enrollment is harmless, being let in after a removal is not
+    if member and settings.DB_ENGINE == 'postgres' and not _listening:
+        return
+    if len(_cache) >= settings.MEMBERSHIP_CACHE_MAX_ENTRIES:
+        # Entries are kept in insertion order, drop the oldest
+        del _cache[next(iter(_cache))]
+    _cache[key] = (time.monotonic() + settings.MEMBERSHIP_CACHE_TTL, generation, member)
+
+
+async def is_course_member(session: AsyncSession, *, course_id: uuid.UUID, user_niub: str) -> bool:
+    """
+        Check whether a user is enrolled in a course, without loading the course users
+        :param session: database session
+        :param course_id: course id
+        :param user_niub: niub of the user
+        :return: True when enrolled, as a student or as a teacher
+    """
+    key = (CoursesUsersLink.__tablename__, course_id, user_niub)
+    member = _get(key)
+    if member is None:
+        generation = cache_service.generation(key[0])
+        member = await crud.course.is_course_member(session=session, course_id=course_id, user_niub=user_niub)
+        _set(key, generation, member)
+    return member
+
+
+async def is_practice_member(session: AsyncSession, *, practice_id: uuid.UUID, user_niub: str) -> bool:
+    """
+        Check whether a user is linked to a practice, without loading the practice users
+        :param session: database session
+        :param practice_id: practice id
+        :param user_niub: niub of the user
+        :return: True when linked
+    """
+    key = (PracticesUsersLink.__tablename__, practice_id, user_niub)
+    member = _get(key)
+    if member is None:
+        generation = cache_service.generation(key[0])
+        member = await crud.practice.is_practice_member(session=session, practice_id=practice_id, user_niub=user_niub)
+        _set(key, generation, member)
+    return member
+
+
+async def announce(session: AsyncSession, table: str) -> None:
+    """
+        Make every other worker drop the memberships of a link table once the transaction commits,
+        this one drops them on the commit
+        :param session: database session where the links are written, the caller commits
+        :param table: name of the link table
+    """
+    if settings.DB_ENGINE == 'postgres':
+        # Delivered on commit, dropped on rollback
+        await session.exec(text("SELECT pg_notify(:channel, :table)"), params={"channel": CHANNEL, "table": table})
+
+
+async def listen() -> None:
+    """Drop the memberships of the link tables announced by the other workers, until cancelled."""
+    global _listening
+    conninfo = make_url(str(settings.SQLALCHEMY_DATABASE_URI)).set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {CHANNEL}")
+                # Changes announced while disconnected were missed, also by the checks running now
+                cache_service.invalidate(CoursesUsersLink.__tablename__, PracticesUsersLink.__tablename__)
+                _listening = True
+                async for notify in conn.notifies():
+                    # A new generation, a membership read before the change is not stored afterwards
+                    cache_service.invalidate(notify.payload)
+        except psycopg.Error as e:
+            logger.warning(f"Membership cache invalidation channel lost, retrying: {str(e)}")
+        finally:
+            _listening = False
+            _cache.clear()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
@@ -0,0 +1,128 @@
+import base64
+import json
+from collections.abc import Sequence
+from typing import Any
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession as SQLAlchemyAsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import SelectOfScalar
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row of a page as an opaque cursor."""
+    payload = json.dumps(list(values), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def _load_cursor(cursor: str, length: int) -> list[Any]:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(payload)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Malformed cursor") from e
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Cursor does not match the sort key")
+    return values
+
+
+def _typed(values: Sequence[Any], keys: Sequence[InstrumentedAttribute]) -> list[Any]:
+    try:
+        # The model field annotation gives the Python type of each key (str, uuid.UUID, datetime...)
+        return [
+            TypeAdapter(key.class_.model_fields[key.key].annotation).validate_python(value)
+            for key, value in zip(keys, values, strict=True)
+        ]
+    except ValidationError as e:
+        raise ValueError("Cursor does not match the sort key") from e
+
+
+def decode_cursor(cursor: str, keys: Sequence[InstrumentedAttribute]) -> list[Any]:
+    """Decode a cursor back into sort key values typed like the key columns."""
+    return _typed(_load_cursor(cursor, len(keys)), keys)
+
+
+def decode_ranked_cursor(cursor: str, keys: Sequence[InstrumentedAttribute]) -> tuple[float, list[Any]]:
+    """Decode the cursor of ranked results, which holds the rank of the last row followed by its sort key."""
+    rank, *values = _load_cursor(cursor, len(keys) + 1)
+    if isinstance(rank, bool) or not isinstance(rank, (int, float)):
+        raise ValueError("Cursor does not match the sort key")
+    return float(rank), _typed(values, keys)
+
+
+def page_statement(
+    statement: SelectOfScalar,
+    *,
+    keys: Sequence[InstrumentedAttribute],
+    skip: int,
+    limit: int,
+    cursor: str | None = None,
+    rank: ColumnElement[float] | None = None
+) -> SelectOfScalar:
+    """
+        Build the statement fetching one page, see paginate
+        :raises ValueError: when the cursor does not match the sort key
+    """
+    if rank is not None:
+        # The rank is selected too, the cursor carries the one of the last row
+        statement = statement.add_columns(rank).order_by(rank.desc(), *(key.desc() for key in keys))
+        if cursor:
+            last_rank, values = decode_ranked_cursor(cursor, keys)
+            statement = statement.where(tuple_(rank, *keys) < tuple_(last_rank, *values))
+        else:
+            statement = statement.offset(skip)
+    elif cursor:
+        values = decode_cursor(cursor, keys)
+        statement = statement.order_by(*keys).where(tuple_(*keys) > tuple_(*values))
+    else:
+        statement = statement.order_by(*keys).offset(skip)
+    return statement.limit(limit)
+
+
+async def paginate(
+    session: AsyncSession,
+    statement: SelectOfScalar,
+    *,
+    keys: Sequence[InstrumentedAttribute],
+    skip: int,
+    limit: int,
+    cursor: str | None = None,
+    rank: ColumnElement[float] | None = None
+) -> tuple[list[Any], str | None]:
+    """
+        Fetch one page of a single entity statement ordered by a unique sort key
+        :param session: database session
+        :param statement: select statement of the entity to paginate
+        :param keys: columns forming a unique, stable sort key (usually the primary key)
+        :param skip: offset, only used when no cursor is given
+        :param limit: page size
+        :param cursor: next_cursor returned by the previous page, enables keyset pagination
+        :param rank: relevance to order by before the keys, higher first. Rows with the same rank are
+            ordered by the keys in descending order, so both can be sought together
+        :return: rows of the page and the cursor of the next page, None on the last page
+    """
+    try:
+        statement = page_statement(statement, keys=keys, skip=skip, limit=limit, cursor=cursor, rank=rank)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    last_rank = None
+    if rank is not None:
+        # sqlmodel's exec() would only return the entity of a SelectOfScalar, not the rank added to it
+        ranked = (await SQLAlchemyAsyncSession.execute(session, statement)).all()
+        rows = [row[0] for row in ranked]
+        if ranked:
+            last_rank = ranked[-1][1]
+    else:
+        rows = (await session.exec(statement)).all()
+
+    next_cursor = None
+    if limit > 0 and len(rows) == limit:
+        values = [getattr(rows[-1], key.key) for key in keys]
+        next_cursor = encode_cursor([last_rank, *values] if rank is not None else values)
+
+    return list(rows), next_cursor
@@ -0,0 +1,64 @@
+import asyncio
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import TypeVar
+
+from fastapi import HTTPException
+
+from app.core import security
+from app.core.config import settings
+
+T = TypeVar("T")
+
+_executor: ProcessPoolExecutor | None = None
+# Hashes submitted and not finished yet, running or waiting for a free process
+_pending = 0
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+    if _executor is None and settings.PASSWORD_HASH_WORKERS > 0:
+        # spawn, forking a process that runs the event loop and its threads is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+async def _run(function: Callable[..., T], *args) -> T:
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many password checks in progress, try again later",
+            headers={"Retry-After": "1"}
+        )
+    _pending += 1
+    try:
+        # Without a process pool the default executor (a thread pool) is used
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), function, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(security.get_password_hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+        Check a password against its hash
+        :param password: plain password
+        :param hashed_password: stored hash
+        :return: whether it matches and, when the stored hash uses an outdated cost factor, its new hash
+    """
+    return await _run(security.verify_and_update_password, password, hashed_password)
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
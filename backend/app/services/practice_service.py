@@ -1,9 +1,12 @@
-import pika
 import json
+
 from app.core.config import settings
 
+
 def send_practice_data(body):
     """Envía un mensaje a la cola del queue worker de corrección de prácticas."""
+    import pika
+
     connection = pika.BlockingConnection(
         pika.URLParameters(settings.CLOUDAMQP_URL)
     )
@@ -11,10 +14,10 @@ def send_practice_data(body):
 
     # Declarar la cola principal - debe coincidir con la configuración del worker
     channel.queue_declare(queue="practicas", durable=True)
-    
+
     # Declarar la cola de reintentos con TTL
     channel.queue_declare(
-        queue="retry.practicas", 
+        queue="retry.practicas",
         durable=True,
         arguments={
             "x-message-ttl": 5000,  # 5 segundos de retraso
@@ -22,13 +25,13 @@ def send_practice_data(body):
             "x-dead-letter-routing-key": "practicas"
         }
     )
-    
+
     # Declarar la cola DLQ para mensajes fallidos permanentemente
     channel.queue_declare(queue="practicas.dlq", durable=True)
 
     # Inicializar headers con contador de reintentos a 0
     headers = {"retry_count": 0}
-    
+
     message = json.dumps(body).encode('utf-8')
     channel.basic_publish(
         exchange="",
@@ -41,4 +44,4 @@ def send_practice_data(body):
     )
     print(f" [x] Sended to worker {message}")
 
-    connection.close()
\ No newline at end of file
+    connection.close()
@@ -0,0 +1,151 @@
+import codecs
+import csv
+import os
+import uuid
+from collections.abc import Iterator, Sequence
+from typing import Any, BinaryIO
+
+from sqlalchemy import and_
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud
+from app.models import (
+    CourseRoleEnum,
+    CourseRosterSync,
+    CoursesUsersLink,
+    PendingEnrollment,
+    RosterRowReport,
+    RosterRowStatusEnum,
+    User,
+)
+from app.services import enrollment_service
+
+NIUB_COLUMN = "niub"
+NIUB_LENGTH = 12
+CSV_SNIFF_BYTES = 4096
+
+
+class RosterError(ValueError):
+    pass
+
+
+def _iter_csv_rows(file: BinaryIO) -> Iterator[Sequence[Any]]:
+    sample = file.read(CSV_SNIFF_BYTES)
+    file.seek(0)
+    try:
+        # Spreadsheets exported with a Catalan or Spanish locale separate the columns with ';'
+        dialect = csv.Sniffer().sniff(sample.decode("utf-8-sig", errors="ignore"), delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    lines = codecs.getreader("utf-8-sig")(file)
+    yield from csv.reader(lines, dialect)
+
+
+def _iter_xlsx_rows(file: BinaryIO) -> Iterator[Sequence[Any]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _normalize_niub(value: Any) -> str | None:
+    if value is None:
+        return None
+    # Numeric cells come back as numbers from the spreadsheet
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    niub = str(value).strip()
+    return niub or None
+
+
+def parse_roster(file: BinaryIO, filename: str) -> list[RosterRowReport]:
+    """
+        Read the niub column of a CSV or XLSX roster row by row, without loading the whole sheet
+        :param file: uploaded file
+        :param filename: name of the uploaded file, its extension selects the format
+        :return: one report per data row, valid niubs are reported as pending until their users are resolved
+    """
+    _, extension = os.path.splitext(filename or "")
+    if extension.lower() == ".csv":
+        rows = _iter_csv_rows(file)
+    elif extension.lower() == ".xlsx":
+        rows = _iter_xlsx_rows(file)
+    else:
+        raise RosterError("Solo se puede subir archivos csv o excel")
+
+    header = next(rows, None) or ()
+    columns = [str(column).strip().lower() if column is not None else "" for column in header]
+    if NIUB_COLUMN not in columns:
+        raise RosterError(f"El archivo debe contener una columna llamada '{NIUB_COLUMN}'")
+    niub_index = columns.index(NIUB_COLUMN)
+
+    reports = []
+    seen = set()
+    for line, row in enumerate(rows, start=2):
+        if not any(cell not in (None, "") for cell in row):
+            continue
+        niub = _normalize_niub(row[niub_index] if niub_index < len(row) else None)
+        if niub is None:
+            reports.append(RosterRowReport(row=line, status=RosterRowStatusEnum.INVALID, detail="Missing niub"))
+        elif len(niub) != NIUB_LENGTH:
+            reports.append(RosterRowReport(row=line, niub=niub, status=RosterRowStatusEnum.INVALID, detail=f"The niub must have {NIUB_LENGTH} characters"))
+        elif niub in seen:
+            reports.append(RosterRowReport(row=line, niub=niub, status=RosterRowStatusEnum.DUPLICATE, detail="Repeated in the roster"))
+        else:
+            seen.add(niub)
+            reports.append(RosterRowReport(row=line, niub=niub, status=RosterRowStatusEnum.PENDING))
+    return reports
+
+
+async def sync_course_roster(session: AsyncSession, *, course_id: uuid.UUID, roster: list[RosterRowReport]) -> CourseRosterSync:
+    """
+        Make the students of a course match a full roster, enrolling the new ones and removing the missing ones
+        :param session: database session, the caller commits
+        :param course_id: course to synchronise
+        :param roster: parsed roster, the status of its rows is updated with the outcome
+        :return: niubs added, removed and left pending, with the updated roster
+    """
+    rows = [report for report in roster if report.status == RosterRowStatusEnum.PENDING]
+    niubs = [report.niub for report in rows]
+
+    # Roster users with their current membership, the other niubs have no account yet
+    statement = select(User, CoursesUsersLink.user_niub.is_not(None)).outerjoin(
+        CoursesUsersLink,
+        and_(CoursesUsersLink.user_niub == User.niub, CoursesUsersLink.course_id == course_id)
+    ).where(User.niub.in_(niubs))
+    found = {user.niub: (user, is_member) for user, is_member in (await session.exec(statement)).all()}
+
+    # Teachers are never removed by a roster, only students missing from it
+    removed = list((await session.exec(
+        select(CoursesUsersLink.user_niub).where(
+            CoursesUsersLink.course_id == course_id,
+            CoursesUsersLink.role == CourseRoleEnum.STUDENT,
+            CoursesUsersLink.user_niub.not_in(niubs)
+        ).order_by(CoursesUsersLink.user_niub)
+    )).all())
+
+    added = []
+    pending = []
+    for report in rows:
+        user, is_member = found.get(report.niub, (None, False))
+        if user is None:
+            report.detail = "Enrolled when the user signs up"
+            pending.append(report.niub)
+        elif is_member:
+            report.status = RosterRowStatusEnum.ALREADY_ENROLLED
+        elif not user.is_student:
+            report.status, report.detail = RosterRowStatusEnum.INVALID, "The user is not a student"
+        else:
+            report.status = RosterRowStatusEnum.ENROLLED
+            added.append(user)
+
+    await enrollment_service.unenroll_course_users(session, course_id=course_id, niubs=removed)
+    await enrollment_service.enroll_course_users(session, course_id=course_id, users=added)
+    await session.exec(delete(PendingEnrollment).where(PendingEnrollment.course_id == course_id))
+    await crud.course.add_pending_enrollments(session=session, course_id=course_id, niubs=pending)
+
+    return CourseRosterSync(added=[user.niub for user in added], removed=removed, pending=pending, roster=roster)
@@ -0,0 +1,38 @@
+from collections.abc import Sequence
+
+from sqlalchemy import Float, case, cast, false, func, or_
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.core.config import settings
+
+
+def search(
+    term: str,
+    *,
+    columns: Sequence[InstrumentedAttribute],
+    prefix_columns: Sequence[InstrumentedAttribute] = ()
+) -> tuple[ColumnElement[bool], ColumnElement[float]]:
+    """
+        Build the filter and relevance of a case insensitive search
+        :param term: text typed by the user
+        :param columns: columns matched anywhere in their value
+        :param prefix_columns: columns only matched from their start (identifiers such as the niub)
+        :return: condition selecting the matching rows and rank ordering them, higher is more relevant
+    """
+    # On PostgreSQL both patterns are served by the pg_trgm GIN indexes declared on the models
+    matches = [column.icontains(term, autoescape=True) for column in columns]
+    prefix_matches = [column.istartswith(term, autoescape=True) for column in prefix_columns]
+    condition = or_(false(), *matches, *prefix_matches)
+
+    if settings.DB_ENGINE == 'postgres':
+        rank = func.greatest(
+            *(func.word_similarity(term, column) for column in columns),
+            *(case((match, 1.0), else_=0.0) for match in prefix_matches)
+        )
+    else:
+        # SQLite has no trigram similarity, rank prefix matches of any column first
+        starts = [column.istartswith(term, autoescape=True) for column in columns]
+        rank = case((or_(false(), *starts, *prefix_matches), 1.0), else_=0.0)
+
+    return condition, cast(rank, Float)
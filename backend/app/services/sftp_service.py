@@ -1,103 +1,518 @@
+import base64
+import logging
 import posixpath
-from app.models import Course, Practice, PracticesUsersLink, PracticeFileInfo
-from app.utils import clean_filename, format_directory_name
-import paramiko
+import stat
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, contextmanager, suppress
+from dataclasses import dataclass, field
+from functools import cache
+from typing import TYPE_CHECKING, Any, NamedTuple
+
 from fastapi import UploadFile
-from app.core.config import settings
-from contextlib import contextmanager
 from fastapi.concurrency import run_in_threadpool
 
-@contextmanager
-def sftp_client():
+from app.core.config import settings
+from app.models import Course, Practice, PracticeFileInfo
+from app.utils import clean_filename, format_directory_name
+
+if TYPE_CHECKING:
+    import paramiko
+
+logger = logging.getLogger(__name__)
+
+# A connection idle for longer than this is checked with a round trip before being handed out
+SFTP_PING_AFTER_IDLE = 30
+# Bytes read from an upload per write, asyncssh sends each write as parallel requests
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Bytes requested per read when downloading, both libraries split it into pipelined requests
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+
+class RemoteEntry(NamedTuple):
+    name: str
+    size: int
+    is_dir: bool
+    mtime: int = 0
+
+@dataclass
+class _Connection:
+    # paramiko.Transport and SFTPClient, or asyncssh.SSHClientConnection and SFTPClient
+    transport: Any
+    sftp: Any
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+class _Pool:
+    """ Idle connections of one client library, the most recently used at the right """
+
+    def __init__(self):
+        self._idle: deque[_Connection] = deque()
+        # Shared by the threadpool threads (paramiko) and the event loop (asyncssh)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def take(self, now: float) -> tuple[_Connection | None, list[_Connection]]:
+        # Also hands back the connections idle for too long, for the caller to close
+        with self._lock:
+            expired = []
+            while self._idle and now - self._idle[0].last_used > settings.SFTP_POOL_IDLE_TIMEOUT:
+                expired.append(self._idle.popleft())
+            return (self._idle.pop() if self._idle else None), expired
+
+    def put(self, connection: _Connection) -> bool:
+        with self._lock:
+            if self._closed or len(self._idle) >= settings.SFTP_POOL_SIZE:
+                return False
+            self._idle.append(connection)
+            return True
+
+    def close(self) -> list[_Connection]:
+        with self._lock:
+            self._closed = True
+            connections = list(self._idle)
+            self._idle.clear()
+            return connections
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+_paramiko_pool = _Pool()
+_asyncssh_pool = _Pool()
+
+def _is_expired(connection: _Connection, now: float) -> bool:
+    return now - connection.created_at > settings.SFTP_POOL_MAX_LIFETIME
+
+# --- paramiko, blocking, used from the threadpool
+
+def _connect() -> _Connection:
+    # Imported on the first connection, most workers never open one
+    import paramiko
+
     transport = paramiko.Transport((settings.SFTP_HOST, settings.SFTP_PORT))
-    transport.connect(username=settings.SFTP_USER, pkey=settings.sftp_pkey)
-    sftp = paramiko.SFTPClient.from_transport(transport)
     try:
-        yield sftp
-    finally:
-        sftp.close()
+        transport.connect(username=settings.SFTP_USER, pkey=settings.sftp_pkey)
+        sftp = paramiko.SFTPClient.from_transport(transport)
+    except BaseException:
         transport.close()
+        raise
+    return _Connection(transport, sftp)
+
+def _disconnect(connection: _Connection) -> None:
+    # The connection may already be broken, closing it must not hide the caller's error
+    with suppress(Exception):
+        connection.sftp.close()
+    with suppress(Exception):
+        connection.transport.close()
+
+def _is_alive(connection: _Connection, now: float, ping: bool) -> bool:
+    if _is_expired(connection, now):
+        return False
+    if not connection.transport.is_active() or connection.sftp.sock.closed:
+        return False
+    if ping:
+        try:
+            connection.sftp.normalize(".")
+        except Exception:
+            return False
+    return True
+
+def _acquire() -> _Connection:
+    while True:
+        now = time.monotonic()
+        connection, expired = _paramiko_pool.take(now)
+        for stale in expired:
+            _disconnect(stale)
+        if connection is None:
+            return _connect()
+        if _is_alive(connection, now, ping=now - connection.last_used > SFTP_PING_AFTER_IDLE):
+            return connection
+        _disconnect(connection)
+
+def _release(connection: _Connection, failed: bool) -> None:
+    now = time.monotonic()
+    # After an error the session may be broken, it is checked before it is reused
+    if _is_alive(connection, now, ping=failed):
+        connection.last_used = now
+        if _paramiko_pool.put(connection):
+            return
+    _disconnect(connection)
+
+# --- asyncssh, on the event loop
+
+@cache
+def _asyncssh_available() -> bool:
+    try:
+        import asyncssh  # noqa: F401
+    except ImportError:
+        logger.warning("asyncssh is not installed, SFTP falls back to paramiko in the threadpool")
+        return False
+    return True
+
+def _use_asyncssh() -> bool:
+    return settings.SFTP_CLIENT == "asyncssh" and _asyncssh_available()
+
+@cache
+def _asyncssh_key() -> Any:
+    import asyncssh
+
+    try:
+        return asyncssh.import_private_key(base64.b64decode(settings.SFTP_KEY))
+    except (ValueError, asyncssh.KeyImportError) as e:
+        raise ValueError(f"Error loading SSH key: {str(e)}")
+
+async def _async_connect() -> _Connection:
+    import asyncssh
+
+    # Same trust as the paramiko Transport, which does not check the host key either
+    connection = await asyncssh.connect(
+        settings.SFTP_HOST,
+        port=settings.SFTP_PORT,
+        username=settings.SFTP_USER,
+        client_keys=[_asyncssh_key()],
+        known_hosts=None,
+        agent_path=None,
+    )
+    try:
+        sftp = await connection.start_sftp_client()
+    except BaseException:
+        connection.close()
+        raise
+    return _Connection(connection, sftp)
+
+async def _async_disconnect(connection: _Connection) -> None:
+    with suppress(Exception):
+        connection.sftp.exit()
+    with suppress(Exception):
+        connection.transport.close()
+        await connection.transport.wait_closed()
+
+async def _async_is_alive(connection: _Connection, now: float, ping: bool) -> bool:
+    if _is_expired(connection, now) or connection.transport.is_closed():
+        return False
+    if ping:
+        try:
+            await connection.sftp.realpath(".")
+        except Exception:
+            return False
+    return True
+
+async def _async_acquire() -> _Connection:
+    while True:
+        now = time.monotonic()
+        connection, expired = _asyncssh_pool.take(now)
+        for stale in expired:
+            await _async_disconnect(stale)
+        if connection is None:
+            return await _async_connect()
+        if await _async_is_alive(connection, now, ping=now - connection.last_used > SFTP_PING_AFTER_IDLE):
+            return connection
+        await _async_disconnect(connection)
+
+async def _async_release(connection: _Connection, failed: bool) -> None:
+    now = time.monotonic()
+    if await _async_is_alive(connection, now, ping=failed):
+        connection.last_used = now
+        if _asyncssh_pool.put(connection):
+            return
+    await _async_disconnect(connection)
+
+@contextmanager
+def _sftp_errors():
+    # asyncssh raises its own errors, callers expect the OSError subclasses paramiko raises
+    import asyncssh
+
+    try:
+        yield
+    except (asyncssh.SFTPNoSuchFile, asyncssh.SFTPNoSuchPath) as e:
+        raise FileNotFoundError(e.reason) from e
+    except asyncssh.SFTPPermissionDenied as e:
+        raise PermissionError(e.reason) from e
+    except asyncssh.SFTPFileAlreadyExists as e:
+        raise FileExistsError(e.reason) from e
+    except asyncssh.SFTPError as e:
+        raise OSError(e.reason) from e
+
+class AsyncSFTPClient(ABC):
+    """ File operations on the SFTP server for the event loop, failures are raised as OSError """
+
+    @abstractmethod
+    async def stat(self, path: str) -> RemoteEntry:
+        ...
+
+    @abstractmethod
+    async def listdir(self, path: str) -> list[RemoteEntry]:
+        ...
+
+    @abstractmethod
+    async def mkdir(self, path: str) -> None:
+        ...
+
+    @abstractmethod
+    async def remove(self, path: str) -> None:
+        ...
+
+    @abstractmethod
+    async def rmdir(self, path: str) -> None:
+        ...
+
+    @abstractmethod
+    async def rename(self, old_path: str, new_path: str) -> None:
+        ...
+
+    @abstractmethod
+    async def put(self, file: UploadFile, path: str) -> None:
+        ...
+
+    @abstractmethod
+    def read(self, path: str) -> AsyncIterator[bytes]:
+        # Chunks of DOWNLOAD_CHUNK_BYTES at most, the file is opened on the first one
+        ...
+
+class _AsyncsshSFTPClient(AsyncSFTPClient):
+    """ Native asyncio SFTP, no thread is held while waiting for the server """
+
+    def __init__(self, sftp: Any):
+        self._sftp = sftp
+
+    @staticmethod
+    def _entry(name: str, attrs: Any) -> RemoteEntry:
+        import asyncssh
+
+        return RemoteEntry(name, attrs.size or 0, attrs.type == asyncssh.FILEXFER_TYPE_DIRECTORY, attrs.mtime or 0)
+
+    async def stat(self, path: str) -> RemoteEntry:
+        with _sftp_errors():
+            return self._entry(posixpath.basename(path), await self._sftp.stat(path))
+
+    async def listdir(self, path: str) -> list[RemoteEntry]:
+        with _sftp_errors():
+            names = await self._sftp.readdir(path)
+        return [self._entry(name.filename, name.attrs) for name in names if name.filename not in (".", "..")]
+
+    async def mkdir(self, path: str) -> None:
+        with _sftp_errors():
+            await self._sftp.mkdir(path)
+
+    async def remove(self, path: str) -> None:
+        with _sftp_errors():
+            await self._sftp.remove(path)
+
+    async def rmdir(self, path: str) -> None:
+        with _sftp_errors():
+            await self._sftp.rmdir(path)
+
+    async def rename(self, old_path: str, new_path: str) -> None:
+        with _sftp_errors():
+            await self._sftp.rename(old_path, new_path)
+
+    async def put(self, file: UploadFile, path: str) -> None:
+        await file.seek(0)
+        with _sftp_errors():
+            async with self._sftp.open(path, "wb") as remote_file:
+                while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                    await remote_file.write(chunk)
+
+    async def read(self, path: str) -> AsyncIterator[bytes]:
+        with _sftp_errors():
+            async with self._sftp.open(path, "rb") as remote_file:
+                # Reads sized past the end of the file still send every parallel request, and one more read
+                # would be needed to see the end. With the size, a small file is a single request
+                size = (await remote_file.stat()).size or 0
+                offset = 0
+                while offset < size:
+                    chunk = await remote_file.read(min(DOWNLOAD_CHUNK_BYTES, size - offset))
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    yield chunk
+
+class _ParamikoSFTPClient(AsyncSFTPClient):
+    """ paramiko fallback, every operation holds a threadpool thread while it runs """
+
+    def __init__(self, sftp: "paramiko.SFTPClient"):
+        self._sftp = sftp
+
+    @staticmethod
+    def _entry(name: str, attrs: Any) -> RemoteEntry:
+        return RemoteEntry(name, attrs.st_size or 0, bool(attrs.st_mode and stat.S_ISDIR(attrs.st_mode)), attrs.st_mtime or 0)
+
+    @staticmethod
+    def _read_window(remote_file: "paramiko.SFTPFile", offset: int, size: int) -> bytes:
+        # readv prefetches only this window, prefetch() would buffer the whole file in memory
+        return next(remote_file.readv([(offset, size)]))
+
+    async def stat(self, path: str) -> RemoteEntry:
+        return self._entry(posixpath.basename(path), await run_in_threadpool(self._sftp.stat, path))
+
+    async def listdir(self, path: str) -> list[RemoteEntry]:
+        return [self._entry(attrs.filename, attrs) for attrs in await run_in_threadpool(self._sftp.listdir_attr, path)]
+
+    async def mkdir(self, path: str) -> None:
+        await run_in_threadpool(self._sftp.mkdir, path)
+
+    async def remove(self, path: str) -> None:
+        await run_in_threadpool(self._sftp.remove, path)
+
+    async def rmdir(self, path: str) -> None:
+        await run_in_threadpool(self._sftp.rmdir, path)
+
+    async def rename(self, old_path: str, new_path: str) -> None:
+        await run_in_threadpool(self._sftp.rename, old_path, new_path)
+
+    async def put(self, file: UploadFile, path: str) -> None:
+        file.file.seek(0)
+        await run_in_threadpool(self._sftp.putfo, file.file, path)
+
+    async def read(self, path: str) -> AsyncIterator[bytes]:
+        remote_file = await run_in_threadpool(self._sftp.open, path, "rb")
+        try:
+            size = (await run_in_threadpool(remote_file.stat)).st_size
+            offset = 0
+            while offset < size:
+                chunk = await run_in_threadpool(self._read_window, remote_file, offset, min(DOWNLOAD_CHUNK_BYTES, size - offset))
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            await run_in_threadpool(remote_file.close)
+
+@asynccontextmanager
+async def async_sftp_client() -> AsyncIterator[AsyncSFTPClient]:
+    """
+        Borrow an SFTP client for the event loop from the worker's pool: asyncssh when SFTP_CLIENT is
+        asyncssh and it is installed, paramiko in the threadpool otherwise
+        :return: SFTP client, only to be used inside the async with block
+    """
+    failed = False
+    if _use_asyncssh():
+        connection = await _async_acquire()
+        try:
+            yield _AsyncsshSFTPClient(connection.sftp)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            await _async_release(connection, failed)
+    else:
+        connection = await run_in_threadpool(_acquire)
+        try:
+            yield _ParamikoSFTPClient(connection.sftp)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            await run_in_threadpool(_release, connection, failed)
 
-def upload_file(sftp: paramiko.SFTPClient, file: UploadFile, remote_path: str):
-    file.file.seek(0)
-    sftp.putfo(file.file, remote_path)
+async def warm_up() -> None:
+    """
+        Open the SFTP_POOL_WARMUP first connections of the pool, so the first requests skip the handshake
+    """
+    count = min(settings.SFTP_POOL_WARMUP, settings.SFTP_POOL_SIZE)
+    use_asyncssh = _use_asyncssh()
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(await _async_connect() if use_asyncssh else await run_in_threadpool(_connect))
+    except Exception as e:
+        # The app still starts without the SFTP server, requests retry the connection
+        logger.warning(f"Could not warm up the SFTP pool: {str(e)}")
+    for connection in connections:
+        if use_asyncssh:
+            await _async_release(connection, failed=False)
+        else:
+            await run_in_threadpool(_release, connection, False)
+
+async def close_pool() -> None:
+    """
+        Close the idle connections, the ones in use are closed when returned
+    """
+    for connection in _asyncssh_pool.close():
+        await _async_disconnect(connection)
+    for connection in _paramiko_pool.close():
+        _disconnect(connection)
 
-def mkdir_p(sftp_client: paramiko.SFTPClient, path: str):
+# --- file operations
+
+async def upload_file(sftp: AsyncSFTPClient, file: UploadFile, remote_path: str):
+    await sftp.put(file, remote_path)
+
+async def mkdir_p(sftp_client: AsyncSFTPClient, path: str):
     if path in ('', '/'):
         return
-    
+
     try:
-        sftp_client.stat(path)
-    except IOError:
+        await sftp_client.stat(path)
+    except OSError:
         parent = posixpath.dirname(path)
         if parent != path:
-            mkdir_p(sftp_client, parent)
+            await mkdir_p(sftp_client, parent)
         try:
-            sftp_client.mkdir(path)
-        except IOError:
+            await sftp_client.mkdir(path)
+        except OSError:
             try:
-                sftp_client.stat(path)
-            except IOError:
+                await sftp_client.stat(path)
+            except OSError:
                 raise RuntimeError(f"Failed to create directory: {path}")
 
-def get_directory_files_info(sftp_client: paramiko.SFTPClient, directory_path: str) -> list[PracticeFileInfo]:
+async def get_directory_files_info(sftp_client: AsyncSFTPClient, directory_path: str) -> list[PracticeFileInfo]:
     """
     Get file information (name and size) from a directory via SFTP.
-    
+
     :param sftp_client: SFTP client
     :param directory_path: Path to the directory
     :return: List of PracticeFileInfo objects
     """
     files_info = []
-    
+
     try:
         # Check if directory exists
-        sftp_client.stat(directory_path)
-    except IOError:
+        await sftp_client.stat(directory_path)
+    except OSError:
         # Directory doesn't exist, return empty list
         return files_info
-    
+
     try:
         # List directory contents
-        items = sftp_client.listdir_attr(directory_path)
-        
+        items = await sftp_client.listdir(directory_path)
+
         for item in items:
             # Only include files (not directories)
-            if item.st_mode and not (item.st_mode & 0o170000) == 0o040000:
+            if not item.is_dir:
                 files_info.append(PracticeFileInfo(
-                    name=item.filename,
-                    size=item.st_size or 0
+                    name=item.name,
+                    size=item.size
                 ))
-        
+
         # Sort files by name for consistent ordering
         files_info.sort(key=lambda x: x.name.lower())
-        
-    except IOError as e:
+
+    except OSError as e:
         raise RuntimeError(f"Failed to read directory '{directory_path}': {str(e)}")
-    
+
     return files_info
 
 async def get_practice_correction_files_info(practice: Practice) -> list[PracticeFileInfo]:
     """
     Get correction files information for a practice asynchronously.
-    
+
     :param practice: Practice
     :return: List of PracticeFileInfo objects
     """
-    def _get_files_info():
-        # Build correction files path (professor files path)
-        correction_files_path = posixpath.join(
-            settings.PROFESSOR_FILES_PATH,
-            practice.course.academic_year,
-            format_directory_name(practice.course.name),
-            format_directory_name(practice.name)
-        )
-        
-        # Get files information via SFTP
-        with sftp_client() as sftp:
-            return get_directory_files_info(sftp, correction_files_path)
-    
-    return await run_in_threadpool(_get_files_info)
+    # Build correction files path (professor files path)
+    correction_files_path = posixpath.join(
+        settings.PROFESSOR_FILES_PATH,
+        practice.course.academic_year,
+        format_directory_name(practice.course.name),
+        format_directory_name(practice.name)
+    )
+
+    # Get files information via SFTP
+    async with async_sftp_client() as sftp:
+        return await get_directory_files_info(sftp, correction_files_path)
 
 async def replace_practice_files(course: Course, practice_name: str, files: list[UploadFile]):
     base_path = posixpath.join(
@@ -107,258 +522,233 @@ async def replace_practice_files(course: Course, practice_name: str, files: list
         format_directory_name(practice_name)
     )
 
-    def _replace_practice_files():
-        with sftp_client() as sftp:
-            try:
-                for file_attr in sftp.listdir_attr(base_path):
-                    full_path = posixpath.join(base_path, file_attr.filename)
-                    sftp.remove(full_path)
+    async with async_sftp_client() as sftp:
+        try:
+            for entry in await sftp.listdir(base_path):
+                full_path = posixpath.join(base_path, entry.name)
+                await sftp.remove(full_path)
 
-            except FileNotFoundError:
-                mkdir_p(sftp, base_path)
+        except FileNotFoundError:
+            await mkdir_p(sftp, base_path)
 
-            # Subir nuevos archivos
-            for file in files:
-                try:
-                    remote_path = posixpath.join(base_path, clean_filename(file.filename))
-                    upload_file(sftp, file, remote_path)
+        # Subir nuevos archivos
+        for file in files:
+            try:
+                remote_path = posixpath.join(base_path, clean_filename(file.filename))
+                await upload_file(sftp, file, remote_path)
 
-                except Exception as e:
-                    raise RuntimeError(f"Error uploading file '{file.filename}': {str(e)}")
-    
-    await run_in_threadpool(_replace_practice_files)
+            except Exception as e:
+                raise RuntimeError(f"Error uploading file '{file.filename}': {str(e)}")
 
-def rename_directory(sftp_client: paramiko.SFTPClient, old_path: str, new_path: str):
+async def rename_directory(sftp_client: AsyncSFTPClient, old_path: str, new_path: str):
     """
     Rename/move directory from old_path to new_path.
     First tries to rename, if that fails, creates new directory and moves contents.
-    
+
     :param sftp_client: SFTP client
     :param old_path: Current directory path
     :param new_path: New directory path
     """
     try:
         # Check if old directory exists
-        sftp_client.stat(old_path)
-    except IOError:
+        await sftp_client.stat(old_path)
+    except OSError:
         # Old directory doesn't exist, nothing to rename
         return
-    
+
     try:
         # Check if new directory already exists
-        sftp_client.stat(new_path)
+        await sftp_client.stat(new_path)
         raise RuntimeError(f"Target directory '{new_path}' already exists")
-    except IOError:
+    except OSError:
         # New directory doesn't exist, which is what we want
         pass
-    
+
     try:
         # Try to rename the directory directly
-        sftp_client.rename(old_path, new_path)
+        await sftp_client.rename(old_path, new_path)
         print(f"Successfully renamed directory from '{old_path}' to '{new_path}'")
-    except IOError:
+    except OSError:
         # Rename failed, manually move contents
         print(f"Direct rename failed, moving contents from '{old_path}' to '{new_path}'")
-        move_directory_contents(sftp_client, old_path, new_path)
+        await move_directory_contents(sftp_client, old_path, new_path)
 
-def move_directory_contents(sftp_client: paramiko.SFTPClient, source_dir: str, target_dir: str):
+async def move_directory_contents(sftp_client: AsyncSFTPClient, source_dir: str, target_dir: str):
     """
     Move all contents from source_dir to target_dir, then remove source_dir.
-    
+
     :param sftp_client: SFTP client
     :param source_dir: Source directory path
     :param target_dir: Target directory path
     """
     # Create target directory
-    mkdir_p(sftp_client, target_dir)
-    
+    await mkdir_p(sftp_client, target_dir)
+
     # List contents of source directory
     try:
-        items = sftp_client.listdir_attr(source_dir)
-    except IOError as e:
+        items = await sftp_client.listdir(source_dir)
+    except OSError as e:
         raise RuntimeError(f"Failed to list contents of '{source_dir}': {str(e)}")
-    
+
     # Move each item
     for item in items:
-        source_item = posixpath.join(source_dir, item.filename)
-        target_item = posixpath.join(target_dir, item.filename)
-        
+        source_item = posixpath.join(source_dir, item.name)
+        target_item = posixpath.join(target_dir, item.name)
+
         try:
-            if item.st_mode and (item.st_mode & 0o170000) == 0o040000:  # Directory
+            if item.is_dir:
                 # Recursively move directory
-                move_directory_contents(sftp_client, source_item, target_item)
+                await move_directory_contents(sftp_client, source_item, target_item)
             else:
                 # Move file
-                sftp_client.rename(source_item, target_item)
+                await sftp_client.rename(source_item, target_item)
                 print(f"Moved file: {source_item} -> {target_item}")
-        except IOError as e:
+        except OSError as e:
             raise RuntimeError(f"Failed to move '{source_item}' to '{target_item}': {str(e)}")
-    
+
     # Remove empty source directory
     try:
-        sftp_client.rmdir(source_dir)
+        await sftp_client.rmdir(source_dir)
         print(f"Removed empty directory: {source_dir}")
-    except IOError as e:
+    except OSError as e:
         print(f"Warning: Failed to remove source directory '{source_dir}': {str(e)}")
 
 async def rename_course_directories(old_course_name: str, new_course_name: str, academic_year: str, old_academic_year: str = None):
     """
     Rename course directories when course name or academic year changes.
-    
+
     :param old_course_name: Current course name
     :param new_course_name: New course name
     :param academic_year: New academic year
     :param old_academic_year: Current academic year (if changing)
     """
-    def _rename_directories():
-        with sftp_client() as sftp:
-            # Use old academic year if provided, otherwise use the new one
-            current_academic_year = old_academic_year if old_academic_year else academic_year
-            
-            # Professor files paths
-            old_p_path = posixpath.join(
-                settings.PROFESSOR_FILES_PATH, 
-                current_academic_year,
-                format_directory_name(old_course_name)
-            )
-            new_p_path = posixpath.join(
-                settings.PROFESSOR_FILES_PATH, 
-                academic_year,
-                format_directory_name(new_course_name)
-            )
-            
-            # Student files paths
-            old_a_path = posixpath.join(
-                settings.STUDENT_FILES_PATH, 
-                current_academic_year,
-                format_directory_name(old_course_name)
-            )
-            new_a_path = posixpath.join(
-                settings.STUDENT_FILES_PATH, 
-                academic_year,
-                format_directory_name(new_course_name)
-            )
-            
-            # Rename professor directory
-            try:
-                rename_directory(sftp, old_p_path, new_p_path)
-            except Exception as e:
-                raise Exception(f"Error renaming professor course directory: {str(e)}")
-            
-            # Rename student directory
-            try:
-                rename_directory(sftp, old_a_path, new_a_path)
-            except Exception as e:
-                raise Exception(f"Error renaming student course directory: {str(e)}")
-    
-    await run_in_threadpool(_rename_directories)
+    async with async_sftp_client() as sftp:
+        # Use old academic year if provided, otherwise use the new one
+        current_academic_year = old_academic_year if old_academic_year else academic_year
+
+        # Professor files paths
+        old_p_path = posixpath.join(
+            settings.PROFESSOR_FILES_PATH,
+            current_academic_year,
+            format_directory_name(old_course_name)
+        )
+        new_p_path = posixpath.join(
+            settings.PROFESSOR_FILES_PATH,
+            academic_year,
+            format_directory_name(new_course_name)
+        )
+
+        # Student files paths
+        old_a_path = posixpath.join(
+            settings.STUDENT_FILES_PATH,
+            current_academic_year,
+            format_directory_name(old_course_name)
+        )
+        new_a_path = posixpath.join(
+            settings.STUDENT_FILES_PATH,
+            academic_year,
+            format_directory_name(new_course_name)
+        )
+
+        # Rename professor directory
+        try:
+            await rename_directory(sftp, old_p_path, new_p_path)
+        except Exception as e:
+            raise Exception(f"Error renaming professor course directory: {str(e)}")
+
+        # Rename student directory
+        try:
+            await rename_directory(sftp, old_a_path, new_a_path)
+        except Exception as e:
+            raise Exception(f"Error renaming student course directory: {str(e)}")
 
 async def rename_practice_directories(old_practice_name: str, new_practice_name: str, course: Course):
     """
     Rename practice directories when practice name changes.
-    
+
     :param old_practice_name: Current practice name
     :param new_practice_name: New practice name
     :param course: Course object
     """
-    def _rename_directories():
-        with sftp_client() as sftp:
-            # Professor files path
-            old_p_path = posixpath.join(
-                settings.PROFESSOR_FILES_PATH, 
-                course.academic_year, 
-                format_directory_name(course.name), 
-                format_directory_name(old_practice_name)
-            )
-            new_p_path = posixpath.join(
-                settings.PROFESSOR_FILES_PATH, 
-                course.academic_year, 
-                format_directory_name(course.name), 
-                format_directory_name(new_practice_name)
-            )
-            
-            # Student files path
-            old_a_path = posixpath.join(
-                settings.STUDENT_FILES_PATH, 
-                course.academic_year, 
-                format_directory_name(course.name), 
-                format_directory_name(old_practice_name)
-            )
-            new_a_path = posixpath.join(
-                settings.STUDENT_FILES_PATH, 
-                course.academic_year, 
-                format_directory_name(course.name), 
-                format_directory_name(new_practice_name)
-            )
-            
-            # Rename professor directory
-            try:
-                rename_directory(sftp, old_p_path, new_p_path)
-            except Exception as e:
-                raise Exception(f"Error renaming professor directory: {str(e)}")
-            
-            # Rename student directory
-            try:
-                rename_directory(sftp, old_a_path, new_a_path)
-            except Exception as e:
-                raise Exception(f"Error renaming student directory: {str(e)}")
-    
-    await run_in_threadpool(_rename_directories)
+    async with async_sftp_client() as sftp:
+        # Professor files path
+        old_p_path = posixpath.join(
+            settings.PROFESSOR_FILES_PATH,
+            course.academic_year,
+            format_directory_name(course.name),
+            format_directory_name(old_practice_name)
+        )
+        new_p_path = posixpath.join(
+            settings.PROFESSOR_FILES_PATH,
+            course.academic_year,
+            format_directory_name(course.name),
+            format_directory_name(new_practice_name)
+        )
+
+        # Student files path
+        old_a_path = posixpath.join(
+            settings.STUDENT_FILES_PATH,
+            course.academic_year,
+            format_directory_name(course.name),
+            format_directory_name(old_practice_name)
+        )
+        new_a_path = posixpath.join(
+            settings.STUDENT_FILES_PATH,
+            course.academic_year,
+            format_directory_name(course.name),
+            format_directory_name(new_practice_name)
+        )
+
+        # Rename professor directory
+        try:
+            await rename_directory(sftp, old_p_path, new_p_path)
+        except Exception as e:
+            raise Exception(f"Error renaming professor directory: {str(e)}")
+
+        # Rename student directory
+        try:
+            await rename_directory(sftp, old_a_path, new_a_path)
+        except Exception as e:
+            raise Exception(f"Error renaming student directory: {str(e)}")
 
 async def create_practice_directories_and_upload_files(course: Course, practice_name: str, files: list[UploadFile]):
     p_path = posixpath.join(settings.PROFESSOR_FILES_PATH, course.academic_year, format_directory_name(course.name), format_directory_name(practice_name))
     a_path = posixpath.join(settings.STUDENT_FILES_PATH, course.academic_year, format_directory_name(course.name), format_directory_name(practice_name))
 
-    def _create_practice_directories_and_upload_files():
-        with sftp_client() as sftp:
-            mkdir_p(sftp, p_path)
-            mkdir_p(sftp, a_path)
+    async with async_sftp_client() as sftp:
+        await mkdir_p(sftp, p_path)
+        await mkdir_p(sftp, a_path)
 
-            for file in files:
-                remote_file_path = posixpath.join(p_path, clean_filename(file.filename))
-                upload_file(sftp, file, remote_file_path)
+        for file in files:
+            remote_file_path = posixpath.join(p_path, clean_filename(file.filename))
+            await upload_file(sftp, file, remote_file_path)
 
-    await run_in_threadpool(_create_practice_directories_and_upload_files)
+async def rm_rf(sftp: AsyncSFTPClient, path: str):
+    # Check if path exists
+    try:
+        await sftp.stat(path)
+    except OSError:
+        # Path doesn't exist, nothing to do
+        return
+
+    # First remove all files and subdirectories recursively
+    for entry in await sftp.listdir(path):
+        entry_path = posixpath.join(path, entry.name)
+        try:
+            if entry.is_dir:
+                await rm_rf(sftp, entry_path)
+            else:
+                await sftp.remove(entry_path)
+        except OSError:
+            pass
 
-def rm_rf(path):
+    # Then remove the directory itself
+    await sftp.rmdir(path)
+
+async def remove_recursive_diretory(path: str):
     try:
-        with sftp_client() as sftp:
-            # Check if path exists
-            try:
-                sftp.stat(path)
-            except IOError:
-                # Path doesn't exist, nothing to do
-                return
-            
-            # List all files and directories in the current path
-            files = sftp.listdir(path)
-            
-            # First remove all files and subdirectories recursively
-            for f in files:
-                filepath = posixpath.join(path, f)
-                try:
-                    # Check if it's a directory
-                    sftp.stat(filepath).st_mode
-                    # If we get here, it's a file or directory
-                    try:
-                        # Try to remove as file
-                        sftp.remove(filepath)
-                    except IOError:
-                        # If not a file, it's a directory - remove recursively
-                        rm_rf(sftp, filepath)
-                except IOError:
-                    # Error stating the file, just try to remove it
-                    try:
-                        sftp.remove(filepath)
-                    except IOError:
-                        pass
-            
-            # Then remove the directory itself
-            sftp.rmdir(path)
-            
+        async with async_sftp_client() as sftp:
+            await rm_rf(sftp, path)
     except Exception as e:
         # Log the error but continue with the database deletion
         print(f"Error removing remote directory {path}: {str(e)}")
-
-async def remove_recursive_diretory(path: str):
-    await run_in_threadpool(rm_rf, path)
\ No newline at end of file
@@ -0,0 +1,226 @@
+import uuid
+from collections.abc import Iterable, Sequence
+from datetime import date, datetime
+from typing import NamedTuple
+
+from sqlalchemy import exists
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import (
+    CourseRoleEnum,
+    CoursesUsersLink,
+    Practice,
+    PracticeStatistics,
+    PracticeStatisticsPublic,
+    PracticesUsersLink,
+    StatusEnum,
+    SubmissionsPerDay,
+)
+
+# Column of PracticeStatistics counting the links in each status
+STATUS_COLUMNS = {
+    StatusEnum.NOT_SUBMITTED: "not_submitted",
+    StatusEnum.SUBMITTED: "submitted",
+    StatusEnum.CORRECTING: "correcting",
+    StatusEnum.CORRECTED: "corrected",
+    StatusEnum.REJECTED: "rejected",
+}
+
+
+class LinkState(NamedTuple):
+    """ The fields of a practice link the statistics are built from """
+    practice_id: uuid.UUID
+    status: StatusEnum
+    grade: float | None = None
+    submission_date: datetime | None = None
+
+
+def link_state(link: PracticesUsersLink) -> LinkState:
+    grade = link.correction.get("grade") if link.correction else None
+    return LinkState(link.practice_id, link.status, grade, link.submission_date)
+
+
+def has_course_role(role: CourseRoleEnum) -> ColumnElement[bool]:
+    """
+        Condition on PracticesUsersLink, true when its user has the role in the course of its practice.
+        Only the links of students are counted
+        :param role: role in the course
+        :return: condition for a statement on PracticesUsersLink
+    """
+    return exists().where(
+        Practice.id == PracticesUsersLink.practice_id,
+        CoursesUsersLink.course_id == Practice.course_id,
+        CoursesUsersLink.user_niub == PracticesUsersLink.user_niub,
+        CoursesUsersLink.role == role
+    ).correlate(PracticesUsersLink)
+
+
+async def is_counted(session: AsyncSession, link: PracticesUsersLink) -> bool:
+    """
+        Whether the statistics count a link, teachers are linked to the practices of their courses too
+        :param session: database session
+        :param link: practice link
+        :return: True when the user of the link is a student of the course
+    """
+    role = (await session.exec(
+        select(CoursesUsersLink.role).join(Practice, Practice.course_id == CoursesUsersLink.course_id).where(
+            Practice.id == link.practice_id,
+            CoursesUsersLink.user_niub == link.user_niub
+        )
+    )).first()
+    return role == CourseRoleEnum.STUDENT
+
+
+async def link_states(session: AsyncSession, *conditions: ColumnElement[bool]) -> list[LinkState]:
+    """
+        Read the states of the links matching some conditions
+        :param session: database session
+        :param conditions: conditions on PracticesUsersLink
+        :return: state of each link
+    """
+    statement = select(
+        PracticesUsersLink.practice_id,
+        PracticesUsersLink.status,
+        PracticesUsersLink.correction["grade"].as_float(),
+        PracticesUsersLink.submission_date
+    ).where(*conditions)
+    return [LinkState(*row) for row in (await session.exec(statement)).all()]
+
+
+def _grade_key(grade: float) -> str:
+    # Same text as PostgreSQL's float8 output, used by the migration that filled the table.
+    # The correction worker keeps a copy, app/tests/services/test_statistics_service.py pins it to this one
+    return repr(float(grade)).removesuffix(".0")
+
+
+def _add(counts: dict[str, int], key: str, sign: int) -> dict[str, int]:
+    # A new dict, so the JSON column is flagged as modified
+    counts = dict(counts)
+    counts[key] = counts.get(key, 0) + sign
+    if counts[key] <= 0:
+        del counts[key]
+    return counts
+
+
+def _count(statistics: PracticeStatistics, state: LinkState, sign: int) -> None:
+    column = STATUS_COLUMNS[state.status]
+    setattr(statistics, column, getattr(statistics, column) + sign)
+    if state.status == StatusEnum.CORRECTED and state.grade is not None:
+        statistics.graded += sign
+        statistics.grade_sum += sign * state.grade
+        statistics.grades = _add(statistics.grades, _grade_key(state.grade), sign)
+    if state.submission_date is not None:
+        statistics.submissions = _add(statistics.submissions, state.submission_date.date().isoformat(), sign)
+
+
+async def _build(session: AsyncSession, practice_id: uuid.UUID) -> PracticeStatistics:
+    # Only for practices that have no row yet, the links already include the pending changes (autoflush)
+    statistics = PracticeStatistics(practice_id=practice_id)
+    states = await link_states(
+        session,
+        PracticesUsersLink.practice_id == practice_id,
+        has_course_role(CourseRoleEnum.STUDENT)
+    )
+    for state in states:
+        _count(statistics, state, 1)
+    return statistics
+
+
+async def _get_or_build(
+    session: AsyncSession,
+    practice_ids: Iterable[uuid.UUID],
+    *,
+    lock: bool
+) -> tuple[dict[uuid.UUID, PracticeStatistics], set[uuid.UUID]]:
+    # Rows are locked in a fixed order so concurrent writers can't deadlock
+    practice_ids = sorted(set(practice_ids))
+    statement = select(PracticeStatistics).where(
+        PracticeStatistics.practice_id.in_(practice_ids)
+    ).order_by(PracticeStatistics.practice_id)
+    if lock:
+        statement = statement.with_for_update()
+    statistics = {row.practice_id: row for row in (await session.exec(statement)).all()}
+
+    built = set()
+    for practice_id in practice_ids:
+        if practice_id not in statistics:
+            statistics[practice_id] = await _build(session, practice_id)
+            built.add(practice_id)
+    return statistics, built
+
+
+def add_practice(session: AsyncSession, *, practice_id: uuid.UUID) -> None:
+    """
+        Add the empty statistics of a new practice, before its links are recorded
+        :param session: database session where the practice was written, the caller commits
+        :param practice_id: id of the new practice
+    """
+    session.add(PracticeStatistics(practice_id=practice_id))
+
+
+async def record(session: AsyncSession, *, removed: Iterable[LinkState] = (), added: Iterable[LinkState] = ()) -> None:
+    """
+        Update the statistics of the practices after the links of students changed, a status change removes
+        the previous state of the link and adds the new one. Links of teachers are not counted
+        :param session: database session where the links were written, the caller commits
+        :param removed: states of the links before the change, or of the deleted links
+        :param added: states of the links after the change, or of the new links
+    """
+    removed, added = list(removed), list(added)
+    if not removed and not added:
+        return
+
+    statistics, built = await _get_or_build(session, [state.practice_id for state in [*removed, *added]], lock=True)
+    for practice_id in built:
+        session.add(statistics[practice_id])
+    for sign, states in ((-1, removed), (1, added)):
+        for state in states:
+            # A row just built from the links already counts the change
+            if state.practice_id not in built:
+                _count(statistics[state.practice_id], state, sign)
+
+
+def _median(grades: dict[str, int]) -> float | None:
+    total = sum(grades.values())
+    if not total:
+        return None
+    values = sorted((float(grade), count) for grade, count in grades.items())
+
+    def nth(position: int) -> float:
+        for grade, count in values:
+            if position < count:
+                return grade
+            position -= count
+
+    if total % 2:
+        return nth(total // 2)
+    return (nth(total // 2 - 1) + nth(total // 2)) / 2
+
+
+def _public(practice: Practice, statistics: PracticeStatistics) -> PracticeStatisticsPublic:
+    return PracticeStatisticsPublic(
+        practice_id=practice.id,
+        name=practice.name,
+        status_counts={status: getattr(statistics, column) for status, column in STATUS_COLUMNS.items()},
+        graded=statistics.graded,
+        grade_mean=statistics.grade_sum / statistics.graded if statistics.graded else None,
+        grade_median=_median(statistics.grades),
+        submissions=[
+            SubmissionsPerDay(day=date.fromisoformat(day), count=count)
+            for day, count in sorted(statistics.submissions.items())
+        ]
+    )
+
+
+async def get_statistics(session: AsyncSession, *, practices: Sequence[Practice]) -> list[PracticeStatisticsPublic]:
+    """
+        Read the statistics of some practices. Every practice gets its row when it is created, or from the
+        migration that added the table, a missing one is computed from the links without being stored
+        :param session: database session, only read from
+        :param practices: practices to read, in the order to return them
+        :return: statistics of each practice
+    """
+    statistics, _ = await _get_or_build(session, [practice.id for practice in practices], lock=False)
+    return [_public(practice, statistics[practice.id]) for practice in practices]
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import psycopg
+from sqlalchemy import make_url, text
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL channel on which every worker announces the users it changed
+CHANNEL = "golem_user_cache"
+LISTEN_RETRY_SECONDS = 5
+
+# Authenticated users by niub: niub -> (expiry, detached snapshot), least recently used first
+_cache: OrderedDict[str, tuple[float, User]] = OrderedDict()
+# Whether the changes of the other workers reach this one, users are only cached then. Otherwise a
+# deleted user or a revoked role would keep working on the other workers until the entry expires
+_listening = False
+
+
+def _snapshot(user: User) -> User:
+    # A detached copy, never attached to any session, so requests running at the same time can share it
+    snapshot = User(**user.model_dump())
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+async def get_user(session: AsyncSession, niub: str) -> User | None:
+    """
+        Resolve a user by niub, from the cache when a fresh snapshot is available
+        :param session: database session of the request
+        :param niub: token subject
+        :return: user attached to the session, None if it does not exist
+    """
+    caching = settings.CURRENT_USER_CACHE_TTL > 0 and _listening
+    if caching:
+        cached = _cache.get(niub)
+        if cached:
+            expires_at, snapshot = cached
+            if expires_at > time.monotonic():
+                _cache.move_to_end(niub)
+                # Attaching the snapshot with load=False emits no SQL
+                return await session.merge(snapshot, load=False)
+            del _cache[niub]
+
+    user = await session.get(User, niub)
+    if user and caching:
+        _cache[niub] = (time.monotonic() + settings.CURRENT_USER_CACHE_TTL, _snapshot(user))
+        if len(_cache) > settings.CURRENT_USER_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return user
+
+
+async def invalidate(session: AsyncSession, niub: str) -> None:
+    """
+        Drop a user from the cache of every worker, call it once the change is committed
+        :param session: database session
+        :param niub: niub of the updated or deleted user
+    """
+    _cache.pop(niub, None)
+    if settings.DB_ENGINE == 'postgres':
+        await session.exec(text("SELECT pg_notify(:channel, :niub)"), params={"channel": CHANNEL, "niub": niub})
+        await session.commit()
+
+
+async def listen() -> None:
+    """Drop the users announced by the other workers, until cancelled."""
+    global _listening
+    conninfo = make_url(str(settings.SQLALCHEMY_DATABASE_URI)).set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {CHANNEL}")
+                # Changes announced while disconnected were missed
+                _cache.clear()
+                _listening = True
+                async for notify in conn.notifies():
+                    _cache.pop(notify.payload, None)
+        except psycopg.Error as e:
+            logger.warning(f"User cache invalidation channel lost, retrying: {str(e)}")
+        finally:
+            _listening = False
+            _cache.clear()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
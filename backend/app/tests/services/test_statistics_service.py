@@ -0,0 +1,49 @@
+import json
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+from app.models import PracticeStatistics, StatusEnum
+from app.services import statistics_service
+from app.services.statistics_service import LinkState
+
+WORKER_PATH = Path(__file__).resolve().parents[4] / "practice_correction_queue_worker"
+
+GRADES = [0, 5, 7.5, 10, 10.0, 3.25, 6.1, 0.1 + 0.2, 1e-7, 1e16, -0.0]
+
+# Run in the worker's own interpreter state, both packages declare the same tables
+WORKER_SCRIPT = """
+import json, sys
+from models import PracticeStatistics, StatusEnum
+from services.statistics_service import _count, _grade_key
+
+grades = json.loads(sys.argv[1])
+statistics = PracticeStatistics(practice_id="00000000-0000-0000-0000-000000000000")
+for grade in grades:
+    _count(statistics, StatusEnum.CORRECTED, grade, 1)
+_count(statistics, StatusEnum.CORRECTED, grades[0], -1)
+print(json.dumps({"keys": [_grade_key(grade) for grade in grades], "grades": statistics.grades}))
+"""
+
+
+def _worker_buckets() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER_SCRIPT, json.dumps(GRADES)],
+        cwd=WORKER_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def test_worker_grade_buckets_match_backend() -> None:
+    statistics = PracticeStatistics(practice_id=uuid.uuid4())
+    for grade in GRADES:
+        statistics_service._count(statistics, LinkState(statistics.practice_id, StatusEnum.CORRECTED, grade), 1)
+    statistics_service._count(statistics, LinkState(statistics.practice_id, StatusEnum.CORRECTED, GRADES[0]), -1)
+
+    worker = _worker_buckets()
+    assert worker["keys"] == [statistics_service._grade_key(grade) for grade in GRADES]
+    assert worker["grades"] == statistics.grades
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.models import User
+from app.services import user_cache_service
+
+
+class _Session:
+    """ Counts the users read from the database """
+
+    def __init__(self, user: User):
+        self.user = user
+        self.reads = 0
+
+    async def get(self, model: type[User], niub: str) -> User:
+        self.reads += 1
+        return self.user
+
+    async def merge(self, user: User, load: bool = True) -> User:
+        return user
+
+
+@pytest.fixture
+def session(monkeypatch: pytest.MonkeyPatch) -> _Session:
+    monkeypatch.setattr(settings, "CURRENT_USER_CACHE_TTL", 60)
+    monkeypatch.setattr(user_cache_service, "_cache", type(user_cache_service._cache)())
+    return _Session(User(niub="STUD00000000", email="s@example.com", name="S", surnames="D", hashed_password="x"))
+
+
+def _get_twice(session: _Session) -> None:
+    for _ in range(2):
+        user = asyncio.run(user_cache_service.get_user(session, "STUD00000000"))  # type: ignore[arg-type]
+        assert user.niub == "STUD00000000"
+
+
+def test_get_user_bypasses_cache_when_not_listening(session: _Session, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(user_cache_service, "_listening", False)
+    _get_twice(session)
+    assert session.reads == 2
+    assert not user_cache_service._cache
+
+
+def test_get_user_caches_when_listening(session: _Session, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(user_cache_service, "_listening", True)
+    _get_twice(session)
+    assert session.reads == 1
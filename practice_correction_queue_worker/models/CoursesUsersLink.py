@@ -0,0 +1,14 @@
+from sqlmodel import Field, Column, Enum
+
+from sqlmodel import SQLModel
+import uuid
+import enum
+
+class CourseRoleEnum(str, enum.Enum):
+    STUDENT = "student"
+    TEACHER = "teacher"
+
+class CoursesUsersLink(SQLModel, table=True):
+    user_niub: str | None = Field(default=None, foreign_key="user.niub", primary_key=True)
+    course_id: uuid.UUID | None = Field(default=None, foreign_key="course.id", primary_key=True)
+    role: CourseRoleEnum = Field(default=CourseRoleEnum.STUDENT, sa_column=Column(Enum(CourseRoleEnum), nullable=False, server_default='STUDENT'))
@@ -0,0 +1,16 @@
+from sqlmodel import Field, JSON
+
+from sqlmodel import SQLModel
+import uuid
+
+class PracticeStatistics(SQLModel, table=True):
+    practice_id: uuid.UUID = Field(foreign_key="practice.id", primary_key=True, ondelete="CASCADE")
+    not_submitted: int = 0
+    submitted: int = 0
+    correcting: int = 0
+    corrected: int = 0
+    rejected: int = 0
+    graded: int = 0
+    grade_sum: float = 0
+    grades: dict[str, int] = Field(default_factory=dict, sa_type=JSON)
+    submissions: dict[str, int] = Field(default_factory=dict, sa_type=JSON)
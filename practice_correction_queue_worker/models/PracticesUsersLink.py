@@ -1,4 +1,4 @@
-from sqlmodel import Field, Column, Enum
+from sqlmodel import Field, Column, Enum, func
 
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import SQLModel
@@ -20,4 +20,7 @@ class PracticesUsersLink(SQLModel, table=True):
     status: StatusEnum = Field(default=StatusEnum.NOT_SUBMITTED, sa_column=Column(Enum(StatusEnum), nullable=False, server_default='NOT_SUBMITTED'))
     submission_file_name: str | None = Field(default=None)
     correction: dict | None = Field(default=None, sa_type=JSONB)
+    # Version stamp of the backend ETags, must move on every status change. The time of the statement,
+    # now() is the start of the transaction
+    updated_at: datetime | None = Field(default=None, nullable=False, sa_column_kwargs={"server_default": func.now(), "onupdate": func.clock_timestamp()})
 
@@ -1,3 +1,5 @@
 from .practice import *
 from .user import *
-from .PracticesUsersLink import *
\ No newline at end of file
+from .PracticesUsersLink import *
+from .CoursesUsersLink import *
+from .PracticeStatistics import *
\ No newline at end of file
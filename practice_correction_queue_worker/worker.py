@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlmodel import select
 from models import Practice, PracticesUsersLink, StatusEnum
 from services.rpc_client import AsyncRpcClient
+from services import statistics_service
 from core.db import engine
 from core.config import settings
 from core.logging_config import configure_logging
@@ -61,20 +62,23 @@ class PracticeCorrectionQueueWorker:
         """Separate method to update practice status with independent DB session"""
         try:
             async with self.get_db() as db_session:
+                # Locked until the commit, so a concurrent change can't move the link from the same previous status twice
                 practice_user = await db_session.execute(
                     select(PracticesUsersLink).where(
                         PracticesUsersLink.user_niub == niub,
                         PracticesUsersLink.practice_id == practice_id
-                    )
+                    ).with_for_update()
                 )
                 practice_user = practice_user.scalar_one_or_none()
                 
                 if practice_user:
+                    previous_status, previous_grade = practice_user.status, statistics_service.get_grade(practice_user)
                     practice_user.status = status
                     if correction is not None:
                         practice_user.correction = correction
                     
                     db_session.add(practice_user)
+                    await statistics_service.record_status_change(db_session, practice_user, previous_status, previous_grade)
                     await db_session.commit()
                     await db_session.refresh(practice_user)
                     logger.info(f"Updated practice {practice_id} status to {status.value} for NIUB {niub}")